@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Сигналы кэша токенов, ленты подписок, списков покупок,
+        # состояния пользователей, ссылок на медиафайлы и номеров
+        # изменений рецептов; проверка базы для api.relations.
+        from api import (authentication, feed, interactions,  # noqa: F401
+                         relations, shopping_list, storage, sync)
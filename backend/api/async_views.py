@@ -0,0 +1,228 @@
+"""
+Асинхронные представления для горячих GET-эндпоинтов.
+
+Список и карточка рецепта, теги, ингредиенты и переход по короткой
+ссылке читаются через асинхронный ORM и не занимают поток воркера
+на время запросов к базе; остальные методы тех же адресов передаются
+синхронным вьюсетам. Ответ строят сериализаторы вьюсетов, поэтому
+форма ответов у обоих путей одна.
+
+Выигрыш есть только под ASGI: Dockerfile запускает gunicorn с
+воркерами uvicorn и foodgram.asgi. Под WSGI каждое представление
+выполнялось бы через async_to_sync.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.paginator import InvalidPage, Paginator
+from django.http import HttpResponseRedirect, JsonResponse
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed, NotFound
+from rest_framework.authtoken.models import Token
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from api.authentication import get_cached_user, set_cached_user
+from api.filters import filter_ingredients, filter_recipes
+from api.metrics import record_cache
+from api.middleware import serializing
+from api.pagination import CustomPagination
+from api.serializers import (IngredientSerializer, RecipeDetailSerializer,
+                             RecipesInfoSerializer, TagSerializer,
+                             with_recipe_info)
+from api.views import short_links_storage
+from recipes.models import Ingredient, Recipes, Tag
+
+
+def method_dispatch(async_view, sync_view):
+    """
+    GET и HEAD обслуживает async_view, остальные методы —
+    синхронный вьюсет DRF через sync_to_async.
+    """
+    sync_view = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            return await async_view(request, *args, **kwargs)
+        return await sync_view(request, *args, **kwargs)
+
+    # csrf_exempt в Django 4.2 превращает корутину в обычную функцию.
+    view.csrf_exempt = True
+    return view
+
+
+def json_response(data, status=200):
+    """JSON без экранирования кириллицы, как у JSONRenderer."""
+    return JsonResponse(
+        data, status=status, safe=False,
+        json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')}
+    )
+
+
+def error_response(exception):
+    """Ответ об ошибке в формате обработчика исключений DRF."""
+    response = json_response(
+        {'detail': str(exception.detail)}, status=exception.status_code
+    )
+    if isinstance(exception, AuthenticationFailed):
+        response['WWW-Authenticate'] = 'Token'
+    return response
+
+
+async def authenticate(request):
+    """Асинхронный аналог CachedTokenAuthentication."""
+    header = request.headers.get('Authorization', '').split()
+    if not header or header[0] != 'Token':
+        return AnonymousUser()
+    if len(header) != 2:
+        raise AuthenticationFailed(_('Invalid token header.'))
+    # Общий кэш токенов по умолчанию файловый: чтение и запись —
+    # в потоке, а не в цикле событий.
+    user = await sync_to_async(get_cached_user)(header[1])
+    if user is None:
+        try:
+            token = await Token.objects.select_related('user').aget(
+                key=header[1]
+            )
+        except Token.DoesNotExist:
+            raise AuthenticationFailed(_('Invalid token.'))
+        user = token.user
+        await sync_to_async(set_cached_user)(header[1], user)
+    if not user.is_active:
+        raise AuthenticationFailed(_('User inactive or deleted.'))
+    return user
+
+
+def serialize(serializer_class, request, user, instance, many=False):
+    """
+    Данные сериализатора вьюсета: форма ответа одна для синхронных и
+    асинхронных представлений. Вызывается через sync_to_async: флаги
+    пользователя читаются из api.interactions, остальные связи должны
+    быть загружены заранее (with_recipe_info).
+    """
+    request.user = user
+    with serializing(request):
+        return serializer_class(
+            instance, many=many, context={'request': request}
+        ).data
+
+
+def page_size(request):
+    """Размер страницы по правилам CustomPagination."""
+    pagination = CustomPagination
+    try:
+        size = int(request.GET[pagination.page_size_query_param])
+    except (KeyError, ValueError):
+        return pagination.page_size
+    if size <= 0:
+        return pagination.page_size
+    return min(size, pagination.max_page_size)
+
+
+async def recipe_list(request):
+    """GET /api/recipes/ с пагинацией CustomPagination."""
+    try:
+        user = await authenticate(request)
+    except AuthenticationFailed as error:
+        return error_response(error)
+    queryset = filter_recipes(Recipes.objects.all(), request.GET, user)
+    paginator = Paginator(queryset, page_size(request))
+    paginator.count = await queryset.acount()
+    try:
+        number = request.GET.get('page', 1)
+        if number == 'last':
+            number = paginator.num_pages
+        page = paginator.page(number)
+    except InvalidPage:
+        return error_response(NotFound(_('Invalid page.')))
+    recipes = [
+        recipe async for recipe in with_recipe_info(queryset)[
+            page.start_index() - 1:page.end_index()
+        ]
+    ] if paginator.count else []
+    url = request.build_absolute_uri()
+    next_link = previous_link = None
+    if page.has_next():
+        next_link = replace_query_param(url, 'page', page.next_page_number())
+    if page.has_previous():
+        number = page.previous_page_number()
+        previous_link = (
+            remove_query_param(url, 'page') if number == 1
+            else replace_query_param(url, 'page', number)
+        )
+    return json_response({
+        'count': paginator.count,
+        'next': next_link,
+        'previous': previous_link,
+        'results': await sync_to_async(serialize)(
+            RecipesInfoSerializer, request, user, recipes, many=True
+        ),
+    })
+
+
+async def recipe_detail(request, pk):
+    """GET /api/recipes/<pk>/ как RecipesViewSet.retrieve."""
+    try:
+        user = await authenticate(request)
+    except AuthenticationFailed as error:
+        return error_response(error)
+    queryset = filter_recipes(Recipes.objects.all(), request.GET, user)
+    try:
+        recipe = await with_recipe_info(queryset).aget(pk=pk)
+    except Recipes.DoesNotExist:
+        return error_response(NotFound())
+    return json_response(await sync_to_async(serialize)(
+        RecipeDetailSerializer, request, user, recipe
+    ))
+
+
+def simple_views(model, serializer_class, filter_queryset=None):
+    """
+    Список и карточка справочника (теги, ингредиенты); список
+    фильтрует filter_queryset(queryset, request.GET), как у вьюсета.
+    """
+
+    async def list_view(request):
+        try:
+            await authenticate(request)
+        except AuthenticationFailed as error:
+            return error_response(error)
+        queryset = model.objects.all()
+        if filter_queryset is not None:
+            queryset = filter_queryset(queryset, request.GET)
+        objects = [obj async for obj in queryset]
+        with serializing(request):
+            data = serializer_class(objects, many=True).data
+        return json_response(data)
+
+    async def detail_view(request, pk):
+        try:
+            await authenticate(request)
+        except AuthenticationFailed as error:
+            return error_response(error)
+        try:
+            obj = await model.objects.aget(pk=pk)
+        except model.DoesNotExist:
+            return error_response(NotFound())
+        with serializing(request):
+            data = serializer_class(obj).data
+        return json_response(data)
+
+    return list_view, detail_view
+
+
+tag_list, tag_detail = simple_views(Tag, TagSerializer)
+ingredient_list, ingredient_detail = simple_views(
+    Ingredient, IngredientSerializer, filter_ingredients
+)
+
+
+async def redirect_short_link(request, short_link):
+    """Переход по короткой ссылке на страницу рецепта."""
+    found = short_link in short_links_storage
+    record_cache('short_links', found)
+    if not found:
+        return json_response(
+            {'ERROR': 'Неверный формат короткой ссылки.'}, status=400
+        )
+    return HttpResponseRedirect(request.build_absolute_uri(
+        f'/recipes/{short_links_storage[short_link]}/'
+    ))
@@ -0,0 +1,143 @@
+"""
+Аутентификация по токену с кэшем пользователя.
+
+Пара токен → пользователь хранится в общем для всех воркеров кэше
+TOKEN_CACHE['CACHE'] на TTL секунд и в памяти процесса на LOCAL_TTL
+секунд, так что авторизованные запросы не обращаются к базе за
+токеном. Кэш процесса — LRU не больше LOCAL_MAX_SIZE записей:
+просроченная запись удаляется при чтении, самая давняя — при
+переполнении. Запись общего кэша сбрасывается при выходе, удалении
+токена, смене пароля и изменении пользователя — сразу и еще раз после
+фиксации транзакции, чтобы параллельный запрос не вернул в кэш старые
+данные. В памяти других процессов запись живет не дольше LOCAL_TTL.
+"""
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from api.metrics import record_cache
+from recipes.models import User
+
+
+local_cache = OrderedDict()
+local_lock = threading.Lock()
+
+
+def get_config():
+    """Настройки TOKEN_CACHE."""
+    return getattr(settings, 'TOKEN_CACHE', {})
+
+
+def cache_key(key):
+    """Ключ кэша по хешу токена, сам токен в кэш не попадает."""
+    return 'auth-token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_cached_user(key):
+    """Пользователь по токену из кэша или None."""
+    config = get_config()
+    if not config.get('ENABLED', False):
+        return None
+    name = cache_key(key)
+    with local_lock:
+        entry = local_cache.get(name)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                local_cache.move_to_end(name)
+            else:
+                del local_cache[name]
+                entry = None
+    if entry is not None:
+        record_cache('auth_tokens', True)
+        # Копия, чтобы запросы не делили один изменяемый объект.
+        return copy.copy(entry[1])
+    user = caches[config.get('CACHE', 'default')].get(name)
+    record_cache('auth_tokens', user is not None)
+    if user is not None:
+        remember_locally(name, user, config)
+    return user
+
+
+def remember_locally(name, user, config):
+    """Кладет пользователя в кэш процесса, вытесняя самые давние."""
+    with local_lock:
+        local_cache[name] = (
+            time.monotonic() + config.get('LOCAL_TTL', 5), copy.copy(user)
+        )
+        local_cache.move_to_end(name)
+        while len(local_cache) > config.get('LOCAL_MAX_SIZE', 1000):
+            local_cache.popitem(last=False)
+
+
+def set_cached_user(key, user):
+    """Кладет пользователя в общий кэш и в кэш процесса."""
+    config = get_config()
+    if not config.get('ENABLED', False):
+        return
+    name = cache_key(key)
+    caches[config.get('CACHE', 'default')].set(
+        name, user, config.get('TTL', 300)
+    )
+    remember_locally(name, user, config)
+
+
+def invalidate_token(key):
+    """Сбрасывает кэш одного токена: сразу и после фиксации."""
+    name = cache_key(key)
+
+    def delete():
+        with local_lock:
+            local_cache.pop(name, None)
+        caches[get_config().get('CACHE', 'default')].delete(name)
+
+    delete()
+    transaction.on_commit(delete)
+
+
+def invalidate_user(user):
+    """Сбрасывает кэш всех токенов пользователя."""
+    for key in Token.objects.filter(user=user).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication с кэшем пользователя по токену."""
+
+    def authenticate_credentials(self, key):
+        user = get_cached_user(key)
+        if user is None:
+            try:
+                token = Token.objects.select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                raise AuthenticationFailed(_('Invalid token.'))
+            user = token.user
+            set_cached_user(key, user)
+        if not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        # Несохраненный Token без запроса к базе: request.auth как у DRF.
+        return user, Token(key=key, user=user)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    """Изменение пользователя, в том числе смена пароля."""
+    if not created:
+        invalidate_user(instance)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """Выход (djoser удаляет токен) и удаление токена."""
+    invalidate_token(instance.key)
@@ -0,0 +1,115 @@
+"""
+Потоковая выгрузка всего каталога рецептов в NDJSON и CSV.
+
+Рецепты читаются через iterator(chunk_size): на каждую пачку
+приходится по одному запросу за составом и тегами, а строки отдаются
+генератором, поэтому расход памяти не зависит от размера каталога.
+Под ASGI строки отдаются асинхронным итератором (alines): синхронный
+генератор Django 4.2 под ASGI сначала собирает в список целиком.
+"""
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from api.serializers import with_recipe_info
+from recipes.models import Recipes
+
+
+CHUNK_SIZE = 500
+CSV_FIELDS = (
+    'id', 'name', 'author_id', 'author', 'cooking_time', 'image',
+    'tags', 'ingredients', 'text',
+)
+
+
+def recipes_with_relations():
+    """Рецепты с автором, составом и тегами для recipe_record."""
+    return with_recipe_info(Recipes.objects.all())
+
+
+def iter_recipes(chunk_size=CHUNK_SIZE):
+    """Рецепты по id с автором, составом и тегами."""
+    return recipes_with_relations().order_by('id').iterator(
+        chunk_size=chunk_size
+    )
+
+
+def recipe_record(recipe):
+    """Рецепт в виде словаря для выгрузки."""
+    return {
+        'id': recipe.id,
+        'name': recipe.name,
+        'author': {
+            'id': recipe.author_id,
+            'username': recipe.author.username,
+        },
+        'cooking_time': recipe.cooking_time,
+        'image': recipe.image.name,
+        'tags': [tag.slug for tag in recipe.tags.all()],
+        'ingredients': [
+            {
+                'id': amount.ingredient_id,
+                'name': amount.ingredient.name,
+                'measurement_unit': amount.ingredient.measurement_unit,
+                'amount': amount.amount,
+            }
+            for amount in recipe.ingredientamount_set.all()
+        ],
+        'text': recipe.text,
+    }
+
+
+def ndjson_lines(chunk_size=CHUNK_SIZE):
+    """По строке JSON на рецепт."""
+    for recipe in iter_recipes(chunk_size):
+        yield json.dumps(recipe_record(recipe), ensure_ascii=False) + '\n'
+
+
+class Echo:
+    """Буфер для csv.writer, который сразу возвращает строку."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(chunk_size=CHUNK_SIZE):
+    """
+    Строка CSV на рецепт: теги через ';', состав как
+    'название:количество единица' через ';'.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_FIELDS)
+    for recipe in iter_recipes(chunk_size):
+        record = recipe_record(recipe)
+        yield writer.writerow((
+            record['id'], record['name'], record['author']['id'],
+            record['author']['username'], record['cooking_time'],
+            record['image'], ';'.join(record['tags']),
+            ';'.join(
+                '{name}:{amount} {measurement_unit}'.format(**item)
+                for item in record['ingredients']
+            ),
+            record['text'],
+        ))
+
+
+async def alines(lines, batch_size=CHUNK_SIZE):
+    """
+    Асинхронный итератор по строкам синхронного генератора lines:
+    пачка из batch_size строк за один переход в поток с соединением.
+    """
+    # thread_sensitive: курсор iterator() остается в потоке соединения.
+    next_batch = sync_to_async(lambda: list(islice(lines, batch_size)))
+    while True:
+        batch = await next_batch()
+        if not batch:
+            return
+        yield ''.join(batch)
+
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson; charset=utf-8', ndjson_lines),
+    'csv': ('text/csv; charset=utf-8', csv_lines),
+}
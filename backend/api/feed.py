@@ -0,0 +1,99 @@
+"""
+Лента рецептов от авторов, на которых подписан пользователь.
+
+Лента хранится в таблице FeedEntry (fan-out on write). Запрос,
+создавший рецепт, ленты не заполняет: после фиксации транзакции
+enqueue_fan_out ставит задачу api.tasks.fan_out_recipes, и рецепт
+появляется в лентах подписчиков, когда ее выполнит воркер очереди
+(manage.py run_workers, сервис worker), пачками по FEED['BATCH_SIZE'].
+Подписка сразу добавляет в ленту последние рецепты автора, отписка их
+убирает. Чтение ленты — один диапазон индекса (user, recipe) без
+соединения с подписками.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.jobs import enqueue
+from recipes.models import FeedEntry, Follower, Recipes
+
+
+def get_config():
+    """Настройки FEED."""
+    return getattr(settings, 'FEED', {})
+
+
+def fan_out(recipes):
+    """Раскладывает рецепты recipes в ленты подписчиков их авторов."""
+    batch_size = get_config().get('BATCH_SIZE', 1000)
+    by_author = {}
+    for recipe in recipes:
+        by_author.setdefault(recipe.author_id, []).append(recipe.id)
+    entries = []
+    for user_id, author_id in Follower.objects.filter(
+        author_id__in=by_author
+    ).values_list('user_id', 'author_id').iterator(chunk_size=batch_size):
+        entries.extend(
+            FeedEntry(user_id=user_id, recipe_id=recipe_id,
+                      author_id=author_id)
+            for recipe_id in by_author[author_id]
+        )
+        if len(entries) >= batch_size:
+            FeedEntry.objects.bulk_create(entries, ignore_conflicts=True)
+            entries = []
+    if entries:
+        FeedEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту подписчика последние рецепты автора."""
+    recipe_ids = Recipes.objects.filter(author_id=author_id).order_by(
+        '-id'
+    ).values_list('id', flat=True)[:get_config().get('BACKFILL', 100)]
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(user_id=user_id, recipe_id=recipe_id,
+                      author_id=author_id)
+            for recipe_id in recipe_ids
+        ),
+        ignore_conflicts=True
+    )
+
+
+def cleanup(user_id, author_id):
+    """Убирает рецепты автора из ленты бывшего подписчика."""
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def enqueue_fan_out(recipe_ids):
+    """
+    После фиксации транзакции рецептов ставит их раскладку задачей
+    api.tasks.fan_out_recipes: ни транзакция, ни запрос создания не ждут
+    вставки в ленты всех подписчиков. Задача перечитывает рецепты,
+    удаленные к этому моменту пропускаются.
+    """
+    recipe_ids = list(recipe_ids)
+    transaction.on_commit(lambda: enqueue(
+        'api.tasks.fan_out_recipes', args=(recipe_ids,)
+    ))
+
+
+@receiver(post_save, sender=Recipes)
+def recipe_created(sender, instance, created, **kwargs):
+    """Новый рецепт попадает в ленты подписчиков автора."""
+    if created:
+        enqueue_fan_out([instance.id])
+
+
+@receiver(post_save, sender=Follower)
+def follower_created(sender, instance, created, **kwargs):
+    """Подписка: рецепты автора в ленту подписчика."""
+    if created:
+        backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follower)
+def follower_deleted(sender, instance, **kwargs):
+    """Отписка: рецепты автора уходят из ленты."""
+    cleanup(instance.user_id, instance.author_id)
@@ -1,55 +1,52 @@
-from django_filters import rest_framework as filters
-from recipes.models import Recipes, Tag
+from django.db.models import Exists, OuterRef
+from recipes.models import Favorite, Recipes, ShoppingList
 
 
-class TagFilter(filters.FilterSet):
-    """Фильтр для управления тегами рецептов."""
+TRUE_VALUES = ('1', 'true', 'True')
 
-    tags = filters.ModelMultipleChoiceFilter(
-        queryset=Tag.objects.all(),
-        field_name='tags__slug',
-        to_field_name='slug',
-        label='Теги'
-    )
 
-    class Meta:
-        model = Recipes
-        fields = ('tags',)
-
-
-class RecipesFilter(filters.FilterSet):
-    """Фильтр для управления рецептами с возможностью фильтрации
-    по тегам и другим параметрам.
+def filter_recipes(queryset, params, user):
     """
-
-    tags = filters.ModelMultipleChoiceFilter(
-        queryset=Tag.objects.all(),
-        field_name='tags__slug',
-        to_field_name='slug',
-        label='Теги'
-    )
-
-    is_favorited = filters.BooleanFilter(
-        method='filter_favorites',
-        label='Избранное'
-    )
-    is_in_shopping_cart = filters.BooleanFilter(
-        method='filter_cart',
-        label='В корзине'
-    )
-
-    class Meta:
-        model = Recipes
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
-
-    def filter_favorites(self, queryset, name, value):
-        """Фильтрует рецепты, добавленные в избранное пользователем."""
-        if value:
-            return queryset.filter(favorites__user=self.request.user)
-        return queryset
-
-    def filter_cart(self, queryset, name, value):
-        """Фильтрует рецепты, находящиеся в корзине пользователя."""
-        if value:
-            return queryset.filter(shopping_cart__author=self.request.user)
-        return queryset
+    Фильтрует рецепты по параметрам запроса: автор, избранное, корзина,
+    теги (рецепт должен иметь все переданные теги).
+    Единственный слой фильтрации синхронного вьюсета и асинхронных
+    представлений, сама к базе не обращается.
+
+    Каждый параметр — полусоединение Exists() по индексу связи:
+    строки рецептов не размножаются, поэтому не нужны ни DISTINCT,
+    ни GROUP BY, и порядок -id берется прямо из первичного ключа.
+    """
+    author_id = params.get('author')
+    if author_id:
+        if not author_id.isdigit():
+            return queryset.none()
+        queryset = queryset.filter(author_id=author_id)
+    if user.is_authenticated:
+        if params.get('is_favorited') in TRUE_VALUES:
+            queryset = queryset.filter(Exists(
+                Favorite.objects.filter(author=user, recipe=OuterRef('pk'))
+            ))
+        if params.get('is_in_shopping_cart') in TRUE_VALUES:
+            queryset = queryset.filter(Exists(
+                ShoppingList.objects.filter(
+                    author=user, recipe=OuterRef('pk')
+                )
+            ))
+    for slug in sorted(set(params.getlist('tags'))):
+        queryset = queryset.filter(Exists(
+            Recipes.tags.through.objects.filter(
+                recipes_id=OuterRef('pk'), tag__slug=slug
+            )
+        ))
+    return queryset
+
+
+def filter_ingredients(queryset, params):
+    """
+    Ингредиенты, чье название начинается с ?name= (без учета регистра),
+    для синхронного вьюсета и асинхронного списка.
+    """
+    name = params.get('name')
+    if name:
+        queryset = queryset.filter(name__istartswith=name)
+    return queryset
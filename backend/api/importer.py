@@ -0,0 +1,174 @@
+"""
+Пакетный импорт рецептов из NDJSON.
+
+Каждая строка — рецепт в формате RecipesAddSerializer. Строки
+проверяются пачками по batch_size, ингредиенты и теги сверяются со
+словарями в памяти, а рецепты, их состав и теги пачки вставляются
+через bulk_create в одной транзакции. Ошибка в строке попадает в
+отчет и не останавливает импорт остальных. Если пачка не вставилась
+(например, параллельно создан рецепт с тем же названием), ее строки
+вставляются по одной, каждая в своей точке сохранения, и в отчет
+попадают только упавшие.
+
+charge вызывается перед каждой пачкой, кроме первой: эндпоинт списывает
+ею жетон ограничения частоты. Если charge вернул False, импорт
+останавливается, и в отчете stopped_at — первая невставленная строка.
+"""
+import json
+
+from django.db import DatabaseError, transaction
+
+from api.feed import enqueue_fan_out
+from api.serializers import RecipesAddSerializer
+from api.sync import number_pending
+from recipes.models import Ingredient, IngredientAmount, Recipes, Tag
+
+
+BATCH_SIZE = 100
+
+
+class RecipeImporter:
+    """Импорт рецептов одного автора с отчетом по строкам."""
+
+    def __init__(self, author, batch_size=BATCH_SIZE, charge=None):
+        """Загружает справочники ингредиентов и тегов."""
+        self.author = author
+        self.batch_size = batch_size
+        self.charge = charge
+        self.batches = 0
+        self.stopped_at = None
+        self.ingredient_ids = set(
+            Ingredient.objects.values_list('id', flat=True)
+        )
+        self.tag_ids = set(Tag.objects.values_list('id', flat=True))
+        self.names = set(
+            Recipes.objects.filter(author=author).values_list(
+                'name', flat=True
+            )
+        )
+        self.created = 0
+        self.errors = []
+
+    def run(self, lines):
+        """Импортирует строки lines (str или bytes) и возвращает отчет."""
+        batch = []
+        for number, line in enumerate(lines, start=1):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            if not line.strip():
+                continue
+            row = self.validate(number, line)
+            if row is not None:
+                batch.append(row)
+            if len(batch) >= self.batch_size:
+                if not self.save(batch):
+                    return self.report()
+                batch = []
+        if batch:
+            self.save(batch)
+        return self.report()
+
+    def report(self):
+        """Число созданных рецептов и ошибки по номерам строк."""
+        report = {'created': self.created, 'errors': self.errors}
+        if self.stopped_at is not None:
+            report['stopped_at'] = self.stopped_at
+        return report
+
+    def error(self, number, errors):
+        """Добавляет ошибки строки number в отчет."""
+        self.errors.append({'line': number, 'errors': errors})
+
+    def validate(self, number, line):
+        """Проверяет строку; при ошибке пишет ее в отчет."""
+        try:
+            data = json.loads(line)
+        except ValueError as error:
+            self.error(number, {'json': [str(error)]})
+            return None
+        if not isinstance(data, dict):
+            self.error(number, {'json': ['Ожидался объект рецепта.']})
+            return None
+        serializer = RecipesAddSerializer(data=data)
+        if not serializer.is_valid():
+            self.error(number, serializer.errors)
+            return None
+        recipe = serializer.validated_data
+        amounts = {
+            item['id']: item['amount'] for item in recipe['ingredients']
+        }
+        errors = {}
+        if not amounts:
+            errors['ingredients'] = ['Нужен хотя бы один ингредиент!']
+        elif len(amounts) != len(recipe['ingredients']):
+            errors['ingredients'] = ['Ингредиенты не должны повторяться.']
+        elif amounts.keys() - self.ingredient_ids:
+            missing = sorted(amounts.keys() - self.ingredient_ids)
+            errors['ingredients'] = ['Ингредиент не найден: {}.'.format(
+                ', '.join(map(str, missing))
+            )]
+        missing_tags = sorted(set(recipe['tags']) - self.tag_ids)
+        if missing_tags:
+            errors['tags'] = ['Тег не найден: {}.'.format(
+                ', '.join(map(str, missing_tags))
+            )]
+        if recipe['name'] in self.names:
+            errors['name'] = ['Рецепт с таким названием уже есть.']
+        if errors:
+            self.error(number, errors)
+            return None
+        self.names.add(recipe['name'])
+        return number, recipe, amounts
+
+    def save(self, batch):
+        """
+        Вставляет пачку проверенных рецептов; False, если charge
+        не разрешил пачку и импорт остановлен.
+        """
+        self.batches += 1
+        if self.batches > 1 and self.charge and not self.charge():
+            self.stopped_at = batch[0][0]
+            return False
+        try:
+            self.insert(batch)
+        except DatabaseError:
+            for row in batch:
+                try:
+                    self.insert([row])
+                except DatabaseError as error:
+                    self.error(row[0], {'database': [str(error)]})
+        return True
+
+    def insert(self, rows):
+        """Вставляет рецепты rows в своей транзакции или точке сохранения."""
+        recipes = [
+            Recipes(
+                author=self.author,
+                name=data['name'],
+                text=data['text'],
+                cooking_time=data['cooking_time'],
+                image=data['image'],
+            )
+            for _, data, _ in rows
+        ]
+        relation = Recipes.tags.through
+        with transaction.atomic():
+            Recipes.objects.bulk_create(recipes)
+            IngredientAmount.objects.bulk_create(
+                IngredientAmount(
+                    recipe=recipe, ingredient_id=ingredient_id,
+                    amount=amount
+                )
+                for recipe, (_, _, amounts) in zip(recipes, rows)
+                for ingredient_id, amount in amounts.items()
+            )
+            relation.objects.bulk_create(
+                relation(recipes=recipe, tag_id=tag_id)
+                for recipe, (_, data, _) in zip(recipes, rows)
+                for tag_id in set(data['tags'])
+            )
+            # bulk_create не шлет post_save: номера изменений
+            # и ленты заполняем сами.
+            transaction.on_commit(number_pending)
+            enqueue_fan_out([recipe.id for recipe in recipes])
+        self.created += len(recipes)
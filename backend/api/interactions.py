@@ -0,0 +1,157 @@
+"""
+Состояние пользователя: избранное, корзина и подписки.
+
+Каждое множество id (рецепты в избранном, рецепты в корзине, авторы
+в подписках) читается из базы одним запросом и хранится в кэше
+INTERACTIONS['CACHE'] отсортированным массивом, а в пределах запроса —
+на самом запросе. Флаги is_favorited, is_in_shopping_cart и
+is_subscribed — проверка вхождения в памяти.
+
+Ключи множеств содержат версию состояния пользователя. Любое
+добавление или удаление избранного, корзины или подписки меняет
+версию, и следующий запрос перечитывает множества из базы. Версия
+читается до запроса к базе, поэтому множество, собранное
+одновременно с записью, остается под старой версией и не читается.
+"""
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.metrics import record_cache
+from recipes.models import Favorite, Follower, ShoppingList
+
+
+# Вид множества: модель, поле пользователя и поле id.
+KINDS = {
+    'favorites': (Favorite, 'author_id', 'recipe_id'),
+    'cart': (ShoppingList, 'author_id', 'recipe_id'),
+    'followed': (Follower, 'user_id', 'author_id'),
+}
+
+
+def get_config():
+    """Настройки INTERACTIONS."""
+    return getattr(settings, 'INTERACTIONS', {})
+
+
+def get_cache():
+    """Кэш множеств, общий для всех воркеров."""
+    return caches[get_config().get('CACHE', 'default')]
+
+
+class IdSet:
+    """Отсортированный массив id, вхождение — бинарным поиском."""
+
+    __slots__ = ('ids',)
+
+    def __init__(self, ids=()):
+        """Последовательность ids должна быть отсортирована."""
+        self.ids = ids
+
+    def __contains__(self, value):
+        index = bisect_left(self.ids, value)
+        return index < len(self.ids) and self.ids[index] == value
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def version_key(user_id):
+    """Ключ версии состояния пользователя."""
+    return f'interactions:{user_id}:version'
+
+
+def load(user_id, kind):
+    """Множество kind пользователя user_id: из кэша или из базы."""
+    cache = get_cache()
+    timeout = get_config().get('TIMEOUT', 3600)
+    version = cache.get_or_set(version_key(user_id), time.time_ns, timeout)
+    key = f'interactions:{user_id}:{kind}:{version}'
+    ids = cache.get(key)
+    record_cache('interactions', ids is not None)
+    if ids is None:
+        model, user_field, id_field = KINDS[kind]
+        ids = array('q', sorted(
+            model.objects.filter(**{user_field: user_id}).values_list(
+                id_field, flat=True
+            )
+        ))
+        cache.set(key, ids, timeout)
+    return IdSet(ids)
+
+
+def invalidate(user_id):
+    """
+    Новая версия состояния пользователя: сразу и после фиксации
+    транзакции, чтобы множество не собралось до нее.
+    """
+    def bump():
+        get_cache().set(
+            version_key(user_id), time.time_ns(),
+            get_config().get('TIMEOUT', 3600)
+        )
+
+    bump()
+    transaction.on_commit(bump)
+
+
+class Interactions:
+    """Множества одного пользователя, загружаемые при первом обращении."""
+
+    def __init__(self, user):
+        """У анонима все множества пустые."""
+        self.user_id = user.pk if user.is_authenticated else None
+        self.sets = {}
+
+    def get(self, kind):
+        if self.user_id is None:
+            return IdSet()
+        if kind not in self.sets:
+            self.sets[kind] = load(self.user_id, kind)
+        return self.sets[kind]
+
+    @property
+    def favorites(self):
+        return self.get('favorites')
+
+    @property
+    def cart(self):
+        return self.get('cart')
+
+    @property
+    def followed(self):
+        return self.get('followed')
+
+
+def for_request(request):
+    """Состояние пользователя запроса, одно на весь запрос."""
+    state = getattr(request, 'interactions', None)
+    if state is None or state.user_id != request.user.pk:
+        state = Interactions(request.user)
+        request.interactions = state
+    return state
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_delete, sender=ShoppingList)
+def recipe_list_changed(sender, instance, **kwargs):
+    """Избранное или корзина изменились."""
+    invalidate(instance.author_id)
+
+
+@receiver(post_save, sender=Follower)
+@receiver(post_delete, sender=Follower)
+def follower_changed(sender, instance, **kwargs):
+    """Подписки изменились."""
+    invalidate(instance.user_id)
@@ -0,0 +1,264 @@
+"""
+Очередь фоновых задач в основной базе данных.
+
+Задача — функция с декоратором @task; enqueue() ставит ее вызов в
+таблицу Job, воркеры команды run_workers забирают задачи по одной.
+На PostgreSQL задача берется через SELECT ... FOR UPDATE SKIP LOCKED,
+на SQLite — условным UPDATE: строку получает только тот воркер, чей
+UPDATE изменил ее первым. Упавшая задача повторяется с
+экспоненциальной задержкой. Периодические задачи из JOBS['SCHEDULE']
+ставит задача schedule_periodic, которую раз в шаг расписания ставит
+один поток каждого процесса; ключ шага оставляет одну такую задачу на
+шаг, а ключи интервалов — по одной периодической задаче на интервал.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from api.metrics import registry
+from api.models import Job, JobStatus
+
+logger = logging.getLogger('recipes')
+
+tasks = {}
+
+
+def get_config():
+    """Настройки JOBS."""
+    return getattr(settings, 'JOBS', {})
+
+
+def task(func):
+    """Регистрирует функцию как задачу: func.enqueue(...) ставит ее."""
+    name = f'{func.__module__}.{func.__name__}'
+    tasks[name] = func
+    func.task_name = name
+
+    def enqueue_task(*args, **kwargs):
+        return enqueue(name, args=args, kwargs=kwargs)
+
+    func.enqueue = enqueue_task
+    return func
+
+
+def get_task(name):
+    """Функция задачи по имени; модуль задачи импортируется сам."""
+    if name not in tasks:
+        import_string(name)
+    return tasks[name]
+
+
+def enqueue(name, args=(), kwargs=None, delay=0, max_attempts=None,
+            key=None):
+    """
+    Ставит задачу name в очередь. С key задача с таким ключом
+    создается один раз, повторный вызов возвращает существующую.
+    """
+    if callable(name):
+        name = name.task_name
+    fields = {
+        'name': name,
+        'args': list(args),
+        'kwargs': kwargs or {},
+        'run_at': timezone.now() + timedelta(seconds=delay),
+        'max_attempts': (
+            max_attempts or get_config().get('MAX_ATTEMPTS', 3)
+        ),
+    }
+    if key is None:
+        return Job.objects.create(**fields)
+    job, _ = Job.objects.get_or_create(key=key, defaults=fields)
+    return job
+
+
+def enqueue_periodic(now=None):
+    """Ставит периодические задачи, по одной на интервал расписания."""
+    now = now or timezone.now()
+    for name, entry in get_config().get('SCHEDULE', {}).items():
+        slot = int(now.timestamp() // entry['INTERVAL'])
+        enqueue(
+            entry['TASK'], args=entry.get('ARGS', ()),
+            key=f'{name}:{slot}'
+        )
+
+
+@task
+def schedule_periodic():
+    """Задача планировщика: ставит периодические задачи интервала."""
+    enqueue_periodic()
+
+
+def schedule_tick():
+    """Шаг планировщика — наименьший интервал расписания, None без него."""
+    schedule = get_config().get('SCHEDULE', {})
+    if not schedule:
+        return None
+    return min(entry['INTERVAL'] for entry in schedule.values())
+
+
+def claim(worker):
+    """Забирает одну готовую задачу для воркера worker или None."""
+    now = timezone.now()
+    stale = now - timedelta(
+        seconds=get_config().get('VISIBILITY_TIMEOUT', 300)
+    )
+    # Задачи упавших воркеров возвращаются в работу по таймауту.
+    ready = Job.objects.filter(
+        Q(status=JobStatus.QUEUED, run_at__lte=now)
+        | Q(status=JobStatus.RUNNING, locked_at__lt=stale)
+    ).order_by('run_at', 'id')
+    values = {
+        'status': JobStatus.RUNNING,
+        'locked_by': worker,
+        'locked_at': now,
+        'attempts': F('attempts') + 1,
+    }
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = ready.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            Job.objects.filter(id=job.id).update(**values)
+    else:
+        for job in ready[:get_config().get('CLAIM_CANDIDATES', 5)]:
+            if ready.filter(id=job.id).update(**values):
+                break
+        else:
+            return None
+    job.status = JobStatus.RUNNING
+    job.locked_by = worker
+    job.locked_at = now
+    job.attempts += 1
+    return job
+
+
+def backoff(attempts):
+    """Задержка перед повтором после attempts неудачных попыток."""
+    config = get_config()
+    return min(
+        config.get('BACKOFF_BASE', 5) * 2 ** (attempts - 1),
+        config.get('BACKOFF_MAX', 3600)
+    )
+
+
+class Worker:
+    """Выполняет задачи очереди в текущем потоке."""
+
+    def __init__(self, name=None, scheduler=False):
+        """
+        Имя воркера: хост, процесс и поток. Воркер-планировщик
+        (по одному на процесс run_workers) раз в шаг расписания ставит
+        задачу schedule_periodic.
+        """
+        self.name = name or '{}:{}:{}'.format(
+            socket.gethostname(), os.getpid(), threading.get_ident()
+        )
+        self.scheduler = scheduler
+        self.next_schedule = 0.0
+
+    def schedule(self):
+        """
+        Ставит schedule_periodic с ключом текущего шага расписания:
+        планировщики всех процессов ставят одну задачу на шаг, и
+        enqueue_periodic выполняет один воркер, взявший ее из очереди.
+        """
+        if not self.scheduler or time.monotonic() < self.next_schedule:
+            return
+        tick = schedule_tick()
+        if tick is None:
+            self.scheduler = False
+            return
+        now = time.time()
+        slot = int(now // tick)
+        enqueue(schedule_periodic, key=f'schedule:{slot}')
+        self.next_schedule = time.monotonic() + (slot + 1) * tick - now
+
+    def run_once(self):
+        """Выполняет одну задачу; False, если очередь пуста."""
+        job = claim(self.name)
+        if job is None:
+            return False
+        self.execute(job)
+        return True
+
+    def execute(self, job):
+        start = time.perf_counter()
+        try:
+            get_task(job.name)(*job.args, **job.kwargs)
+        except Exception as error:
+            result = self.fail(job, error)
+        else:
+            result = 'done'
+            Job.objects.filter(id=job.id, locked_by=self.name).update(
+                status=JobStatus.DONE, finished_at=timezone.now(),
+                last_error=''
+            )
+        labels = (('task', job.name),)
+        registry.observe(
+            'foodgram_job_duration_seconds', labels,
+            time.perf_counter() - start
+        )
+        registry.inc('foodgram_jobs_total', labels + (('result', result),))
+
+    def fail(self, job, error):
+        logger.error('Задача %s #%s упала: %s', job.name, job.id, error)
+        fields = {'last_error': traceback.format_exc()}
+        if job.attempts < job.max_attempts:
+            result = 'retry'
+            fields.update(
+                status=JobStatus.QUEUED,
+                run_at=timezone.now() + timedelta(
+                    seconds=backoff(job.attempts)
+                )
+            )
+        else:
+            result = 'failed'
+            fields.update(status=JobStatus.FAILED, finished_at=timezone.now())
+        Job.objects.filter(id=job.id, locked_by=self.name).update(**fields)
+        return result
+
+    def run(self, stop, burst=False, poll_interval=1.0):
+        """
+        Берет задачи, пока не выставлен stop. В режиме burst
+        завершается, как только очередь опустела.
+        """
+        while not stop.is_set():
+            self.schedule()
+            if self.run_once():
+                continue
+            if burst:
+                break
+            stop.wait(poll_interval)
+
+
+def run_threads(count, stop, burst=False, poll_interval=1.0):
+    """Запускает count воркеров в потоках и ждет их завершения."""
+    def target(scheduler):
+        try:
+            Worker(scheduler=scheduler).run(stop, burst, poll_interval)
+        finally:
+            connection.close()
+
+    threads = [
+        threading.Thread(target=target, args=(number == 0,), daemon=True)
+        for number in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,78 @@
+"""
+Блокировка ключа кэша между процессами.
+
+Файловому кэшу атомарный add недоступен, поэтому для него берется
+flock на одном из LOCK_STRIPES файлов рядом с кэшем; для остальных
+кэшей (Redis, memcached) — атомарный cache.add ключа блокировки со
+случайным значением. Ожидание ограничено timeout: попытки повторяются
+с растущей паузой, а не опрашивают кэш каждую миллисекунду, и по
+истечении timeout поднимается LockTimeoutError — критическая секция без
+блокировки не выполняется. Снимается только своя блокировка.
+"""
+import hashlib
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files import locks
+
+
+# Файлов блокировок у файлового кэша: ключи делят их по хешу.
+LOCK_STRIPES = 64
+# Пауза между попытками: от MIN_DELAY, удваиваясь до MAX_DELAY секунд.
+MIN_DELAY = 0.001
+MAX_DELAY = 0.05
+
+
+class LockTimeoutError(Exception):
+    """Блокировку не удалось взять за отведенное время."""
+
+
+def retry(acquire, timeout):
+    """
+    Вызывает acquire, пока он не вернет True, с растущей паузой;
+    LockTimeoutError, если за timeout секунд не удалось.
+    """
+    deadline = time.monotonic() + timeout
+    delay = MIN_DELAY
+    while not acquire():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LockTimeoutError()
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, MAX_DELAY)
+
+
+@contextmanager
+def cache_lock(cache, key, timeout):
+    """
+    Блокировка ключа key кэша cache. У cache.add блокировку упавшего
+    владельца снимает истечение ключа через timeout секунд.
+    """
+    if isinstance(cache, FileBasedCache):
+        stripe = int(hashlib.md5(key.encode()).hexdigest(), 16) % (
+            LOCK_STRIPES
+        )
+        os.makedirs(cache._dir, exist_ok=True)
+        with open(os.path.join(cache._dir, f'bucket-{stripe}.lock'),
+                  'a') as lock_file:
+            retry(
+                lambda: locks.lock(lock_file, locks.LOCK_EX | locks.LOCK_NB),
+                timeout
+            )
+            try:
+                yield
+            finally:
+                locks.unlock(lock_file)
+        return
+    lock_key = f'{key}:lock'
+    owner = uuid.uuid4().hex
+    retry(lambda: cache.add(lock_key, owner, timeout), timeout)
+    try:
+        yield
+    finally:
+        # Истекшую блокировку мог уже взять другой владелец.
+        if cache.get(lock_key) == owner:
+            cache.delete(lock_key)
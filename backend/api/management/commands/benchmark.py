@@ -0,0 +1,136 @@
+import json
+import math
+import platform
+import subprocess
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from rest_framework.authtoken.models import Token
+
+from api.middleware import RequestTiming
+from recipes.models import Ingredient, Recipes, Tag, User
+
+
+def percentile(values, percent):
+    """Перцентиль по методу ближайшего ранга."""
+    ordered = sorted(values)
+    rank = max(0, math.ceil(percent / 100 * len(ordered)) - 1)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    """
+    Замеряет основные эндпоинты API на текущих данных
+    (их можно создать командой generate_data).
+    Для каждого эндпоинта считает SQL-запросы и задержку p50/p95,
+    результат пишет в JSON для сравнения между коммитами.
+    """
+
+    help = 'Замер производительности основных эндпоинтов API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--output', help='Файл для результатов JSON.')
+        parser.add_argument(
+            '--compare', help='Файл с прошлыми результатами для сравнения.'
+        )
+
+    def handle(self, *args, **options):
+        user = (
+            User.objects
+            .annotate(cart_size=Count('shopping_cart', distinct=True))
+            .order_by('-cart_size', 'id')
+            .first()
+        )
+        recipe = Recipes.objects.first()
+        if user is None or recipe is None:
+            raise CommandError(
+                'Нет данных для замера, запустите generate_data.'
+            )
+        token, _ = Token.objects.get_or_create(user=user)
+        slugs = list(Tag.objects.values_list('slug', flat=True)[:2])
+        ingredient = Ingredient.objects.first()
+        tags_query = '&'.join(f'tags={slug}' for slug in slugs)
+        endpoints = {
+            'recipes-list': '/api/recipes/',
+            'recipes-list-filtered': (
+                f'/api/recipes/?{tags_query}&is_favorited=1'
+            ),
+            'recipes-detail': f'/api/recipes/{recipe.id}/',
+            'subscriptions': '/api/users/subscriptions/?recipes_limit=3',
+            'download-shopping-cart': '/api/recipes/download_shopping_cart/',
+            'ingredients-search': '/api/ingredients/?name={}'.format(
+                ingredient.name[:3] if ingredient else ''
+            ),
+        }
+        client = Client(
+            HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Token {token.key}'
+        )
+        results = {
+            name: self.measure(client, url, options['iterations'])
+            for name, url in endpoints.items()
+        }
+        report = {
+            'commit': self.get_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'dataset': {
+                'users': User.objects.count(),
+                'recipes': Recipes.objects.count(),
+            },
+            'iterations': options['iterations'],
+            'results': results,
+        }
+        self.print_report(report, options.get('compare'))
+        if options.get('output'):
+            with open(options['output'], 'w', encoding='utf-8') as target:
+                json.dump(report, target, ensure_ascii=False, indent=2)
+
+    def measure(self, client, url, iterations):
+        counter = RequestTiming(url)
+        with connection.execute_wrapper(counter):
+            response = client.get(url)
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            client.get(url)
+            timings.append((time.perf_counter() - start) * 1000)
+        return {
+            'url': url,
+            'status': response.status_code,
+            'queries': counter.queries,
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'mean_ms': round(sum(timings) / len(timings), 2),
+        }
+
+    def get_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def print_report(self, report, compare_path):
+        previous = {}
+        if compare_path:
+            with open(compare_path, encoding='utf-8') as source:
+                previous = json.load(source)['results']
+        self.stdout.write(
+            f'{"эндпоинт":<25}{"статус":>7}{"SQL":>6}'
+            f'{"p50, мс":>10}{"p95, мс":>10}{"Δp95":>9}'
+        )
+        for name, result in report['results'].items():
+            delta = ''
+            if name in previous:
+                delta = f'{result["p95_ms"] - previous[name]["p95_ms"]:+.1f}'
+            self.stdout.write(
+                f'{name:<25}{result["status"]:>7}{result["queries"]:>6}'
+                f'{result["p50_ms"]:>10}{result["p95_ms"]:>10}{delta:>9}'
+            )
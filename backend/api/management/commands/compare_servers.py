@@ -0,0 +1,117 @@
+import asyncio
+import importlib.util
+import json
+import sys
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.management.commands.benchmark import percentile
+from api.management.commands.replay_collection import fetch, start_server
+from recipes.models import Recipes
+
+
+SERVERS = {
+    'wsgi': ['foodgram.wsgi'],
+    'asgi': ['-k', 'uvicorn.workers.UvicornWorker', 'foodgram.asgi'],
+}
+
+
+class Command(BaseCommand):
+    """
+    Сравнивает пропускную способность WSGI и ASGI на горячих
+    GET-эндпоинтах: по очереди поднимает gunicorn с синхронными
+    воркерами и с воркерами uvicorn и нагружает их одинаковым
+    числом одновременных соединений.
+    """
+
+    help = 'Сравнение WSGI и ASGI под высокой конкурентностью.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--concurrency', type=int, default=64)
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Длительность нагрузки, секунд.')
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8100)
+        parser.add_argument('--servers', nargs='+', default=list(SERVERS),
+                            choices=list(SERVERS))
+        parser.add_argument('--output', help='Файл для результатов JSON.')
+
+    def handle(self, *args, **options):
+        for module in ('gunicorn', 'uvicorn'):
+            if importlib.util.find_spec(module) is None:
+                raise CommandError(f'Не установлен {module}.')
+        recipe = Recipes.objects.first()
+        paths = ['/api/recipes/', '/api/tags/', '/api/ingredients/']
+        if recipe is not None:
+            paths.append(f'/api/recipes/{recipe.id}/')
+        host, port = options['host'], options['port']
+        results = {}
+        for name in options['servers']:
+            server = start_server(
+                [sys.executable, '-m', 'gunicorn',
+                 '-w', str(options['workers']), '-b', f'{host}:{port}',
+                 *SERVERS[name]],
+                host, port
+            )
+            try:
+                results[name] = asyncio.run(self.load(
+                    host, port, paths,
+                    options['concurrency'], options['duration']
+                ))
+            finally:
+                server.terminate()
+                server.wait()
+        self.stdout.write(
+            f'{"сервер":<8}{"запр/с":>10}{"p50, мс":>10}'
+            f'{"p95, мс":>10}{"p99, мс":>10}{"ошибки":>9}'
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<8}{result["throughput_rps"]:>10}'
+                f'{result["p50_ms"]:>10}{result["p95_ms"]:>10}'
+                f'{result["p99_ms"]:>10}{result["errors"]:>9}'
+            )
+        if options.get('output'):
+            with open(options['output'], 'w', encoding='utf-8') as target:
+                json.dump(results, target, ensure_ascii=False, indent=2)
+
+    async def load(self, host, port, paths, concurrency, duration):
+        latencies = []
+        statuses = Counter()
+        deadline = time.monotonic() + duration
+
+        async def client(number):
+            index = number
+            while time.monotonic() < deadline:
+                path = paths[index % len(paths)]
+                index += 1
+                start = time.perf_counter()
+                try:
+                    status, _ = await fetch(
+                        host, port, 'GET', path, [], b'', 30
+                    )
+                except (OSError, asyncio.TimeoutError, ValueError):
+                    status = None
+                latencies.append((time.perf_counter() - start) * 1000)
+                statuses[status] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client(number) for number in range(
+            concurrency
+        )))
+        elapsed = time.perf_counter() - started
+        return {
+            'requests': len(latencies),
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'errors': sum(
+                count for status, count in statuses.items()
+                if status is None or status >= 500
+            ),
+            'statuses': {str(key): value for key, value in statuses.items()},
+        }
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api.exporter import CHUNK_SIZE, FORMATS
+
+
+class Command(BaseCommand):
+    """
+    Выгружает все рецепты с составом и тегами в NDJSON или CSV.
+    Рецепты читаются пачками, файл пишется построчно.
+    """
+
+    help = 'Потоковая выгрузка каталога рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file-format', choices=list(FORMATS),
+                            default='ndjson')
+        parser.add_argument('--output', help='Файл; по умолчанию stdout.')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        _, lines = FORMATS[options['file_format']]
+        if options.get('output'):
+            with open(options['output'], 'w', encoding='utf-8',
+                      newline='') as target:
+                target.writelines(lines(options['chunk_size']))
+        else:
+            self.stdout.writelines(lines(options['chunk_size']))
@@ -0,0 +1,44 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importer import BATCH_SIZE, RecipeImporter
+from recipes.models import User
+
+
+class Command(BaseCommand):
+    """
+    Импортирует рецепты из NDJSON-файла (по рецепту в строке,
+    формат RecipesAddSerializer) от имени пользователя --author.
+    Ошибки выводятся по номерам строк, остальные рецепты создаются.
+    """
+
+    help = 'Пакетный импорт рецептов из NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл NDJSON или - для stdin.')
+        parser.add_argument('--author', required=True,
+                            help='Email автора рецептов.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            author = User.objects.get(email=options['author'])
+        except User.DoesNotExist:
+            raise CommandError(f'Нет пользователя {options["author"]}.')
+        importer = RecipeImporter(author, options['batch_size'])
+        if options['path'] == '-':
+            report = importer.run(sys.stdin)
+        else:
+            with open(options['path'], encoding='utf-8') as source:
+                report = importer.run(source)
+        for error in report['errors']:
+            self.stderr.write(
+                f'строка {error["line"]}: '
+                + json.dumps(error['errors'], ensure_ascii=False)
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано рецептов: {report["created"]}, '
+            f'ошибок: {len(report["errors"])}'
+        ))
@@ -0,0 +1,392 @@
+import asyncio
+import json
+import re
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from http import HTTPStatus
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.management.commands.benchmark import percentile
+
+
+DEFAULT_COLLECTION = (
+    Path(settings.BASE_DIR).parent
+    / 'postman_collection' / 'foodgram.postman_collection.json'
+)
+# Переменные с уникальными значениями (email, username): у каждого
+# виртуального пользователя к ним добавляется свой префикс.
+UNIQUE_VARIABLES = (
+    'email', 'username', 'secondUserEmail', 'secondUserUsername',
+    'thirdUserEmail', 'thirdUserUsername',
+)
+STATUS_BY_PHRASE = {status.phrase: status.value for status in HTTPStatus}
+VARIABLE = re.compile(r'{{(\w+)}}')
+SET_VARIABLE = re.compile(
+    r'collectionVariables\.set\(\s*[\'"](\w+)[\'"]\s*,\s*(.+?)\)\s*;?\s*$'
+)
+EXPECTED_STATUS = re.compile(
+    r'pm\.response\.status,.*?\)\.to\.be\.eql\(\s*"([^"]+)"\s*\)', re.S
+)
+LODASH_GET = re.compile(r'_\.get\(\s*responseData\s*,\s*"([\w.]+)"\s*\)')
+RESPONSE_PATH = re.compile(
+    r'responseData((?:\[\d+\]|\.\w+)*?)(?:\.slice\((\d+),\s*(\d+)\))?$'
+)
+
+
+def parse_capture(expression, script):
+    """
+    Переводит JS-выражение из pm.collectionVariables.set в путь
+    по JSON ответа: список ключей и индексов и необязательный срез.
+    """
+    expression = expression.strip()
+    if re.fullmatch(r'\w+', expression) and expression != 'responseData':
+        definition = re.search(
+            rf'(?:const|let|var)\s+{expression}\s*=\s*([^;\n]+)', script
+        )
+        if definition is None:
+            return None
+        expression = definition.group(1).strip()
+    match = LODASH_GET.fullmatch(expression)
+    if match:
+        return match.group(1).split('.'), None
+    match = RESPONSE_PATH.fullmatch(expression)
+    if match is None:
+        return None
+    path = [
+        int(index) if index else key
+        for index, key in re.findall(r'\[(\d+)\]|\.(\w+)', match.group(1))
+    ]
+    cut = None
+    if match.group(2) is not None:
+        cut = (int(match.group(2)), int(match.group(3)))
+    return path, cut
+
+
+def extract_value(data, capture):
+    """Достает из JSON ответа значение по пути из parse_capture."""
+    path, cut = capture
+    for key in path:
+        try:
+            data = data[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    if cut is not None and isinstance(data, str):
+        data = data[cut[0]:cut[1]]
+    return data
+
+
+def load_collection(path):
+    """Разворачивает коллекцию в плоский список запросов по порядку."""
+    with open(path, encoding='utf-8') as source:
+        collection = json.load(source)
+    variables = {
+        item['key']: item['value'] for item in collection.get('variable', ())
+    }
+    requests = []
+
+    def walk(items, auth):
+        for item in items:
+            if 'item' in item:
+                walk(item['item'], item.get('auth', auth))
+                continue
+            request = item['request']
+            script = '\n'.join(
+                line
+                for event in item.get('event', ())
+                if event.get('listen') == 'test'
+                for line in event['script'].get('exec', ())
+            )
+            captures = []
+            for line in script.splitlines():
+                match = SET_VARIABLE.search(line.strip())
+                if match:
+                    capture = parse_capture(match.group(2), script)
+                    if capture is not None:
+                        captures.append((match.group(1), capture))
+            expected = EXPECTED_STATUS.search(script)
+            url = request['url']
+            requests.append({
+                'name': item['name'],
+                'method': request['method'],
+                'url': url['raw'] if isinstance(url, dict) else url,
+                'headers': [
+                    (header['key'], header['value'])
+                    for header in request.get('header', ())
+                    if not header.get('disabled')
+                ],
+                'body': (request.get('body') or {}).get('raw', ''),
+                'auth': request.get('auth', auth),
+                'expected': (
+                    STATUS_BY_PHRASE.get(expected.group(1))
+                    if expected else None
+                ),
+                'captures': captures,
+            })
+
+    walk(collection['item'], collection.get('auth'))
+    return variables, requests
+
+
+def substitute(text, variables):
+    """Подставляет {{переменные}} коллекции."""
+    return VARIABLE.sub(
+        lambda match: str(variables.get(match.group(1), match.group(0))),
+        text
+    )
+
+
+def unique_value(value, prefix):
+    """Добавляет префикс к значению, сохраняя кавычки JSON."""
+    if value.startswith('"'):
+        return f'"{prefix}{value[1:]}'
+    return f'{prefix}{value}'
+
+
+async def fetch(host, port, method, target, headers, body, timeout):
+    """Минимальный HTTP/1.1 клиент на asyncio: одно соединение на запрос."""
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port), timeout
+    )
+    try:
+        lines = [
+            f'{method} {target} HTTP/1.1',
+            f'Host: {host}:{port}',
+            'Connection: close',
+            f'Content-Length: {len(body)}',
+            *(f'{key}: {value}' for key, value in headers),
+            '', '',
+        ]
+        writer.write('\r\n'.join(lines).encode() + body)
+        await writer.drain()
+        raw = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    head, _, payload = raw.partition(b'\r\n\r\n')
+    status_line, *header_lines = head.decode('latin-1').split('\r\n')
+    response_headers = {}
+    for line in header_lines:
+        key, _, value = line.partition(':')
+        response_headers[key.strip().lower()] = value.strip()
+    if response_headers.get('transfer-encoding') == 'chunked':
+        payload = dechunk(payload)
+    return int(status_line.split(' ', 2)[1]), payload
+
+
+def dechunk(payload):
+    """Собирает тело ответа с Transfer-Encoding: chunked."""
+    chunks = []
+    while payload:
+        size, _, payload = payload.partition(b'\r\n')
+        size = int(size.split(b';')[0], 16)
+        if size == 0:
+            break
+        chunks.append(payload[:size])
+        payload = payload[size + 2:]
+    return b''.join(chunks)
+
+
+def start_server(command, host, port, timeout=30):
+    """Запускает сервер командой command и ждет, пока откроется порт."""
+    server = subprocess.Popen(
+        command, cwd=settings.BASE_DIR,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), 1).close()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.2)
+    server.terminate()
+    raise CommandError(f'Сервер {command} не запустился.')
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочный прогон Postman-коллекции.
+    Каждый виртуальный пользователь проходит коллекцию по порядку со
+    своими переменными: подставляет {{переменные}}, берет токены и id
+    из ответов по скриптам коллекции. Пользователи работают
+    параллельно на asyncio. В отчете пропускная способность,
+    перцентили задержки, ошибки и несовпадения статусов с ожидаемыми.
+    """
+
+    help = 'Параллельный прогон Postman-коллекции против сервера.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collection', default=str(DEFAULT_COLLECTION))
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--iterations', type=int, default=1,
+                            help='Проходов коллекции на пользователя.')
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--start-server', action='store_true',
+                            help='Запустить runserver на адресе --base-url.')
+        parser.add_argument('--output', help='Файл для отчета JSON.')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['base_url'])
+        if url.scheme != 'http':
+            raise CommandError('Поддерживается только http.')
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.timeout = options['timeout']
+        self.variables, self.requests = load_collection(options['collection'])
+        self.variables['baseUrl'] = options['base_url'].rstrip('/')
+        server = None
+        if options['start_server']:
+            server = self.start_server()
+        try:
+            started = time.perf_counter()
+            results = asyncio.run(self.run(
+                options['concurrency'], options['iterations']
+            ))
+            elapsed = time.perf_counter() - started
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+        report = self.build_report(results, elapsed)
+        self.print_report(report)
+        if options.get('output'):
+            with open(options['output'], 'w', encoding='utf-8') as target:
+                json.dump(report, target, ensure_ascii=False, indent=2)
+        return None
+
+    def start_server(self):
+        return start_server(
+            [sys.executable, 'manage.py', 'runserver', '--noreload',
+             f'{self.host}:{self.port}'],
+            self.host, self.port
+        )
+
+    async def run(self, concurrency, iterations):
+        results = []
+        await asyncio.gather(*(
+            self.virtual_user(number, iterations, results)
+            for number in range(concurrency)
+        ))
+        return results
+
+    async def virtual_user(self, number, iterations, results):
+        for iteration in range(iterations):
+            variables = dict(self.variables)
+            prefix = f'vu{number}i{iteration}{time.time_ns() % 10**6}-'
+            for name in UNIQUE_VARIABLES:
+                if name in variables:
+                    variables[name] = unique_value(variables[name], prefix)
+            for request in self.requests:
+                results.append(await self.send(request, variables))
+
+    def prepare(self, request, variables):
+        url = urlsplit(substitute(request['url'], variables))
+        target = url.path + (f'?{url.query}' if url.query else '')
+        headers = [
+            (key, substitute(value, variables))
+            for key, value in request['headers']
+        ]
+        auth = request['auth'] or {}
+        if auth.get('type') == 'apikey':
+            params = {item['key']: item['value'] for item in auth['apikey']}
+            headers.append((
+                params.get('key', 'Authorization'),
+                substitute(params.get('value', ''), variables)
+            ))
+        body = substitute(request['body'], variables).encode()
+        if body and not any(
+            key.lower() == 'content-type' for key, _ in headers
+        ):
+            headers.append(('Content-Type', 'application/json'))
+        return target, headers, body
+
+    async def send(self, request, variables):
+        target, headers, body = self.prepare(request, variables)
+        started = time.perf_counter()
+        result = {'name': request['name'], 'expected': request['expected']}
+        try:
+            status, payload = await fetch(
+                self.host, self.port, request['method'], target, headers,
+                body, self.timeout
+            )
+        except (OSError, asyncio.TimeoutError, ValueError) as error:
+            result.update(status=None, error=type(error).__name__)
+            status, payload = None, b''
+        else:
+            result['status'] = status
+        result['latency'] = time.perf_counter() - started
+        if request['captures'] and payload:
+            try:
+                data = json.loads(payload)
+            except ValueError:
+                data = None
+            for name, capture in request['captures']:
+                value = extract_value(data, capture)
+                if value is not None:
+                    variables[name] = value
+        return result
+
+    def build_report(self, results, elapsed):
+        latencies = [result['latency'] * 1000 for result in results]
+        errors = [
+            result for result in results
+            if result['status'] is None or result['status'] >= 500
+        ]
+        mismatches = defaultdict(Counter)
+        for result in results:
+            if (result['expected'] is not None
+                    and result['status'] != result['expected']):
+                mismatches[result['name']][
+                    f'{result["expected"]}->{result["status"]}'
+                ] += 1
+        by_request = defaultdict(list)
+        for result in results:
+            by_request[result['name']].append(result['latency'] * 1000)
+        return {
+            'requests': len(results),
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(len(results) / elapsed, 1),
+            'latency_ms': {
+                f'p{percent}': round(percentile(latencies, percent), 2)
+                for percent in (50, 90, 95, 99)
+            },
+            'errors': len(errors),
+            'error_rate': round(len(errors) / len(results), 4),
+            'statuses': dict(Counter(
+                str(result['status']) for result in results
+            )),
+            'mismatches': {
+                name: dict(counter) for name, counter in mismatches.items()
+            },
+            'slowest_p95_ms': dict(sorted(
+                (
+                    (name, round(percentile(values, 95), 2))
+                    for name, values in by_request.items()
+                ),
+                key=lambda item: item[1], reverse=True
+            )[:10]),
+        }
+
+    def print_report(self, report):
+        self.stdout.write(
+            f'Запросов: {report["requests"]} за {report["elapsed_s"]} с, '
+            f'{report["throughput_rps"]} запр/с'
+        )
+        self.stdout.write('Задержка, мс: ' + ', '.join(
+            f'{key}={value}' for key, value in report['latency_ms'].items()
+        ))
+        self.stdout.write(
+            f'Ошибок (5xx и сетевых): {report["errors"]} '
+            f'({report["error_rate"]:.2%})'
+        )
+        for name, counter in report['mismatches'].items():
+            self.stdout.write(f'  статус не совпал: {name} {counter}')
@@ -0,0 +1,77 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api.jobs import Worker, get_config, run_threads
+from api.metrics import archive, registry
+
+
+def run_process(threads, stop, *arguments):
+    """Дочерний процесс: потоки воркеров, затем сброс метрик."""
+    try:
+        run_threads(threads, stop, *arguments)
+    finally:
+        # Процесс multiprocessing выходит без atexit.
+        registry.flush()
+
+
+class Command(BaseCommand):
+    """
+    Запускает воркеры очереди фоновых задач: --processes процессов
+    по --threads потоков. С --burst выходит, когда очередь пуста.
+    """
+
+    help = 'Воркеры очереди фоновых задач.'
+
+    def add_arguments(self, parser):
+        config = get_config()
+        parser.add_argument('--processes', type=int,
+                            default=config.get('PROCESSES', 1))
+        parser.add_argument('--threads', type=int,
+                            default=config.get('THREADS', 4))
+        parser.add_argument('--poll-interval', type=float,
+                            default=config.get('POLL_INTERVAL', 1.0))
+        parser.add_argument('--burst', action='store_true')
+
+    def handle(self, *args, **options):
+        processes, threads = options['processes'], options['threads']
+        arguments = (options['burst'], options['poll_interval'])
+        if processes == 1 and threads == 1:
+            # Один воркер прямо в текущем потоке.
+            stop = threading.Event()
+            signal.signal(signal.SIGTERM, lambda *_: stop.set())
+            try:
+                Worker(scheduler=True).run(stop, *arguments)
+            except KeyboardInterrupt:
+                pass
+            return
+        if processes == 1:
+            stop = threading.Event()
+            signal.signal(signal.SIGTERM, lambda *_: stop.set())
+            run_threads(threads, stop, *arguments)
+            return
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        # Дочерним процессам нужны свои соединения с базой.
+        connections.close_all()
+        children = [
+            context.Process(
+                target=run_process, args=(threads, stop, *arguments)
+            )
+            for _ in range(processes)
+        ]
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        for child in children:
+            child.start()
+        try:
+            for child in children:
+                child.join()
+        except KeyboardInterrupt:
+            stop.set()
+            for child in children:
+                child.join()
+        for child in children:
+            archive(child.pid)
@@ -0,0 +1,278 @@
+"""
+Метрики воркеров в формате Prometheus.
+
+Каждый процесс копит счетчики и гистограммы в памяти и раз в
+FLUSH_INTERVAL секунд, а также при выходе сбрасывает их в свой файл
+metrics-<pid>.json в общем каталоге. Эндпоинт метрик складывает файлы
+всех воркеров, поэтому значения верны при любом числе процессов
+gunicorn.
+
+Файл завершившегося процесса добавляется в metrics-archive.json и
+удаляется (archive; хуки gunicorn.conf.py и run_workers): счетчики не
+убывают, когда воркер перезапускается, а новый процесс получает PID
+старого. Слияние и чтение файлов идут под блокировкой metrics.lock,
+поэтому сумма не видит файл дважды или ни разу.
+"""
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+HELP = {
+    'foodgram_request_duration_seconds': (
+        'histogram', 'Время обработки запроса по представлению.'),
+    'foodgram_requests_total': (
+        'counter', 'Количество запросов по представлению и статусу.'),
+    'foodgram_db_queries_total': (
+        'counter', 'Количество SQL-запросов по представлению.'),
+    'foodgram_exceptions_total': (
+        'counter', 'Необработанные исключения по представлению.'),
+    'foodgram_cache_requests_total': (
+        'counter', 'Обращения к кэшам приложения: hit или miss.'),
+    'foodgram_throttled_total': (
+        'counter', 'Запросы, отклоненные ограничением частоты.'),
+    'foodgram_jobs_total': (
+        'counter', 'Выполненные фоновые задачи по результату.'),
+    'foodgram_job_duration_seconds': (
+        'histogram', 'Время выполнения фоновой задачи.'),
+    'foodgram_static_manifest_load_seconds': (
+        'histogram', 'Время чтения манифеста статики процессом.'),
+}
+
+
+class MetricsRegistry:
+    """Метрики текущего процесса с периодическим сбросом в файл."""
+
+    def __init__(self):
+        """Создает пустой реестр."""
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.last_flush = 0.0
+
+    @property
+    def config(self):
+        return getattr(settings, 'METRICS', {})
+
+    @property
+    def directory(self):
+        return Path(self.config['DIRECTORY'])
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.counters[(name, labels)] += value
+        self.maybe_flush()
+
+    def observe(self, name, labels, value):
+        index = bisect.bisect_left(LATENCY_BUCKETS, value)
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                # Счетчики корзин, затем +Inf, сумма и количество.
+                histogram = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0]
+                self.histograms[(name, labels)] = histogram
+            histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if time.monotonic() - self.last_flush >= self.config.get(
+            'FLUSH_INTERVAL', 1.0
+        ):
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [
+                    [name, labels, value]
+                    for (name, labels), value in self.counters.items()
+                ],
+                'histograms': [
+                    [name, labels, list(values)]
+                    for (name, labels), values in self.histograms.items()
+                ],
+            }
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.counters and not self.histograms:
+            return
+        directory = self.directory
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'metrics-{os.getpid()}.json'
+        tmp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        tmp_path.write_text(json.dumps(self.snapshot()))
+        os.replace(tmp_path, path)
+
+    def collect(self):
+        """Складывает метрики всех процессов из общего каталога."""
+        self.flush()
+        counters = defaultdict(float)
+        histograms = {}
+        with locked(self.directory, fcntl.LOCK_SH):
+            for path in self.directory.glob('metrics-*.json'):
+                merge(read(path), counters, histograms)
+        return counters, histograms
+
+
+def read(path):
+    """Метрики из файла; пустые, если файла нет или он поврежден."""
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {'counters': [], 'histograms': []}
+
+
+def merge(data, counters, histograms):
+    """Прибавляет метрики data к counters и histograms."""
+    for name, labels, value in data['counters']:
+        counters[(name, tuple(map(tuple, labels)))] += value
+    for name, labels, values in data['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        if key not in histograms:
+            histograms[key] = list(values)
+        else:
+            histograms[key] = [
+                a + b for a, b in zip(histograms[key], values)
+            ]
+
+
+@contextmanager
+def locked(directory, operation):
+    """Блокировка flock (fcntl.LOCK_SH или LOCK_EX) каталога метрик."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / 'metrics.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# pid, ожидающие переноса в архив в текущем потоке. Мастер gunicorn
+# вызывает archive из обработчика SIGCHLD: повторный вызов, пока тот
+# же поток держит блокировку, ждал бы flock сам себя, поэтому он
+# только добавляет pid, а переносит их внешний вызов.
+archiving = threading.local()
+
+
+def archive(pid=None):
+    """
+    Переносит метрики завершившегося процесса pid (без pid — всех
+    процессов, например, оставшиеся от прошлого запуска) в
+    metrics-archive.json.
+    """
+    pending = getattr(archiving, 'pending', None)
+    if pending is not None:
+        pending.append(pid)
+        return
+    archiving.pending = [pid]
+    directory = registry.directory
+    try:
+        with locked(directory, fcntl.LOCK_EX):
+            while archiving.pending:
+                move_to_archive(directory, archiving.pending.pop(0))
+    finally:
+        archiving.pending = None
+
+
+def move_to_archive(directory, pid):
+    """Перенос в архив под блокировкой, вызывающий ее уже взял."""
+    archive_path = directory / 'metrics-archive.json'
+    paths = (
+        [directory / f'metrics-{pid}.json'] if pid is not None
+        else [
+            path for path in directory.glob('metrics-*.json')
+            if path != archive_path
+        ]
+    )
+    paths = [path for path in paths if path.exists()]
+    if not paths:
+        return
+    counters = defaultdict(float)
+    histograms = {}
+    for path in [archive_path] + paths:
+        merge(read(path), counters, histograms)
+    tmp_path = archive_path.with_suffix('.tmp')
+    tmp_path.write_text(json.dumps({
+        'counters': [
+            [name, labels, value]
+            for (name, labels), value in counters.items()
+        ],
+        'histograms': [
+            [name, labels, values]
+            for (name, labels), values in histograms.items()
+        ],
+    }))
+    os.replace(tmp_path, archive_path)
+    for path in paths:
+        path.unlink()
+
+
+registry = MetricsRegistry()
+# Последний интервал процесса не теряется при штатном выходе.
+atexit.register(registry.flush)
+
+
+def format_labels(labels, extra=()):
+    """Форматирует метки в виде {key="value",...}."""
+    pairs = [
+        '{}="{}"'.format(key, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"').replace('\n', r'\n'))
+        for key, value in tuple(labels) + tuple(extra)
+    ]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def render_metrics():
+    """Отдает метрики всех воркеров в текстовом формате Prometheus."""
+    counters, histograms = registry.collect()
+    by_name = defaultdict(list)
+    for (name, labels), value in sorted(counters.items()):
+        by_name[name].append(f'{name}{format_labels(labels)} {value}')
+    for (name, labels), values in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(
+            LATENCY_BUCKETS + ('+Inf',), values[:-2]
+        ):
+            cumulative += count
+            by_name[name].append('{}_bucket{} {}'.format(
+                name, format_labels(labels, (('le', bound),)), cumulative
+            ))
+        by_name[name].append(
+            f'{name}_sum{format_labels(labels)} {values[-2]}'
+        )
+        by_name[name].append(
+            f'{name}_count{format_labels(labels)} {values[-1]}'
+        )
+    lines = []
+    for name, samples in by_name.items():
+        kind, description = HELP.get(name, ('untyped', name))
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+
+def record_cache(cache, hit):
+    """Учитывает попадание или промах кэша cache."""
+    registry.inc(
+        'foodgram_cache_requests_total',
+        (('cache', cache), ('result', 'hit' if hit else 'miss'))
+    )
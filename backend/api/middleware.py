@@ -0,0 +1,473 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections, transaction
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from rest_framework.exceptions import AuthenticationFailed
+
+from api.authentication import CachedTokenAuthentication
+from api.metrics import registry
+
+logger = logging.getLogger('recipes')
+sql_logger = logging.getLogger('recipes.sql')
+
+
+class RequestTiming:
+    """
+    Замеры одного запроса: SQL, представление, сериализация ответа
+    (часть времени представления) и рендеринг.
+    """
+
+    def __init__(self, endpoint):
+        """Начинает замер для эндпоинта endpoint."""
+        self.endpoint = endpoint
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.view_start = time.perf_counter()
+        self.render_start = None
+        self.render_end = None
+
+    def __call__(self, execute, sql, params, many, context):
+        # Обертка для connection.execute_wrapper: считает запросы и время.
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+    def finish_render(self, response):
+        self.render_end = time.perf_counter()
+        return response
+
+    def as_dict(self, total):
+        view_end = self.render_start or time.perf_counter()
+        render = 0.0
+        if self.render_start is not None and self.render_end is not None:
+            render = self.render_end - self.render_start
+        return {
+            'endpoint': self.endpoint,
+            'db_queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 2),
+            'serialize_ms': round(self.serialize_time * 1000, 2),
+            'view_ms': round((view_end - self.view_start) * 1000, 2),
+            'render_ms': round(render * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+        }
+
+
+@contextmanager
+def serializing(request):
+    """Время блока копится в сегменте serialize замера запроса request."""
+    timing = getattr(request, '_timing', None)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timing is not None:
+            timing.serialize_time += time.perf_counter() - start
+
+
+def timed_serializer(request, serializer):
+    """
+    Возвращает serializer, чье представление (serializer.data)
+    замеряется в сегменте serialize запроса request.
+    """
+    representation = serializer.to_representation
+
+    def to_representation(instance):
+        with serializing(request):
+            return representation(instance)
+
+    serializer.to_representation = to_representation
+    return serializer
+
+
+def add_wrapper(wrapper, alias=None):
+    """
+    Подключает execute_wrapper к соединению alias, без alias — ко всем.
+    Соединения у каждого потока свои: под ASGI функция вызывается
+    через sync_to_async в потоке, где выполняются запросы к базе.
+    """
+    aliases = [alias] if alias else list(connections)
+    for name in aliases:
+        connections[name].execute_wrappers.append(wrapper)
+
+
+def remove_wrapper(wrapper):
+    """Отключает execute_wrapper от всех соединений текущего потока."""
+    for alias in connections:
+        wrappers = connections[alias].execute_wrappers
+        if wrapper in wrappers:
+            wrappers.remove(wrapper)
+
+
+class AsyncCapableMiddleware:
+    """
+    Основа middleware, работающего и под WSGI, и под ASGI. Если
+    следующий обработчик — корутина, __call__ возвращает корутину
+    acall: запрос не занимает поток воркера, пока ждет базу, а
+    middleware не оборачивается в async_to_sync/sync_to_async.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """Запоминает обработчик и режим, в котором он работает."""
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.acall(request)
+        return self.call(request)
+
+
+class ServerTimingMiddleware(AsyncCapableMiddleware):
+    """
+    Замеряет количество SQL-запросов, время БД, представления,
+    сериализации (serializing, timed_serializer) и рендеринга ответа.
+    Результат отдается в заголовке Server-Timing и пишется строкой
+    в логгер 'recipes'.
+    Выключенный в настройках REQUEST_TIMING middleware не подключается.
+    """
+
+    def __init__(self, get_response):
+        """Читает настройки; выключенный middleware не подключается."""
+        config = getattr(settings, 'REQUEST_TIMING', {})
+        if not config.get('ENABLED', False):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.sample_rate = config.get('SAMPLE_RATE', 1.0)
+        self.endpoint_rates = config.get('ENDPOINT_SAMPLE_RATES', {})
+
+    def call(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        timing = getattr(request, '_timing', None)
+        if timing is None:
+            return response
+        remove_wrapper(timing)
+        return self.finish(request, response, timing, start)
+
+    async def acall(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        timing = getattr(request, '_timing', None)
+        if timing is None:
+            return response
+        # process_view под ASGI выполняется через sync_to_async,
+        # обертка подключена к соединениям того же потока.
+        await sync_to_async(remove_wrapper)(timing)
+        return self.finish(request, response, timing, start)
+
+    def finish(self, request, response, timing, start):
+        data = timing.as_dict(time.perf_counter() - start)
+        response['Server-Timing'] = (
+            'db;dur={db_ms};desc="{db_queries} queries", '
+            'serialize;dur={serialize_ms}, view;dur={view_ms}, '
+            'render;dur={render_ms}, total;dur={total_ms}'.format(**data)
+        )
+        logger.info(
+            'timing %s %s status=%s endpoint=%s db_queries=%s db_ms=%s '
+            'serialize_ms=%s view_ms=%s render_ms=%s total_ms=%s',
+            request.method, request.path, response.status_code,
+            data['endpoint'], data['db_queries'], data['db_ms'],
+            data['serialize_ms'], data['view_ms'], data['render_ms'],
+            data['total_ms'],
+            extra={'timing': data}
+        )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        endpoint = request.resolver_match.view_name
+        rate = self.endpoint_rates.get(endpoint, self.sample_rate)
+        if rate < 1 and random.random() >= rate:
+            return None
+        timing = RequestTiming(endpoint)
+        add_wrapper(timing)
+        request._timing = timing
+        return None
+
+    def process_template_response(self, request, response):
+        timing = getattr(request, '_timing', None)
+        if timing is not None:
+            timing.render_start = time.perf_counter()
+            response.add_post_render_callback(timing.finish_render)
+        return response
+
+
+class MetricsMiddleware(AsyncCapableMiddleware):
+    """
+    Пишет в реестр метрик время ответа, статус и число SQL-запросов
+    по каждому представлению DRF (имя маршрута и action).
+    """
+
+    def __init__(self, get_response):
+        """Читает настройки; выключенный middleware не подключается."""
+        if not getattr(settings, 'METRICS', {}).get('ENABLED', False):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def call(self, request):
+        start = time.perf_counter()
+        counter = RequestTiming(None)
+        with connections['default'].execute_wrapper(counter):
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, counter)
+        return response
+
+    async def acall(self, request):
+        start = time.perf_counter()
+        counter = RequestTiming(None)
+        await sync_to_async(add_wrapper)(counter, 'default')
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(remove_wrapper)(counter)
+        self.record(request, response, time.perf_counter() - start, counter)
+        return response
+
+    def record(self, request, response, duration, counter):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        labels = (('view', view), ('method', request.method))
+        registry.observe(
+            'foodgram_request_duration_seconds', labels, duration
+        )
+        registry.inc(
+            'foodgram_requests_total',
+            labels + (('status', response.status_code),)
+        )
+        if counter.queries:
+            registry.inc(
+                'foodgram_db_queries_total', labels, counter.queries
+            )
+
+    def process_exception(self, request, exception):
+        registry.inc(
+            'foodgram_exceptions_total',
+            (('view', request.resolver_match.view_name),
+             ('exception', type(exception).__name__))
+        )
+
+
+class SlowQueryLogger:
+    """
+    Обертка execute_wrapper: запросы дольше порога пишутся в логгер
+    'recipes.sql' с параметрами, представлением и планом выполнения.
+    """
+
+    def __init__(self, request, connection, threshold, explain):
+        """Запоминает запрос, соединение и порог в секундах."""
+        self.request = request
+        self.connection = connection
+        self.threshold = threshold
+        self.explain = explain
+        self.explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.explaining:
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - start
+        if duration >= self.threshold:
+            self.log(sql, params, many, duration)
+        return result
+
+    def get_plan(self, sql, params):
+        prefix = self.connection.ops.explain_query_prefix()
+        self.explaining = True
+        try:
+            # Своя точка сохранения: ошибка EXPLAIN внутри транзакции
+            # запроса (PostgreSQL прерывает ее целиком) откатывает
+            # только EXPLAIN.
+            with transaction.atomic(using=self.connection.alias):
+                with self.connection.cursor() as cursor:
+                    cursor.execute(f'{prefix} {sql}', params)
+                    return '\n'.join(
+                        ' '.join(str(column) for column in row)
+                        for row in cursor.fetchall()
+                    )
+        except DatabaseError as error:
+            return f'план недоступен: {error}'
+        finally:
+            self.explaining = False
+
+    def log(self, sql, params, many, duration):
+        match = self.request.resolver_match
+        view = match.view_name if match else self.request.path
+        plan = None
+        if (self.explain and not many
+                and sql.lstrip()[:6].upper() == 'SELECT'):
+            plan = self.get_plan(sql, params)
+        sql_logger.warning(
+            'slow query %.1f ms view=%s method=%s\nsql: %s\n'
+            'params: %r\nplan:\n%s',
+            duration * 1000, view, self.request.method, sql, params, plan,
+            extra={'view': view, 'duration_ms': duration * 1000}
+        )
+
+
+class SlowQueryMiddleware(AsyncCapableMiddleware):
+    """Подключает SlowQueryLogger к соединениям на время запроса."""
+
+    def __init__(self, get_response):
+        """Читает настройки; выключенный middleware не подключается."""
+        config = getattr(settings, 'SLOW_QUERY_LOG', {})
+        if not config.get('ENABLED', False):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.threshold = config.get('THRESHOLD_MS', 200) / 1000
+        self.explain = config.get('EXPLAIN', True)
+
+    def install(self, request):
+        """Подключает журнал к соединению default текущего потока."""
+        wrapper = SlowQueryLogger(
+            request, connections['default'], self.threshold, self.explain
+        )
+        add_wrapper(wrapper, 'default')
+        return wrapper
+
+    def call(self, request):
+        wrapper = self.install(request)
+        try:
+            return self.get_response(request)
+        finally:
+            remove_wrapper(wrapper)
+
+    async def acall(self, request):
+        wrapper = await sync_to_async(self.install)(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            await sync_to_async(remove_wrapper)(wrapper)
+
+
+class ProfilingMiddleware(AsyncCapableMiddleware):
+    """
+    Профилирует обработку запроса представлением через cProfile.
+    Администратор добавляет к запросу ?_profile=1 и получает сводку
+    вместо ответа, либо ?_profile=save — профиль сохраняется
+    в .pstats файл. Кроме того, доля запросов по эндпоинтам из
+    PROFILING['SAMPLE_RATES'] профилируется и сохраняется в файл.
+    Для остальных запросов middleware ничего не делает.
+
+    Под ASGI профилей два: цикла событий (в него попадают и корутины
+    других запросов, выполнявшиеся в то же время) и потока, в котором
+    sync_to_async выполняет синхронную часть запроса — ORM,
+    синхронные middleware и представления.
+    """
+
+    def __init__(self, get_response):
+        """Читает настройки; выключенный middleware не подключается."""
+        config = getattr(settings, 'PROFILING', {})
+        if not config.get('ENABLED', False):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.directory = Path(config['DIRECTORY'])
+        self.sample_rates = config.get('SAMPLE_RATES', {})
+        self.limit = config.get('LIMIT', 40)
+
+    def call(self, request):
+        endpoint, mode = self.get_mode(request)
+        if mode is not None and self.requested(request):
+            if not self.is_admin(request):
+                mode = None
+        if mode is None:
+            return self.get_response(request)
+        # Профилируется вся обработка после этого middleware:
+        # process_view остальных middleware, представление, обработка
+        # исключений, ATOMIC_REQUESTS и рендеринг ответа.
+        profiler = cProfile.Profile()
+        response = profiler.runcall(self.get_response, request)
+        return self.respond(response, endpoint, mode, profiler)
+
+    async def acall(self, request):
+        endpoint, mode = self.get_mode(request)
+        if mode is not None and self.requested(request):
+            if not await sync_to_async(self.is_admin)(request):
+                mode = None
+        if mode is None:
+            return await self.get_response(request)
+        loop_profiler = cProfile.Profile()
+        thread_profiler = cProfile.Profile()
+        await sync_to_async(thread_profiler.enable)()
+        loop_profiler.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            loop_profiler.disable()
+            await sync_to_async(thread_profiler.disable)()
+        return self.respond(
+            response, endpoint, mode, loop_profiler, thread_profiler
+        )
+
+    def respond(self, response, endpoint, mode, *profilers):
+        """Ответ со сводкой профиля или с именем сохраненного файла."""
+        stream = io.StringIO()
+        stats = pstats.Stats(*profilers, stream=stream)
+        if mode == 'save':
+            response['X-Profile-File'] = self.save(stats, endpoint)
+            return response
+        stats.sort_stats('cumulative').print_stats(self.limit)
+        return HttpResponse(stream.getvalue(), content_type='text/plain')
+
+    def requested(self, request):
+        """Профиль запрошен параметром ?_profile, а не выборкой."""
+        return '_profile' in request.GET
+
+    def is_admin(self, request):
+        user = request.user
+        if not user.is_authenticated:
+            try:
+                result = CachedTokenAuthentication().authenticate(request)
+            except AuthenticationFailed:
+                return False
+            if result is None:
+                return False
+            user = result[0]
+        return user.admin
+
+    def get_mode(self, request):
+        """
+        Эндпоинт и режим профилирования; режим None — без профиля.
+        Права на ?_profile проверяет is_admin: ему нужны кэш и база.
+        """
+        try:
+            endpoint = resolve(request.path_info).view_name
+        except Resolver404:
+            return None, None
+        mode = request.GET.get('_profile')
+        if mode is not None:
+            return endpoint, mode
+        rate = self.sample_rates.get(endpoint)
+        if not rate or random.random() >= rate:
+            return endpoint, None
+        return endpoint, 'save'
+
+    def save(self, stats, endpoint):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = '{}-{}-{}.pstats'.format(
+            endpoint.replace(':', '_'), time.strftime('%Y%m%d%H%M%S'),
+            os.getpid()
+        )
+        stats.dump_stats(self.directory / name)
+        return name
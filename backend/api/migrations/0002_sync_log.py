@@ -0,0 +1,50 @@
+# Generated by Django 4.2.17 on 2026-10-19 10:18
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def number_recipes(apps, schema_editor):
+    """Существующие рецепты получают номера по id."""
+    Recipes = apps.get_model('recipes', 'Recipes')
+    SyncCounter = apps.get_model('api', 'SyncCounter')
+    Recipes.objects.update(sync_seq=F('id'))
+    last = Recipes.objects.aggregate(last=Max('id'))['last'] or 0
+    SyncCounter.objects.update_or_create(pk=1, defaults={'value': last})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_job_queue'),
+        ('recipes', '0005_recipes_sync_seq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedRecipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipe_id', models.BigIntegerField(verbose_name='Рецепт')),
+                ('sync_seq', models.BigIntegerField(null=True, unique=True, verbose_name='Номер изменения')),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Удален')),
+            ],
+            options={
+                'verbose_name': 'Удаленный рецепт',
+                'verbose_name_plural': 'Удаленные рецепты',
+            },
+        ),
+        migrations.CreateModel(
+            name='SyncCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0, verbose_name='Последний номер')),
+                ('horizon', models.BigIntegerField(default=0, verbose_name='Граница журнала удалений')),
+            ],
+            options={
+                'verbose_name': 'Счетчик изменений',
+                'verbose_name_plural': 'Счетчики изменений',
+            },
+        ),
+        migrations.RunPython(number_recipes, migrations.RunPython.noop),
+    ]
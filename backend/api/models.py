@@ -1,3 +1,119 @@
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class JobStatus(models.TextChoices):
+    """Состояния фоновой задачи."""
+
+    QUEUED = 'queued', 'В очереди'
+    RUNNING = 'running', 'Выполняется'
+    DONE = 'done', 'Выполнена'
+    FAILED = 'failed', 'Ошибка'
+
+
+class Job(models.Model):
+    """Фоновая задача очереди api.jobs."""
+
+    name = models.CharField(
+        verbose_name='Задача',
+        max_length=200)
+    args = models.JSONField(
+        verbose_name='Аргументы',
+        default=list)
+    kwargs = models.JSONField(
+        verbose_name='Именованные аргументы',
+        default=dict)
+    status = models.CharField(
+        verbose_name='Состояние',
+        max_length=10,
+        choices=JobStatus.choices,
+        default=JobStatus.QUEUED)
+    run_at = models.DateTimeField(
+        verbose_name='Запустить не раньше',
+        default=timezone.now)
+    attempts = models.PositiveIntegerField(
+        verbose_name='Попыток',
+        default=0)
+    max_attempts = models.PositiveIntegerField(
+        verbose_name='Максимум попыток',
+        default=3)
+    # Ключ периодической задачи: одна задача на интервал расписания.
+    key = models.CharField(
+        verbose_name='Ключ',
+        max_length=200,
+        unique=True,
+        null=True,
+        blank=True)
+    locked_by = models.CharField(
+        verbose_name='Воркер',
+        max_length=100,
+        blank=True)
+    locked_at = models.DateTimeField(
+        verbose_name='Взята в работу',
+        null=True,
+        blank=True)
+    last_error = models.TextField(
+        verbose_name='Последняя ошибка',
+        blank=True)
+    created_at = models.DateTimeField(
+        verbose_name='Создана',
+        auto_now_add=True)
+    finished_at = models.DateTimeField(
+        verbose_name='Завершена',
+        null=True,
+        blank=True)
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            # Выборка готовых к запуску задач воркером.
+            models.Index(
+                fields=['status', 'run_at'],
+                name='job_status_run_at_idx')]
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
+
+
+class SyncCounter(models.Model):
+    """
+    Счетчик изменений каталога рецептов (api.sync), одна строка.
+    Номера до horizon удалены из журнала DeletedRecipe.
+    """
+
+    value = models.BigIntegerField(
+        verbose_name='Последний номер',
+        default=0)
+    horizon = models.BigIntegerField(
+        verbose_name='Граница журнала удалений',
+        default=0)
+
+    class Meta:
+        verbose_name = 'Счетчик изменений'
+        verbose_name_plural = 'Счетчики изменений'
+
+    def __str__(self):
+        return f'{self.value}'
+
+
+class DeletedRecipe(models.Model):
+    """Удаленный рецепт в журнале синхронизации клиентов."""
+
+    recipe_id = models.BigIntegerField(
+        verbose_name='Рецепт')
+    sync_seq = models.BigIntegerField(
+        verbose_name='Номер изменения',
+        null=True,
+        unique=True)
+    deleted_at = models.DateTimeField(
+        verbose_name='Удален',
+        auto_now_add=True,
+        db_index=True)
+
+    class Meta:
+        verbose_name = 'Удаленный рецепт'
+        verbose_name_plural = 'Удаленные рецепты'
+
+    def __str__(self):
+        return f'{self.recipe_id} ({self.sync_seq})'
@@ -1,7 +1,16 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class CustomPagination(PageNumberPagination):
     page_size = 6  # Количество объектов на странице
     page_size_query_param = 'limit'
     max_page_size = 10
+
+
+class FeedPagination(CursorPagination):
+    """Курсор по id рецепта: страница ленты — один диапазон индекса."""
+
+    page_size = CustomPagination.page_size
+    page_size_query_param = 'limit'
+    max_page_size = CustomPagination.max_page_size
+    ordering = '-recipe_id'
@@ -25,3 +25,21 @@ class AuthorOrReadOnly(permissions.BasePermission):
             return True
         # Разрешить изменение и удаление только автору
         return obj.author == request.user
+
+
+class IsStaffOrLocalhost(permissions.BasePermission):
+    """Доступ для персонала или запросов с локального адреса."""
+
+    def has_permission(self, request, view):
+        if request.META.get('REMOTE_ADDR') in ('127.0.0.1', '::1'):
+            return True
+        user = request.user
+        return user.is_authenticated and (user.is_staff or user.admin)
+
+
+class IsStaff(permissions.BasePermission):
+    """Доступ только для персонала и администраторов."""
+
+    def has_permission(self, request, view):
+        user = request.user
+        return user.is_authenticated and (user.is_staff or user.admin)
@@ -0,0 +1,153 @@
+"""
+Избранное, корзина и подписки: добавление и удаление пачкой.
+
+Вставка пачки — один INSERT ... SELECT ... ON CONFLICT DO NOTHING
+RETURNING: строки, которые успел вставить параллельный запрос (двойной
+клик), пропускает уникальное ограничение, а результат каждого id
+берется из RETURNING самой вставки, а не из закэшированного состояния.
+Из двух одновременных запросов added получит только тот, чья строка
+действительно вставлена. Удаление пачки — один DELETE ... RETURNING:
+removed получают только удаленные этим запросом строки. Одиночные
+действия вьюсетов — та же пачка из одного id.
+
+Запросы не отправляют post_save и post_delete, поэтому сброс состояния
+пользователя и обновление ленты при подписке вызываются здесь явно.
+
+SQL написан вручную: bulk_create(ignore_conflicts=True) не возвращает
+ключи вставленных строк, а filter().delete() — удаленные id. RETURNING
+вместе с ON CONFLICT требует PostgreSQL 9.5+ или SQLite 3.35+ (в
+Django — connection.features.can_return_rows_from_bulk_insert);
+на более старой базе manage.py check сообщает ошибку api.E001.
+"""
+from django.core import checks
+from django.db import connection
+
+from api.feed import backfill, cleanup
+from api.interactions import invalidate
+from recipes.models import Favorite, Follower, Recipes, ShoppingList, User
+
+
+# Вид связи: модель, поле пользователя, поле объекта и модель объекта.
+KINDS = {
+    'favorite': (Favorite, 'author', 'recipe', Recipes),
+    'shopping_cart': (ShoppingList, 'author', 'recipe', Recipes),
+    'subscribe': (Follower, 'user', 'author', User),
+}
+
+MAX_BATCH_SIZE = 100
+
+ADDED = 'added'
+EXISTS = 'exists'
+REMOVED = 'removed'
+MISSING = 'missing'
+NOT_FOUND = 'not_found'
+SELF = 'self'
+
+
+@checks.register(checks.Tags.compatibility)
+def check_returning(app_configs=None, **kwargs):
+    """База должна поддерживать INSERT ... RETURNING."""
+    if connection.features.can_return_rows_from_bulk_insert:
+        return []
+    return [checks.Error(
+        'api.relations требует INSERT ... ON CONFLICT ... RETURNING: '
+        'PostgreSQL 9.5+ или SQLite 3.35+.',
+        id='api.E001',
+    )]
+
+
+def get_columns(kind):
+    """Таблица, ее ключ и столбцы связи kind, уже в кавычках."""
+    model, user_field, target_field, target_model = KINDS[kind]
+    quote = connection.ops.quote_name
+    return (
+        quote(model._meta.db_table),
+        quote(model._meta.pk.column),
+        quote(model._meta.get_field(user_field).column),
+        quote(model._meta.get_field(target_field).column),
+        quote(target_model._meta.db_table),
+        quote(target_model._meta.pk.column),
+    )
+
+
+def insert(kind, user, ids):
+    """
+    Вставляет строки связи kind для существующих объектов ids;
+    {id объекта: id вставленной строки} — только для вставленных.
+    """
+    table, pk, user_column, target_column, target_table, target_pk = (
+        get_columns(kind)
+    )
+    placeholders = ', '.join(['%s'] * len(ids))
+    params = [user.id, *ids]
+    condition = f'{target_pk} IN ({placeholders})'
+    if kind == 'subscribe':
+        condition += f' AND {target_pk} <> %s'
+        params.append(user.id)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({user_column}, {target_column}) '
+            f'SELECT %s, {target_pk} FROM {target_table} '
+            f'WHERE {condition} '
+            f'ON CONFLICT DO NOTHING RETURNING {pk}, {target_column}',
+            params
+        )
+        return {target_id: row_id for row_id, target_id in cursor.fetchall()}
+
+
+def add_rows(kind, user, ids):
+    """
+    Добавляет объекты ids в связь kind; ({id: результат},
+    {id: id вставленной строки}).
+    """
+    target_model = KINDS[kind][3]
+    rows = insert(kind, user, ids)
+    rest = set(ids) - set(rows)
+    # Запрос нужен, только если что-то не вставилось.
+    found = set(
+        target_model.objects.filter(id__in=rest).values_list('id', flat=True)
+    ) if rest else set()
+    results = {}
+    for target_id in ids:
+        if target_id in rows:
+            results[target_id] = ADDED
+        elif target_id not in found:
+            results[target_id] = NOT_FOUND
+        elif kind == 'subscribe' and target_id == user.id:
+            results[target_id] = SELF
+        else:
+            results[target_id] = EXISTS
+    if rows:
+        invalidate(user.id)
+        if kind == 'subscribe':
+            for author_id in rows:
+                backfill(user.id, author_id)
+    return results, rows
+
+
+def add(kind, user, ids):
+    """Добавляет объекты ids в связь kind; {id: результат}."""
+    return add_rows(kind, user, ids)[0]
+
+
+def remove(kind, user, ids):
+    """Убирает объекты ids из связи kind; {id: результат}."""
+    table, _, user_column, target_column, _, _ = get_columns(kind)
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE {user_column} = %s '
+            f'AND {target_column} IN ({placeholders}) '
+            f'RETURNING {target_column}',
+            [user.id, *ids]
+        )
+        removed = {target_id for target_id, in cursor.fetchall()}
+    if removed:
+        invalidate(user.id)
+        if kind == 'subscribe':
+            for author_id in removed:
+                cleanup(user.id, author_id)
+    return {
+        target_id: REMOVED if target_id in removed else MISSING
+        for target_id in ids
+    }
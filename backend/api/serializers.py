@@ -1,16 +1,22 @@
+import logging
 import re
 from django.contrib.auth import authenticate
 from django.db import transaction
-from django.shortcuts import get_object_or_404
+from django.db.models import Prefetch
 from rest_framework import serializers
 from drf_extra_fields.fields import Base64ImageField
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.fields import IntegerField, SerializerMethodField
+from api.interactions import for_request
+from api.relations import MAX_BATCH_SIZE
 from recipes.models import (User, Ingredient, Tag,
                             Recipes, IngredientAmount,
                             ShoppingList, Follower, Favorite)
 
 
+logger = logging.getLogger('recipes')
+
+
 class CustomAuthTokenSerializer(serializers.Serializer):
     email = serializers.EmailField(label='Email')
     password = serializers.CharField(
@@ -73,7 +79,9 @@ class UserSerializer(serializers.ModelSerializer):
         return value
 
     def create(self, validated_data):
-        print("Создание пользователя с данными:", validated_data)
+        logger.debug(
+            'Создание пользователя %s', validated_data.get('email')
+        )
         # Пароль не должен храниться в обычном виде.
         # Поэтому сначала извлекаем пароль из validated_data
         # и удаляем его из словаря, потом передаем данные без пароля.
@@ -95,13 +103,18 @@ class UserSerializer(serializers.ModelSerializer):
         return representation
 
     def get_is_subscribed(self, instance):
+        """
+        Берется из аннотации subscribed (CustomUserViewSet.get_queryset),
+        иначе из множества подписок пользователя (api.interactions).
+        """
         request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return Follower.objects.filter(
-                user=request.user,
-                author=instance
-            ).exists()
-        return False
+        if not request or not request.user.is_authenticated:
+            return False
+        if hasattr(instance, 'subscribed'):
+            return instance.subscribed
+        if instance.pk == request.user.pk:
+            return False
+        return instance.pk in for_request(request).followed
 
 
 class PasswordSerializer(serializers.Serializer):
@@ -202,6 +215,41 @@ class CompactRecipesInfoSerializer(serializers.ModelSerializer):
         return [tag.id for tag in recipe_instance.tags.all()]
 
 
+def recipe_info_related(prefix=''):
+    """
+    Связи рецепта, которые читает RecipesInfoSerializer, для
+    prefetch_related; prefix — путь к рецепту (например, 'recipe__').
+    Автора добавляет select_related(f'{prefix}author').
+    """
+    return (
+        f'{prefix}tags',
+        Prefetch(
+            f'{prefix}ingredientamount_set',
+            queryset=IngredientAmount.objects.select_related(
+                'ingredient'
+            ).order_by('id')
+        ),
+    )
+
+
+def with_recipe_info(queryset):
+    """Рецепты для RecipesInfoSerializer за постоянное число запросов."""
+    return queryset.select_related('author').prefetch_related(
+        *recipe_info_related()
+    )
+
+
+def ingredient_amounts(recipe):
+    """Состав рецепта: из prefetch_related или отдельным запросом."""
+    if 'ingredientamount_set' in getattr(
+        recipe, '_prefetched_objects_cache', {}
+    ):
+        return recipe.ingredientamount_set.all()
+    return IngredientAmount.objects.filter(recipe=recipe).select_related(
+        'ingredient'
+    ).order_by('id')
+
+
 class RecipesInfoSerializer(serializers.ModelSerializer):
     """Представление данных о рецептах."""
 
@@ -228,9 +276,6 @@ class RecipesInfoSerializer(serializers.ModelSerializer):
         )
 
     def get_ingredients(self, recipe_instance):
-        ingredient_amounts = IngredientAmount.objects.filter(
-            recipe=recipe_instance
-        ).select_related('ingredient')
         return [
             {
                 'id': ia.ingredient.id,
@@ -238,7 +283,7 @@ class RecipesInfoSerializer(serializers.ModelSerializer):
                 'measurement_unit': ia.ingredient.measurement_unit,
                 'name': ia.ingredient.name
             }
-            for ia in ingredient_amounts
+            for ia in ingredient_amounts(recipe_instance)
         ]
 
     def get_tags(self, recipe_instance):
@@ -253,31 +298,26 @@ class RecipesInfoSerializer(serializers.ModelSerializer):
     def get_list(self, recipe_instance, list_name):
         # Добавлен ли рецепт в избранное или корзину пользователя
         request = self.context.get('request')
-        if request is None:
-            return False
-
-        user = request.user
-        if user.is_anonymous:
+        if request is None or request.user.is_anonymous:
             return False
-        if list_name == 'favorites':
-            return user.favorites.filter(recipe=recipe_instance).exists()
-        elif list_name == 'shopping_cart':
-            return user.shopping_cart.filter(recipe=recipe_instance).exists()
-        return False
+        return recipe_instance.id in for_request(request).get(list_name)
 
     def get_is_favorited(self, recipe_instance):
         # Избранное
-        request = self.context.get('request')
-        if request is None or request.user.is_anonymous:
-            return False
-        is_favorited = request.user.favorites.filter(
-            recipe=recipe_instance
-        ).exists()
-        return is_favorited
+        return self.get_list(recipe_instance, 'favorites')
 
     def get_is_in_shopping_cart(self, recipe_instance):
         # Корзина
-        return self.get_list(recipe_instance, 'shopping_cart')
+        return self.get_list(recipe_instance, 'cart')
+
+
+class RecipeDetailSerializer(RecipesInfoSerializer):
+    """Карточка рецепта: состав в формате IngredientRecipeSerializer."""
+
+    def get_ingredients(self, recipe_instance):
+        return IngredientRecipeSerializer(
+            ingredient_amounts(recipe_instance), many=True
+        ).data
 
 
 class RecipesAddSerializer(serializers.ModelSerializer):
@@ -316,61 +356,112 @@ class RecipesAddSerializer(serializers.ModelSerializer):
                 )
         return value
 
-    @transaction.atomic
-    def _add_ingredients(self, ingredients, recipe):
+    def _get_ingredients(self, ingredients):
+        """
+        Проверяет состав одним запросом in_bulk.
+        Возвращает словарь {id ингредиента: количество}.
+        """
         if not ingredients:
             raise ValidationError({
                 'ingredients': 'Нужен хотя бы один ингредиент!'
             })
+        amounts = {item['id']: item['amount'] for item in ingredients}
+        if len(amounts) != len(ingredients):
+            raise ValidationError({
+                'ingredients': 'Ингредиенты не должны повторяться.'
+            })
+        found = Ingredient.objects.in_bulk(list(amounts), field_name='id')
+        if len(found) != len(amounts):
+            raise NotFound('Ингредиент не найден.')
+        return amounts
+
+    def _set_ingredients(self, recipe, amounts, created=False):
+        """
+        Применяет к составу рецепта только разницу: новые строки,
+        измененные количества и удаленные ингредиенты.
+        """
+        existing = {} if created else {
+            row.ingredient_id: row
+            for row in IngredientAmount.objects.filter(recipe=recipe)
+        }
+        to_create = [
+            IngredientAmount(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
+        ]
+        to_update = []
+        for ingredient_id, row in existing.items():
+            if ingredient_id in amounts and row.amount != amounts[
+                ingredient_id
+            ]:
+                row.amount = amounts[ingredient_id]
+                to_update.append(row)
+        to_delete = [
+            row.id for ingredient_id, row in existing.items()
+            if ingredient_id not in amounts
+        ]
+        if to_delete:
+            IngredientAmount.objects.filter(id__in=to_delete).delete()
+        if to_update:
+            IngredientAmount.objects.bulk_update(to_update, ['amount'])
+        if to_create:
+            IngredientAmount.objects.bulk_create(to_create)
+
+    def _set_tags(self, recipe, tags_data, created=False):
+        """Добавляет недостающие теги и удаляет лишние."""
+        relation = Recipes.tags.through
+        tag_ids = set(
+            Tag.objects.filter(id__in=tags_data).values_list('id', flat=True)
+        )
+        existing = set() if created else set(
+            relation.objects.filter(recipes=recipe).values_list(
+                'tag_id', flat=True
+            )
+        )
+        if existing - tag_ids:
+            relation.objects.filter(
+                recipes=recipe, tag_id__in=existing - tag_ids
+            ).delete()
+        if tag_ids - existing:
+            relation.objects.bulk_create(
+                relation(recipes=recipe, tag_id=tag_id)
+                for tag_id in tag_ids - existing
+            )
 
-        ingredient_objects = []
-
-        for item in ingredients:
-            ingredient = get_object_or_404(Ingredient, id=item['id'])
-            amount = item['amount']
-            ingredient_objects.append(IngredientAmount(
-                recipe=recipe,
-                ingredient=ingredient,
-                amount=amount
-            ))
-        IngredientAmount.objects.bulk_create(ingredient_objects)
-
-    def _add_tags(self, recipe, tags_data):
-        """Добавляет теги к рецепту."""
-        existing_tags = Tag.objects.filter(id__in=tags_data)
-        recipe.tags.set(existing_tags)
-
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
         tags_data = validated_data.pop('tags')
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             raise ValidationError('Пользователь не авторизован.')
+        amounts = self._get_ingredients(ingredients_data)
         validated_data['author'] = request.user
         recipe = Recipes.objects.create(**validated_data)
-        self._add_ingredients(ingredients_data, recipe)
-        self._add_tags(recipe, tags_data)
+        self._set_ingredients(recipe, amounts, created=True)
+        self._set_tags(recipe, tags_data, created=True)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients', None)
         tags = validated_data.pop('tags', None)
+        amounts = (
+            self._get_ingredients(ingredients)
+            if ingredients is not None else None
+        )
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
+        # Сохранение помечает рецепт ожидающим номера (api.sync) один
+        # раз на запрос, и за изменения состава, и за удаленные строки.
         instance.save()
-        if ingredients is not None:
-            self._update_ingredients(ingredients, instance)
+        if amounts is not None:
+            self._set_ingredients(instance, amounts)
         if tags is not None:
-            self._update_tags(instance, tags)
-        return RecipesInfoSerializer(instance).data
-
-    def _update_ingredients(self, ingredients_data, recipe):
-        recipe.ingredients.clear()
-        self._add_ingredients(ingredients_data, recipe)
-
-    def _update_tags(self, recipe, tags_data):
-        recipe.tags.clear()
-        self._add_tags(recipe, tags_data)
+            self._set_tags(instance, tags)
+        return instance
 
 
 class RecipesFoFollowerSerializer(serializers.ModelSerializer):
@@ -423,6 +514,20 @@ class FollowerSerializer(serializers.ModelSerializer):
         return RecipesFoFollowerSerializer(recipes_queryset, many=True).data
 
 
+class BatchSerializer(serializers.Serializer):
+    """Пачка id рецептов или авторов для api.relations."""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BATCH_SIZE
+    )
+
+    def validate_ids(self, ids):
+        # Повторы не меняют результат, порядок сохраняется.
+        return list(dict.fromkeys(ids))
+
+
 class ShoppingListSerializer(serializers.ModelSerializer):
     recipe = serializers.PrimaryKeyRelatedField(queryset=Recipes.objects.all())
 
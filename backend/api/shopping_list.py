@@ -0,0 +1,211 @@
+"""
+Документы списка покупок (txt, CSV, PDF) с кэшем по содержимому.
+
+Ключ документа — хеш пар (рецепт, номер изменения sync_seq) корзины
+и версии справочника ингредиентов: любое изменение состава рецепта
+меняет его номер (api.sync). Неизменная корзина отдается из кэша
+SHOPPING_LIST['CACHE'] по одному запросу к корзине, без чтения
+ингредиентов и рендеринга, а хеш служит сильным ETag.
+
+Документ строится из строк одного запроса — номеров рецептов вместе с
+их ингредиентами, — и кэшируется под хешем номеров из этих же строк,
+так что изменение корзины между проверкой и построением не положит
+новый документ под старый ключ. Пока изменение рецепта ждет номера,
+хеша нет и документ не кэшируется. Изменившаяся корзина рендерится
+один раз: остальные запросы ждут документ под блокировкой ключа
+(api.locks.cache_lock), а не дождавшись за LOCK_TIMEOUT, строят сами.
+"""
+import csv
+import hashlib
+import io
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.locks import LockTimeoutError, cache_lock
+from api.metrics import record_cache
+from recipes.models import Ingredient
+
+
+VERSION_KEY = 'shopping-list:ingredients-version'
+
+
+def get_config():
+    """Настройки SHOPPING_LIST."""
+    return getattr(settings, 'SHOPPING_LIST', {})
+
+
+def get_cache():
+    """Кэш документов и версии справочника."""
+    return caches[get_config().get('CACHE', 'default')]
+
+
+def get_version():
+    """Версия справочника ингредиентов."""
+    return get_cache().get_or_set(VERSION_KEY, time.time_ns, None)
+
+
+def cart_versions(user):
+    """Пары (рецепт, номер изменения) корзины в порядке рецептов."""
+    return list(
+        user.shopping_cart.order_by('recipe_id')
+        .values_list('recipe_id', 'recipe__sync_seq')
+    )
+
+
+def cart_digest(versions, version):
+    """
+    Хеш пар versions и версии справочника; None, если изменение
+    рецепта еще ждет номера: такая пара не определяет состав.
+    """
+    if any(sequence is None for _, sequence in versions):
+        return None
+    return hashlib.sha256(repr((version, versions)).encode()).hexdigest()
+
+
+def cart_rows(user):
+    """
+    Рецепты корзины с номерами изменений и ингредиентами одним
+    запросом; у рецепта без ингредиентов поля ингредиента — None.
+    """
+    return list(
+        user.shopping_cart.order_by('recipe_id', 'recipe__ingredientamount')
+        .values_list(
+            'recipe_id', 'recipe__sync_seq',
+            'recipe__ingredientamount__ingredient__name',
+            'recipe__ingredientamount__ingredient__measurement_unit',
+            'recipe__ingredientamount__amount',
+        )
+    )
+
+
+def summary(rows):
+    """Суммарное количество каждого ингредиента строк cart_rows."""
+    totals = defaultdict(int)
+    for _, _, name, unit, amount in rows:
+        if name is not None:
+            totals[(name, unit)] += amount
+    return [
+        (name, unit, total)
+        for (name, unit), total in sorted(totals.items())
+    ]
+
+
+def render_txt(items):
+    """Текст в прежнем формате download_shopping_cart."""
+    text = 'Список покупок:\n\n'
+    for number, (name, unit, total) in enumerate(items, start=1):
+        text += f'{number}) {name} - {total} {unit}\n'
+    return text.encode()
+
+
+def render_csv(items):
+    """CSV: номер, ингредиент, количество, единица."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('№', 'Ингредиент', 'Количество', 'Единица'))
+    for number, (name, unit, total) in enumerate(items, start=1):
+        writer.writerow((number, name, total, unit))
+    return buffer.getvalue().encode()
+
+
+def render_pdf(items):
+    """Страницы A4 для печати; шрифт с кириллицей из PDF_FONT."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+
+    if 'ShoppingList' not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont('ShoppingList', get_config()['PDF_FONT'])
+        )
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4, invariant=True)
+    width, height = A4
+    pdf.setFont('ShoppingList', 16)
+    pdf.drawString(50, height - 60, 'Список покупок')
+    pdf.setFont('ShoppingList', 12)
+    y = height - 100
+    for number, (name, unit, total) in enumerate(items, start=1):
+        if y < 50:
+            pdf.showPage()
+            pdf.setFont('ShoppingList', 12)
+            y = height - 60
+        pdf.drawString(50, y, f'{number}) {name} — {total} {unit}')
+        pdf.rect(width - 80, y - 2, 12, 12)
+        y -= 22
+    pdf.save()
+    return buffer.getvalue()
+
+
+FORMATS = {
+    'txt': ('text/plain', render_txt),
+    'csv': ('text/csv; charset=utf-8', render_csv),
+    'pdf': ('application/pdf', render_pdf),
+}
+
+
+def document_key(digest, file_format):
+    """Ключ документа в кэше."""
+    return f'shopping-list:{file_format}:{digest}'
+
+
+def get_document(user, digest, file_format):
+    """
+    Документ корзины с хешем digest: из кэша или свежий. Возвращает
+    (хеш, документ) — хеш состава, из которого документ построен, —
+    или (None, None), если в корзине нет ингредиентов.
+    """
+    cache = get_cache()
+    if digest is not None:
+        content = cache.get(document_key(digest, file_format))
+        record_cache('shopping_lists', content is not None)
+        if content is not None:
+            return digest, content
+        # Документ строит один запрос, остальные ждут его под
+        # блокировкой и берут из кэша.
+        try:
+            with cache_lock(cache, document_key(digest, file_format),
+                            get_config().get('LOCK_TIMEOUT', 10)):
+                content = cache.get(document_key(digest, file_format))
+                if content is not None:
+                    return digest, content
+                return build_document(user, file_format)
+        except LockTimeoutError:
+            # Владелец блокировки строит дольше LOCK_TIMEOUT: документ
+            # строится без нее и кэшируется под хешем своих строк.
+            pass
+    return build_document(user, file_format)
+
+
+def build_document(user, file_format):
+    """Строит и кэширует документ под хешем его собственных строк."""
+    # Версия читается до строк: переименование после чтения строк
+    # сменит версию, и устаревший документ не найдется по новой.
+    version = get_version()
+    rows = cart_rows(user)
+    items = summary(rows)
+    if not items:
+        return None, None
+    content = FORMATS[file_format][1](items)
+    digest = cart_digest(
+        list(dict.fromkeys(row[:2] for row in rows)), version
+    )
+    if digest is not None:
+        get_cache().set(
+            document_key(digest, file_format), content,
+            get_config().get('TIMEOUT', 86400)
+        )
+    return digest, content
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    """Название или единица ингредиента меняют все документы."""
+    get_cache().set(VERSION_KEY, time.time_ns(), None)
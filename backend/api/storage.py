@@ -0,0 +1,190 @@
+"""
+Хранилище медиафайлов с адресацией по содержимому.
+
+Файл сохраняется под именем <каталог upload_to>/<xx>/<sha256>.<ext>:
+повторная загрузка той же картинки (например, рецепт, отредактированный
+с тем же base64-изображением) не пишет на диск ничего нового и дает
+то же имя. Содержимое по такому имени никогда не меняется, поэтому
+nginx отдает эти файлы с Cache-Control: immutable.
+
+Один файл могут разделять несколько рецептов и пользователей. Число
+ссылок на файл — строки REFERENCES с этим именем (поля
+проиндексированы); когда рецепт или пользователь удаляется или меняет
+картинку, файл без оставшихся ссылок удаляется после фиксации
+транзакции.
+
+Другой запрос может сохранить ту же картинку (файл уже есть, запись
+пропущена), пока его строка еще не зафиксирована, — проверка ссылок
+ее не видит и удаляет файл. Поэтому сохранивший запрос после фиксации
+своей строки восстанавливает файл, если его нет (restore_after_commit).
+Проверка с удалением и восстановление идут под одной блокировкой
+имени: восстановление либо видит удаление и пишет файл заново, либо
+идет раньше, и тогда проверка ссылок видит зафиксированную строку.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from django.core.files import locks
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from recipes.models import Recipes, User
+
+
+# Поля моделей, ссылающиеся на файлы хранилища.
+REFERENCES = {Recipes: 'image', User: 'avatar'}
+
+# Блокировки имен файлов: LOCK_STRIPES файлов в LOCK_DIRECTORY.
+LOCK_DIRECTORY = os.path.join(tempfile.gettempdir(), 'foodgram_media_locks')
+LOCK_STRIPES = 64
+# Сколько сохраненных, но еще не записанных в базу файлов помнит поток.
+MAX_PENDING = 16
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage, называющий файлы хешем содержимого."""
+
+    def hashed_name(self, name, content):
+        """Имя файла по sha256 содержимого content."""
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        hexdigest = digest.hexdigest()
+        return os.path.join(
+            directory, hexdigest[:2], f'{hexdigest}{extension}'
+        )
+
+    def __init__(self, *args, **kwargs):
+        """Содержимое сохраненных файлов до записи ссылки на них."""
+        super().__init__(*args, **kwargs)
+        self.local = threading.local()
+
+    @property
+    def pending(self):
+        if not hasattr(self.local, 'pending'):
+            self.local.pending = {}
+        return self.local.pending
+
+    @contextmanager
+    def lock(self, name):
+        """Блокировка имени name между процессами (flock)."""
+        stripe = int(hashlib.md5(name.encode()).hexdigest(), 16) % (
+            LOCK_STRIPES
+        )
+        os.makedirs(LOCK_DIRECTORY, exist_ok=True)
+        with open(os.path.join(LOCK_DIRECTORY, f'{stripe}.lock'),
+                  'a') as lock_file:
+            locks.lock(lock_file, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(lock_file)
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, content)
+        pending = self.pending
+        pending.pop(name, None)
+        if len(pending) >= MAX_PENDING:
+            # Файлы, строка для которых так и не сохранилась.
+            pending.pop(next(iter(pending)))
+        pending[name] = content.read()
+        content.seek(0)
+        if self.exists(name):
+            return name
+        saved = super()._save(name, content)
+        if saved != name:
+            # Тот же файл одновременно записал другой запрос,
+            # копия с суффиксом не нужна.
+            self.delete(saved)
+        return name
+
+    def restore_after_commit(self, name):
+        """После фиксации ссылки на name записывает файл, если его нет."""
+        content = self.pending.pop(name, None)
+        if content is None:
+            return
+
+        def restore():
+            with self.lock(name):
+                if not self.exists(name):
+                    saved = super(ContentAddressedStorage, self)._save(
+                        name, ContentFile(content)
+                    )
+                    if saved != name:
+                        self.delete(saved)
+
+        transaction.on_commit(restore)
+
+
+def is_referenced(name):
+    """Ссылается ли на файл name хотя бы один рецепт или пользователь."""
+    return any(
+        model.objects.filter(**{field: name}).exists()
+        for model, field in REFERENCES.items()
+    )
+
+
+def release(storage, name):
+    """Удаляет файл name после фиксации, если ссылок на него не осталось."""
+    if not name:
+        return
+
+    def delete_orphan():
+        with storage.lock(name):
+            if not is_referenced(name):
+                storage.delete(name)
+
+    transaction.on_commit(delete_orphan)
+
+
+def stored_name(instance):
+    """Имя файла экземпляра; None, если поле не загружено."""
+    value = instance.__dict__.get(REFERENCES[type(instance)])
+    return getattr(value, 'name', value)
+
+
+def get_storage(instance):
+    """Хранилище файлового поля экземпляра."""
+    return instance._meta.get_field(REFERENCES[type(instance)]).storage
+
+
+@receiver(post_init, sender=Recipes)
+@receiver(post_init, sender=User)
+def remember_file(sender, instance, **kwargs):
+    """Имя файла из базы, чтобы после сохранения заметить замену."""
+    instance._stored_file = stored_name(instance)
+
+
+@receiver(post_save, sender=Recipes)
+@receiver(post_save, sender=User)
+def file_saved(sender, instance, created, **kwargs):
+    """
+    Сохраненный файл восстанавливается после фиксации, если его успели
+    удалить; замененный или убранный из записи файл теряет ссылку.
+    """
+    old_name = getattr(instance, '_stored_file', None)
+    instance._stored_file = stored_name(instance)
+    storage = get_storage(instance)
+    if instance._stored_file and hasattr(storage, 'restore_after_commit'):
+        storage.restore_after_commit(instance._stored_file)
+    if not created and old_name and old_name != instance._stored_file:
+        release(storage, old_name)
+
+
+@receiver(post_delete, sender=Recipes)
+@receiver(post_delete, sender=User)
+def owner_deleted(sender, instance, **kwargs):
+    """Файл удаленного рецепта или пользователя теряет ссылку."""
+    release(
+        get_storage(instance),
+        stored_name(instance) or getattr(instance, '_stored_file', None)
+    )
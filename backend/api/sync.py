@@ -0,0 +1,191 @@
+"""
+Инкрементальная синхронизация каталога рецептов.
+
+Каждое изменение каталога получает номер счетчика SyncCounter: рецепт —
+в поле Recipes.sync_seq, удаление — в записи журнала DeletedRecipe.
+Транзакция изменения счетчик не трогает: она только помечает строку
+ожидающей номера (sync_seq = NULL), а номера раздает number_pending
+после фиксации, в своей короткой транзакции. Блокировка строки счетчика
+держится только на время этой раздачи, поэтому сохранения рецептов,
+импорт и раскладка по лентам идут параллельно, а не друг за другом.
+
+Порядок номеров совпадает с порядком фиксаций: номер получает только
+уже зафиксированная строка, раздачи идут по очереди под блокировкой
+счетчика, и каждая выдает номера больше всех прежних. Номера строк и
+новое значение счетчика фиксируются вместе, поэтому все номера до
+значения счетчика видны читателю, и клиент не пропустит изменение,
+зафиксированное после его запроса. Пока строка ждет номера, ее нет в
+ответах; она придет следующим запросом уже с новым номером. Строки,
+заблокированные чужой незавершенной транзакцией, раздача пропускает:
+их пронумерует эта транзакция после своей фиксации. Если раздача после
+фиксации не выполнилась (процесс упал) или такая транзакция
+откатилась, строки подбирает периодическая задача number_pending_changes.
+
+Клиент хранит непрозрачный токен — номер последнего полученного
+изменения — и запрашивает изменения после него пачками в порядке
+номеров. Актуальному клиенту хватает одного запроса по первичному
+ключу счетчика. Старые записи журнала удалений чистит задача
+purge_deleted_recipes; токен старше границы журнала требует полной
+синхронизации.
+
+Состав рецепта меняется вместе с сохранением рецепта (RecipesAddSerializer,
+страница рецепта в админке), импорт и generate_data вставляют рецепты
+уже ожидающими номера. Строки состава, измененные отдельно от рецепта
+(IngredientAmountAdmin), помечают рецепт через mark_pending.
+Переименование тега или ингредиента номер рецептов не меняет.
+"""
+import base64
+import heapq
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from api.exporter import recipe_record, recipes_with_relations
+from api.models import DeletedRecipe, SyncCounter
+from recipes.models import Recipes
+
+
+class TokenExpiredError(Exception):
+    """Журнал удалений после токена уже очищен."""
+
+
+def get_config():
+    """Настройки SYNC."""
+    return getattr(settings, 'SYNC', {})
+
+
+def encode_token(sequence):
+    """Непрозрачный токен для номера изменения."""
+    return base64.urlsafe_b64encode(
+        f'v1:{sequence}'.encode()
+    ).decode().rstrip('=')
+
+
+def decode_token(token):
+    """Номер изменения из токена; пустой токен — с начала каталога."""
+    if not token:
+        return 0
+    try:
+        version, sequence = base64.urlsafe_b64decode(
+            token + '=' * (-len(token) % 4)
+        ).decode().split(':')
+        sequence = int(sequence)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Неверный токен синхронизации.')
+    if version != 'v1' or sequence < 0:
+        raise ValueError('Неверный токен синхронизации.')
+    return sequence
+
+
+def number_pending():
+    """
+    Раздает номера зафиксированным изменениям, ждущим номера;
+    возвращает число пронумерованных.
+    """
+    with transaction.atomic():
+        SyncCounter.objects.get_or_create(pk=1)
+        counter = SyncCounter.objects.select_for_update().get(pk=1)
+        recipes = [
+            Recipes(id=recipe_id) for recipe_id in
+            Recipes.objects.select_for_update(skip_locked=True).filter(
+                sync_seq__isnull=True
+            ).order_by('id').values_list('id', flat=True)
+        ]
+        deleted = list(
+            DeletedRecipe.objects.select_for_update(skip_locked=True).filter(
+                sync_seq__isnull=True
+            ).order_by('id').only('id')
+        )
+        changes = recipes + deleted
+        if not changes:
+            return 0
+        for number, change in enumerate(changes, start=counter.value + 1):
+            change.sync_seq = number
+        Recipes.objects.bulk_update(recipes, ['sync_seq'])
+        DeletedRecipe.objects.bulk_update(deleted, ['sync_seq'])
+        SyncCounter.objects.filter(pk=1).update(
+            value=counter.value + len(changes)
+        )
+        return len(changes)
+
+
+def mark_pending(recipe_ids):
+    """Рецепты recipe_ids ждут нового номера изменения."""
+    Recipes.objects.filter(pk__in=recipe_ids).update(sync_seq=None)
+    transaction.on_commit(number_pending)
+
+
+def get_changes(since, limit):
+    """
+    Изменения после номера since: не больше limit рецептов и удалений
+    в порядке номеров. Возвращает (рецепты, id удаленных, новый номер,
+    есть ли еще изменения).
+    """
+    value, horizon = SyncCounter.objects.filter(pk=1).values_list(
+        'value', 'horizon'
+    ).first() or (0, 0)
+    if 0 < since < horizon:
+        raise TokenExpiredError()
+    if since >= value:
+        return [], [], since, False
+    recipes = recipes_with_relations().filter(
+        sync_seq__gt=since, sync_seq__lte=value
+    ).order_by('sync_seq')[:limit + 1]
+    deleted = DeletedRecipe.objects.filter(
+        sync_seq__gt=since, sync_seq__lte=value
+    ).order_by('sync_seq').values_list('sync_seq', 'recipe_id')[:limit + 1]
+    changes = list(heapq.merge(
+        ((recipe.sync_seq, recipe) for recipe in recipes),
+        ((sequence, recipe_id) for sequence, recipe_id in deleted),
+        key=lambda change: change[0]
+    ))
+    page = changes[:limit]
+    has_more = len(changes) > limit
+    # Все изменения до value уже зафиксированы: без продолжения
+    # токен сразу сдвигается на value.
+    last = page[-1][0] if has_more else value
+    return (
+        [change for _, change in page if isinstance(change, Recipes)],
+        [change for _, change in page if not isinstance(change, Recipes)],
+        last,
+        has_more
+    )
+
+
+def changes_response(since, limit, request):
+    """Тело ответа GET /api/recipes/changes/."""
+    recipes, deleted, last, has_more = get_changes(since, limit)
+    records = []
+    for recipe in recipes:
+        record = recipe_record(recipe)
+        record['image'] = request.build_absolute_uri(recipe.image.url)
+        records.append(record)
+    return {
+        'recipes': records,
+        'deleted': deleted,
+        'next': encode_token(last),
+        'has_more': has_more,
+    }
+
+
+@receiver(pre_save, sender=Recipes)
+def recipe_saving(sender, instance, raw=False, **kwargs):
+    """Сохраняемый рецепт ждет нового номера изменения."""
+    if not raw:
+        instance.sync_seq = None
+
+
+@receiver(post_save, sender=Recipes)
+def recipe_saved(sender, instance, raw=False, **kwargs):
+    """Номер выдается после фиксации сохранения."""
+    if not raw:
+        transaction.on_commit(number_pending)
+
+
+@receiver(post_delete, sender=Recipes)
+def recipe_deleted(sender, instance, **kwargs):
+    """Удаленный рецепт попадает в журнал удалений."""
+    DeletedRecipe.objects.create(recipe_id=instance.id)
+    transaction.on_commit(number_pending)
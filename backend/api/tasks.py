@@ -0,0 +1,62 @@
+"""Фоновые задачи приложения для очереди api.jobs."""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from api.feed import fan_out
+from api.jobs import task
+from api.models import DeletedRecipe, Job, JobStatus, SyncCounter
+from api.sync import get_config as get_sync_config
+from api.sync import number_pending
+from recipes.models import Recipes
+
+
+@task
+def purge_jobs(days=7):
+    """Удаляет завершенные задачи старше days дней."""
+    Job.objects.filter(
+        status__in=(JobStatus.DONE, JobStatus.FAILED),
+        finished_at__lt=timezone.now() - timedelta(days=days)
+    ).delete()
+
+
+@task
+def fan_out_recipes(recipe_ids):
+    """Раскладывает рецепты recipe_ids в ленты подписчиков (api.feed)."""
+    fan_out(
+        Recipes.objects.filter(id__in=recipe_ids).only('id', 'author_id')
+    )
+
+
+@task
+def number_pending_changes():
+    """
+    Нумерует изменения каталога, чья раздача номеров после фиксации
+    не выполнилась (api.sync).
+    """
+    number_pending()
+
+
+@task
+def purge_deleted_recipes(days=None):
+    """
+    Удаляет записи журнала удалений старше days дней (по умолчанию
+    SYNC['TOMBSTONE_DAYS']) и поднимает границу журнала: клиенту с
+    токеном раньше нее нужна полная синхронизация.
+    """
+    if days is None:
+        days = get_sync_config().get('TOMBSTONE_DAYS', 30)
+    with transaction.atomic():
+        expired = DeletedRecipe.objects.filter(
+            deleted_at__lt=timezone.now() - timedelta(days=days)
+        )
+        horizon = expired.aggregate(horizon=Max('sync_seq'))['horizon']
+        if horizon is None:
+            return
+        SyncCounter.objects.get_or_create(pk=1)
+        SyncCounter.objects.filter(pk=1, horizon__lt=horizon).update(
+            horizon=horizon
+        )
+        DeletedRecipe.objects.filter(sync_seq__lte=horizon).delete()
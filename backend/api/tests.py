@@ -1,7 +1,68 @@
+import base64
+import functools
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from array import array
+from datetime import timedelta
 from http import HTTPStatus
+from unittest import mock, skipUnless
 
-from api import models
-from django.test import Client, TestCase
+from asgiref.sync import iscoroutinefunction
+from api import metrics, models, relations, sync
+from api.authentication import (CachedTokenAuthentication, cache_key,
+                                get_cached_user, local_cache,
+                                remember_locally)
+from api.filters import filter_recipes
+from api.importer import RecipeImporter
+from api.interactions import IdSet, Interactions
+from api.jobs import (Worker, backoff, claim, enqueue, enqueue_periodic,
+                      schedule_periodic, task)
+from api.locks import LockTimeoutError, cache_lock
+from api.management.commands.benchmark import percentile
+from api.management.commands.replay_collection import (
+    DEFAULT_COLLECTION, extract_value, load_collection)
+from api.metrics import archive, registry, render_metrics
+from api.middleware import (MetricsMiddleware, ProfilingMiddleware,
+                            RequestTiming, ServerTimingMiddleware,
+                            SlowQueryLogger, SlowQueryMiddleware)
+from api.models import Job, JobStatus
+from api.serializers import TagSerializer, UserSerializer
+from api.shopping_list import (cart_digest, cart_versions, get_document,
+                               get_version)
+from api.tasks import (fan_out_recipes, number_pending_changes,
+                       purge_deleted_recipes)
+from api.throttling import TokenBucketThrottle
+from api.views import IngredientViewSet, RecipesViewSet, TagViewSet
+from django.conf import settings
+from django.contrib import admin as django_admin
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.http import QueryDict
+from django.test import (Client, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image as PILImage
+from foodgram.log import JsonFormatter, LazyQueueHandler
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+from recipes.admin import IngredientAmountInline
+from recipes.models import (UserRole, User, Ingredient, Tag, Recipes,
+                            IngredientAmount, ShoppingList, Follower,
+                            Favorite, FeedEntry)
 
 
 class TaskiAPITestCase(TestCase):
@@ -12,3 +73,2438 @@ class TaskiAPITestCase(TestCase):
         """Проверка доступности рецептов."""
         response = self.guest_client.get('/api/recipes/')
         self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'План запроса проверяется в SQLite')
+class QueryPlanTestCase(TestCase):
+    """Горячие запросы идут по индексам, а не полным сканом таблиц."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@ya.ru', username='user')
+        cls.author = User.objects.create(
+            email='author@ya.ru', username='author'
+        )
+        Follower.objects.create(user=cls.user, author=cls.author)
+        ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+        recipe = Recipes.objects.create(
+            author=cls.author, name='Суп', text='Варить',
+            cooking_time=10, image='media/soup.png'
+        )
+        IngredientAmount.objects.create(
+            recipe=recipe, ingredient=ingredient, amount=5
+        )
+        ShoppingList.objects.create(author=cls.user, recipe=recipe)
+
+    def get_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assert_uses_index(self, queryset, table):
+        plan = self.get_plan(queryset)
+        for detail in plan:
+            self.assertNotRegex(detail, r'^SCAN \w+$', plan)
+        self.assertTrue(
+            any(
+                detail.startswith(f'SEARCH {table} USING')
+                for detail in plan
+            ),
+            plan
+        )
+
+    def test_recipes_list_by_author(self):
+        queryset = Recipes.objects.filter(author=self.author)[:6]
+        self.assert_uses_index(queryset, 'recipes_recipes')
+        self.assertFalse(
+            any('TEMP B-TREE' in d for d in self.get_plan(queryset))
+        )
+
+    def test_subscriptions(self):
+        queryset = (
+            Follower.objects
+            .filter(user=self.user)
+            .select_related('author')
+            .order_by('id')
+        )
+        self.assert_uses_index(queryset, 'recipes_follower')
+        self.assertFalse(
+            any('TEMP B-TREE' in d for d in self.get_plan(queryset))
+        )
+
+    def test_shopping_cart(self):
+        queryset = (
+            IngredientAmount.objects
+            .filter(recipe_id__in=self.user.shopping_cart.values('recipe_id'))
+            .values('ingredient__name', 'ingredient__measurement_unit')
+            .annotate(total_amount=Sum('amount'))
+        )
+        self.assert_uses_index(queryset, 'recipes_ingredientamount')
+
+    def test_filters_without_temp_b_tree(self):
+        tag = Tag.objects.create(name='Обед', slug='lunch')
+        Tag.objects.create(name='Ужин', slug='dinner')
+        Recipes.objects.get().tags.add(tag)
+        params = QueryDict(
+            'author={}&is_favorited=1&is_in_shopping_cart=1'
+            '&tags=lunch&tags=dinner'.format(self.author.id)
+        )
+        queryset = filter_recipes(Recipes.objects.all(), params, self.user)
+        sql = str(queryset.query)
+        self.assertNotIn('DISTINCT', sql)
+        self.assertNotIn('GROUP BY', sql)
+        plan = self.get_plan(queryset[:6])
+        self.assertFalse(any('TEMP B-TREE' in d for d in plan), plan)
+        self.assert_uses_index(queryset[:6], 'recipes_recipes')
+        # Каждое полусоединение — поиск по покрывающему индексу связи.
+        for index in ('recipes_favorite', 'recipes_shoppinglist',
+                      'recipes_recipes_tags_recipes_id_tag_id'):
+            self.assertTrue(
+                any(
+                    d.startswith('SEARCH U0 USING COVERING INDEX')
+                    and index in d for d in plan
+                ),
+                plan
+            )
+
+
+class ServerTimingTestCase(TestCase):
+    """Заголовок Server-Timing и строка в логе для замеренных запросов."""
+
+    @override_settings(REQUEST_TIMING={'ENABLED': True})
+    def test_header_and_log(self):
+        with self.assertLogs('recipes', level='INFO') as logs:
+            response = Client().get('/api/tags/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertRegex(
+            response['Server-Timing'],
+            r'db;dur=[\d.]+;desc="1 queries", serialize;dur=[\d.]+, '
+            r'view;dur=[\d.]+, render;dur=[\d.]+, total;dur=[\d.]+'
+        )
+        self.assertIn('endpoint=tag-list db_queries=1', logs.output[-1])
+
+    @override_settings(REQUEST_TIMING={'ENABLED': True})
+    def test_serialization_is_timed(self):
+        def slow(serializer, instance):
+            time.sleep(0.01)
+            return {'id': instance.id}
+
+        Tag.objects.create(name='Тег', slug='tag')
+        with mock.patch.object(TagSerializer, 'to_representation', slow):
+            response = Client().get('/api/tags/')
+        serialize = float(re.search(
+            r'serialize;dur=([\d.]+)', response['Server-Timing']
+        ).group(1))
+        self.assertGreaterEqual(serialize, 10)
+
+    @override_settings(REQUEST_TIMING={
+        'ENABLED': True, 'ENDPOINT_SAMPLE_RATES': {'tag-list': 0}
+    })
+    def test_endpoint_sampling(self):
+        response = Client().get('/api/tags/')
+        self.assertNotIn('Server-Timing', response)
+
+    def test_disabled(self):
+        response = Client().get('/api/tags/')
+        self.assertNotIn('Server-Timing', response)
+
+
+class MetricsTestCase(TestCase):
+    """Метрики складываются по всем воркерам и закрыты от посторонних."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_override = override_settings(METRICS={
+            'ENABLED': True, 'DIRECTORY': directory.name,
+            'FLUSH_INTERVAL': 0,
+        })
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.directory = directory.name
+        registry.counters.clear()
+        registry.histograms.clear()
+
+    def test_aggregates_worker_files(self):
+        Client().get('/api/tags/')
+        registry.flush()
+        own = f'{self.directory}/metrics-{os.getpid()}.json'
+        with open(own) as source:
+            data = source.read()
+        # Второй воркер с такими же метриками.
+        with open(f'{self.directory}/metrics-1.json', 'w') as target:
+            target.write(data)
+        body = Client().get('/api/metrics/').content.decode()
+        self.assertIn(
+            'foodgram_requests_total{view="tag-list",method="GET",'
+            'status="200"} 2.0', body
+        )
+        self.assertIn(
+            'foodgram_request_duration_seconds_count{view="tag-list",'
+            'method="GET"} 2', body
+        )
+        self.assertIn('# TYPE foodgram_request_duration_seconds histogram',
+                      body)
+
+    def test_archived_worker_counters_stay_monotonic(self):
+        Client().get('/api/tags/')
+        registry.flush()
+        with open(f'{self.directory}/metrics-{os.getpid()}.json') as source:
+            data = source.read()
+        key = ('foodgram_requests_total', (
+            ('view', 'tag-list'), ('method', 'GET'), ('status', 200)
+        ))
+        worker = f'{self.directory}/metrics-1.json'
+        with open(worker, 'w') as target:
+            target.write(data)
+        self.assertEqual(registry.collect()[0][key], 2)
+        archive(1)
+        self.assertFalse(os.path.exists(worker))
+        self.assertEqual(registry.collect()[0][key], 2)
+        # Новый воркер с тем же PID не затирает счетчики старого.
+        with open(worker, 'w') as target:
+            target.write(data)
+        self.assertEqual(registry.collect()[0][key], 3)
+
+    def test_archive_reentered_from_signal_handler(self):
+        Client().get('/api/tags/')
+        registry.flush()
+        with open(f'{self.directory}/metrics-{os.getpid()}.json') as source:
+            data = source.read()
+        for pid in (1, 2):
+            with open(f'{self.directory}/metrics-{pid}.json', 'w') as target:
+                target.write(data)
+        read = metrics.read
+
+        def read_with_sigchld(path):
+            # SIGCHLD второго воркера приходит, пока мастер переносит
+            # метрики первого.
+            if path.name == 'metrics-1.json':
+                archive(2)
+            return read(path)
+
+        with mock.patch('api.metrics.read', read_with_sigchld):
+            archive(1)
+        for pid in (1, 2):
+            self.assertFalse(
+                os.path.exists(f'{self.directory}/metrics-{pid}.json')
+            )
+        key = ('foodgram_requests_total', (
+            ('view', 'tag-list'), ('method', 'GET'), ('status', 200)
+        ))
+        self.assertEqual(registry.collect()[0][key], 3)
+
+    def test_remote_anonymous_forbidden(self):
+        response = Client(REMOTE_ADDR='10.0.0.1').get('/api/metrics/')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+
+class SlowQueryLogTestCase(TestCase):
+    """Медленные запросы пишутся с представлением и планом."""
+
+    @override_settings(SLOW_QUERY_LOG={'ENABLED': True, 'THRESHOLD_MS': 0})
+    def test_logs_view_and_plan(self):
+        with self.assertLogs('recipes.sql', level='WARNING') as logs:
+            Client().get('/api/tags/')
+        self.assertIn('view=tag-list method=GET', logs.output[0])
+        self.assertIn('FROM "recipes_tag"', logs.output[0])
+        if connection.vendor == 'sqlite':
+            self.assertIn('SCAN recipes_tag', logs.output[0])
+
+    def test_failed_explain_keeps_transaction_usable(self):
+        logger = SlowQueryLogger(
+            RequestFactory().get('/api/tags/'), connection, 0, True
+        )
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                plan = logger.get_plan('SELECT * FROM missing_table', ())
+                self.assertEqual(Tag.objects.count(), 0)
+        self.assertIn('план недоступен', plan)
+        executed = [query['sql'] for query in queries.captured_queries]
+        explain = next(
+            index for index, sql in enumerate(executed) if 'EXPLAIN' in sql
+        )
+        self.assertIn('SAVEPOINT', executed[explain - 1])
+        self.assertIn('ROLLBACK TO SAVEPOINT', executed[explain + 1])
+
+
+class ProfilingTestCase(TestCase):
+    """Профилирование доступно только администраторам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        admin = User.objects.create(
+            email='admin@ya.ru', username='admin', role=UserRole.ADMIN
+        )
+        user = User.objects.create(email='user@ya.ru', username='user')
+        cls.admin_token = Token.objects.create(user=admin).key
+        cls.user_token = Token.objects.create(user=user).key
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def get(self, token, url='/api/tags/?_profile=1', **config):
+        config = {'ENABLED': True, 'DIRECTORY': self.directory, **config}
+        with override_settings(PROFILING=config):
+            return Client().get(url, HTTP_AUTHORIZATION=f'Token {token}')
+
+    def test_admin_gets_summary(self):
+        response = self.get(self.admin_token)
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertIn('function calls', response.content.decode())
+
+    def test_admin_saves_pstats(self):
+        response = self.get(self.admin_token, '/api/tags/?_profile=save')
+        self.assertEqual(response.json(), [])
+        self.assertTrue(
+            os.path.exists(f'{self.directory}/{response["X-Profile-File"]}')
+        )
+
+    def test_profiled_request_keeps_error_handling(self):
+        response = self.get(
+            self.admin_token, '/api/recipes/999999/?_profile=save'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertIn('X-Profile-File', response)
+
+    def test_user_is_noop(self):
+        response = self.get(self.user_token)
+        self.assertEqual(response.json(), [])
+        self.assertNotIn('X-Profile-File', response)
+
+    def test_sampling(self):
+        response = self.get(
+            self.user_token, '/api/tags/', SAMPLE_RATES={'tag-list': 1}
+        )
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        self.assertEqual(response.json(), [])
+
+    async def test_asgi_admin_gets_summary(self):
+        config = {'ENABLED': True, 'DIRECTORY': self.directory}
+        with override_settings(PROFILING=config):
+            response = await self.async_client.get(
+                '/api/recipes/?_profile=1',
+                headers={'Authorization': f'Token {self.admin_token}'}
+            )
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        # Запросы к базе выполняются в потоке sync_to_async.
+        self.assertIn('execute', response.content.decode())
+
+
+class LoggingTestCase(TestCase):
+    """Логгер 'recipes' пишет через очередь в JSON."""
+
+    def test_queue_handler(self):
+        handlers = logging.getLogger('recipes').handlers
+        self.assertEqual(len(handlers), 1)
+        self.assertIsInstance(handlers[0], LazyQueueHandler)
+
+    def test_json_formatter(self):
+        record = logging.makeLogRecord({
+            'name': 'recipes', 'levelname': 'INFO', 'msg': 'db=%s',
+            'args': (3,), 'timing': {'db_queries': 3},
+        })
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual(data['message'], 'db=3')
+        self.assertEqual(data['timing'], {'db_queries': 3})
+
+
+class BenchmarkTestCase(TestCase):
+    """Генерация данных и замер эндпоинтов на маленьком наборе."""
+
+    def test_percentile_nearest_rank(self):
+        for values, percent, expected in (
+            (range(1, 7), 50, 3),
+            (range(1, 21), 95, 19),
+            (range(1, 21), 50, 10),
+            (range(1, 11), 100, 10),
+            (range(1, 11), 0, 1),
+            (range(1, 8), 50, 4),
+            ([5], 95, 5),
+        ):
+            self.assertEqual(
+                percentile(values, percent), expected, (values, percent)
+            )
+
+    def test_generate_data_rejects_empty_users(self):
+        with self.assertRaises(CommandError):
+            call_command('generate_data', users=0, stdout=io.StringIO())
+
+    def test_generate_and_benchmark(self):
+        call_command(
+            'generate_data', users=5, recipes=10, follows=2, favorites=3,
+            cart=2, stdout=io.StringIO()
+        )
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Recipes.objects.count(), 10)
+        self.assertEqual(Follower.objects.count(), 10)
+        self.assertEqual(Favorite.objects.count(), 15)
+        counts = Recipes.objects.annotate(
+            total=Count('ingredients')
+        ).values_list('total', flat=True)
+        self.assertTrue(all(5 <= count <= 20 for count in counts))
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command(
+                'benchmark', iterations=2, output=output.name,
+                stdout=io.StringIO()
+            )
+            report = json.load(output)
+        self.assertEqual(len(report['results']), 6)
+        for result in report['results'].values():
+            self.assertEqual(result['status'], HTTPStatus.OK)
+            self.assertGreater(result['queries'], 0, report)
+
+
+class ReplayCollectionTestCase(TestCase):
+    """Разбор Postman-коллекции для нагрузочного прогона."""
+
+    def test_load_collection(self):
+        variables, requests = load_collection(DEFAULT_COLLECTION)
+        self.assertEqual(variables['baseUrl'], 'http://127.0.0.1:8000')
+        self.assertEqual(len(requests), 157)
+        login = next(
+            request for request in requests
+            if request['url'].endswith('/api/auth/token/login/')
+        )
+        self.assertEqual(login['expected'], HTTPStatus.OK)
+        name, capture = login['captures'][0]
+        self.assertEqual(name, 'userToken')
+        self.assertEqual(
+            extract_value({'auth_token': 'abc'}, capture), 'abc'
+        )
+
+    def test_capture_with_slice(self):
+        _, requests = load_collection(DEFAULT_COLLECTION)
+        captures = dict(
+            capture for request in requests
+            for capture in request['captures']
+        )
+        data = [{'id': 7, 'name': 'абрикос'}, {'id': 8, 'name': 'банан'}]
+        self.assertEqual(
+            extract_value(data, captures['ingredientNameFirstLatter']), 'а'
+        )
+        self.assertEqual(
+            extract_value(data, captures['secondIndredientId']), 8
+        )
+
+
+class AsyncViewsTestCase(TestCase):
+    """Асинхронные GET-представления отвечают как вьюсеты DRF."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@ya.ru', username='user')
+        author = User.objects.create(email='author@ya.ru', username='author')
+        cls.token = Token.objects.create(user=cls.user).key
+        Follower.objects.create(user=cls.user, author=author)
+        tags = [
+            Tag.objects.create(name=f'Тег {number}', slug=f'tag{number}')
+            for number in range(2)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Продукт {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        for number in range(8):
+            recipe = Recipes.objects.create(
+                author=author if number % 2 else cls.user,
+                name=f'Рецепт {number}', text='Текст',
+                cooking_time=number + 1, image='media/recipe.png'
+            )
+            recipe.tags.set(tags[:number % 2 + 1])
+            for ingredient in ingredients[:number % 3 + 1]:
+                IngredientAmount.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=number + 1
+                )
+        cls.recipe = recipe
+        Favorite.objects.create(author=cls.user, recipe=recipe)
+        ShoppingList.objects.create(author=cls.user, recipe=recipe)
+
+    def setUp(self):
+        # Множества флагов живут в общем кэше между тестами.
+        caches['interactions'].clear()
+
+    def normalize(self, data):
+        for recipe in data.get('results', [data]):
+            recipe['tags'].sort(key=lambda tag: tag['id'])
+            recipe['ingredients'].sort(key=lambda item: item['id'])
+        return data
+
+    def sync_response(self, url, actions, **kwargs):
+        request = APIRequestFactory().get(url)
+        force_authenticate(request, self.user)
+        response = RecipesViewSet.as_view(actions)(request, **kwargs)
+        return self.normalize(json.loads(response.render().content))
+
+    def async_response(self, url):
+        response = Client().get(url, HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return self.normalize(response.json())
+
+    def test_list_matches_viewset(self):
+        for url in (
+            '/api/recipes/', '/api/recipes/?page=2&limit=3',
+            '/api/recipes/?tags=tag0&tags=tag1&is_favorited=1',
+            '/api/recipes/?is_in_shopping_cart=1',
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(
+                    self.async_response(url),
+                    self.sync_response(url, {'get': 'list'})
+                )
+
+    def test_detail_matches_viewset(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        self.assertEqual(
+            self.async_response(url),
+            self.sync_response(url, {'get': 'retrieve'}, pk=self.recipe.id)
+        )
+
+    def test_list_query_count_is_fixed(self):
+        client = Client(HTTP_AUTHORIZATION=f'Token {self.token}')
+        # Первый запрос читает три множества флагов пользователя.
+        with self.assertNumQueries(7):
+            client.get('/api/recipes/?limit=10')
+        # Токен и флаги в кэше: количество, страница, теги, ингредиенты.
+        with self.assertNumQueries(4):
+            client.get('/api/recipes/?limit=10')
+
+    async def test_asgi_handler(self):
+        response = await self.async_client.get('/api/tags/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(response.json()), 2)
+
+    async def test_asgi_recipes(self):
+        headers = {'Authorization': f'Token {self.token}'}
+        response = await self.async_client.get(
+            '/api/recipes/?is_in_shopping_cart=1', headers=headers
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.json()['results']],
+            [self.recipe.id]
+        )
+        response = await self.async_client.get(
+            f'/api/recipes/{self.recipe.id}/', headers=headers
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(response.json()['author']['is_subscribed'])
+
+    def test_references_match_viewsets(self):
+        for url, viewset in (
+            ('/api/tags/', TagViewSet),
+            ('/api/ingredients/', IngredientViewSet),
+        ):
+            with self.subTest(url=url):
+                response = viewset.as_view({'get': 'list'})(
+                    APIRequestFactory().get(url)
+                )
+                self.assertEqual(
+                    Client().get(url).json(),
+                    json.loads(response.render().content)
+                )
+
+    def test_ingredient_name_prefix(self):
+        url = '/api/ingredients/?name=Продукт 1'
+        response = IngredientViewSet.as_view({'get': 'list'})(
+            APIRequestFactory().get(url)
+        )
+        names = [
+            ingredient['name']
+            for ingredient in json.loads(response.render().content)
+        ]
+        self.assertEqual(names, ['Продукт 1'])
+        self.assertEqual(
+            [ingredient['name'] for ingredient in Client().get(url).json()],
+            names
+        )
+
+    def test_invalid_token(self):
+        response = Client().get(
+            '/api/recipes/', HTTP_AUTHORIZATION='Token wrong'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+    def test_short_link_redirect(self):
+        client = Client(HTTP_AUTHORIZATION=f'Token {self.token}')
+        short_link = client.get(
+            f'/api/recipes/{self.recipe.id}/get-link/'
+        ).json()['short-link']
+        response = client.get(short_link)
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertTrue(
+            response['Location'].endswith(f'/recipes/{self.recipe.id}/')
+        )
+        response = client.get('/api/recipes/redirect/none/')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_api_middleware_is_async(self):
+        async def get_response(request):
+            pass
+
+        with override_settings(
+            REQUEST_TIMING={'ENABLED': True},
+            PROFILING={'ENABLED': True, 'DIRECTORY': tempfile.gettempdir()}
+        ):
+            for middleware in (MetricsMiddleware, SlowQueryMiddleware,
+                               ServerTimingMiddleware, ProfilingMiddleware):
+                with self.subTest(middleware=middleware.__name__):
+                    self.assertTrue(
+                        iscoroutinefunction(middleware(get_response))
+                    )
+
+    @override_settings(REQUEST_TIMING={'ENABLED': True})
+    async def test_asgi_timing_counts_queries(self):
+        response = await self.async_client.get('/api/tags/')
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+
+    def test_write_goes_to_viewset(self):
+        response = Client().post(
+            '/api/tags/', {'name': 'Новый', 'slug': 'new'},
+            HTTP_AUTHORIZATION=f'Token {self.token}'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+
+
+class TokenCacheTestCase(TestCase):
+    """Кэш токенов: ноль запросов на аутентификацию и сброс кэша."""
+
+    def setUp(self):
+        self.user = User.objects.create(email='user@ya.ru', username='user')
+        self.user.set_password('old-password')
+        self.user.save()
+        self.token = Token.objects.create(user=self.user).key
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.request = APIRequestFactory().get(
+            '/api/tags/', HTTP_AUTHORIZATION=f'Token {self.token}'
+        )
+
+    def test_warm_cache_skips_database(self):
+        authentication = CachedTokenAuthentication()
+        authentication.authenticate(self.request)
+        with self.assertNumQueries(0):
+            user, token = authentication.authenticate(self.request)
+        self.assertEqual(user, self.user)
+        self.assertEqual(token.key, self.token)
+
+    def test_local_cache_is_bounded(self):
+        local_cache.clear()
+        self.addCleanup(local_cache.clear)
+        config = {'ENABLED': True, 'LOCAL_TTL': 60, 'LOCAL_MAX_SIZE': 3}
+        with override_settings(TOKEN_CACHE=config):
+            for number in range(5):
+                remember_locally(f'key{number}', self.user, config)
+            self.assertEqual(list(local_cache), ['key2', 'key3', 'key4'])
+            # Просроченная запись удаляется при чтении.
+            local_cache[cache_key('old')] = (0, self.user)
+            self.assertIsNone(get_cached_user('old'))
+            self.assertNotIn(cache_key('old'), local_cache)
+
+    def test_set_password_invalidates(self):
+        self.client.get('/api/users/me/')
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'old-password',
+            'new_password': 'new-password',
+        })
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertIsNone(get_cached_user(self.token))
+
+    def test_user_update_invalidates(self):
+        self.client.get('/api/users/me/')
+        self.client.patch(
+            '/api/users/me/', {'first_name': 'Новое'},
+            content_type='application/json'
+        )
+        self.assertEqual(
+            self.client.get('/api/users/me/').json()['first_name'], 'Новое'
+        )
+
+    def test_logout_and_token_delete_invalidate(self):
+        self.client.get('/api/users/me/')
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertEqual(
+            self.client.get('/api/users/me/').status_code,
+            HTTPStatus.UNAUTHORIZED
+        )
+        token = Token.objects.create(user=self.user)
+        client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        client.get('/api/users/me/')
+        token.delete()
+        self.assertEqual(
+            client.get('/api/users/me/').status_code, HTTPStatus.UNAUTHORIZED
+        )
+
+    def test_invalidation_reaches_other_workers(self):
+        config = settings.TOKEN_CACHE
+        self.assertNotIsInstance(caches[config['CACHE']], LocMemCache)
+        CachedTokenAuthentication().authenticate(self.request)
+        # Отдельный экземпляр кэша — как в другом воркере gunicorn.
+        other_worker = caches.create_connection(config['CACHE'])
+        self.assertIsNotNone(other_worker.get(cache_key(self.token)))
+        with self.captureOnCommitCallbacks(execute=True):
+            Token.objects.filter(key=self.token).delete()
+        self.assertIsNone(other_worker.get(cache_key(self.token)))
+
+
+# Прозрачный PNG 1x1.
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAA'
+    'AADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=='
+)
+
+
+class RecipeWriteTestCase(TestCase):
+    """Создание и изменение рецепта за постоянное число запросов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@ya.ru', username='user')
+        cls.token = Token.objects.create(user=cls.user).key
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}', slug=f'tag{number}')
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Продукт {number}',
+                                      measurement_unit='г')
+            for number in range(10)
+        ]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        # Ведра throttle живут в общем кэше между запусками тестов.
+        caches['throttle'].clear()
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.client.get('/api/tags/')
+
+    def payload(self, count, name='Рецепт', amount=1):
+        return {
+            'name': name, 'text': 'Текст', 'cooking_time': 5,
+            'image': IMAGE,
+            'tags': [tag.id for tag in self.tags[:count % 3 + 1]],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': amount}
+                for ingredient in self.ingredients[:count]
+            ],
+        }
+
+    def send(self, method, url, data):
+        counter = RequestTiming(url)
+        with connection.execute_wrapper(counter):
+            response = getattr(self.client, method)(
+                url, data, content_type='application/json'
+            )
+        return response, counter.queries
+
+    def test_create_query_count_is_fixed(self):
+        response, small = self.send(
+            'post', '/api/recipes/', self.payload(2, 'Малый')
+        )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        response, large = self.send(
+            'post', '/api/recipes/', self.payload(10, 'Большой')
+        )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.json()['ingredients']), 10)
+
+    def test_update_applies_diff(self):
+        response, _ = self.send('post', '/api/recipes/', self.payload(4))
+        url = f'/api/recipes/{response.json()["id"]}/'
+        kept = IngredientAmount.objects.get(
+            recipe_id=response.json()['id'], ingredient=self.ingredients[0]
+        )
+        data = self.payload(6, amount=2)
+        data['ingredients'] = data['ingredients'][:1] + [
+            {'id': ingredient.id, 'amount': 3}
+            for ingredient in self.ingredients[5:9]
+        ]
+        response, small = self.send('patch', url, data)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        rows = IngredientAmount.objects.filter(recipe_id=response.json()['id'])
+        self.assertEqual(
+            {row.ingredient_id: row.amount for row in rows},
+            {self.ingredients[0].id: 2, **{
+                ingredient.id: 3 for ingredient in self.ingredients[5:9]
+            }}
+        )
+        self.assertEqual(rows.get(ingredient=self.ingredients[0]).id, kept.id)
+        self.assertEqual(
+            sorted(tag['id'] for tag in response.json()['tags']),
+            [tag.id for tag in self.tags[:1]]
+        )
+        # Снова все виды изменений, но строк в несколько раз больше.
+        data['ingredients'] = [
+            {'id': ingredient.id, 'amount': 4}
+            for ingredient in self.ingredients[1:7]
+        ] + [{'id': self.ingredients[9].id, 'amount': 4}]
+        data['tags'] = [tag.id for tag in self.tags]
+        response, large = self.send('patch', url, data)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(small, large)
+
+    def test_removed_rows_do_not_add_queries(self):
+        counts = []
+        for removed in (1, 8):
+            response, _ = self.send(
+                'post', '/api/recipes/', self.payload(10, f'Рецепт {removed}')
+            )
+            data = self.payload(10 - removed, f'Рецепт {removed}')
+            data['tags'] = [self.tags[0].id]
+            response, queries = self.send(
+                'patch', f'/api/recipes/{response.json()["id"]}/', data
+            )
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertEqual(
+                len(response.json()['ingredients']), 10 - removed
+            )
+            counts.append(queries)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_unknown_or_repeated_ingredient(self):
+        data = self.payload(2)
+        data['ingredients'].append({'id': 10 ** 6, 'amount': 1})
+        response, _ = self.send('post', '/api/recipes/', data)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        data = self.payload(2)
+        data['ingredients'].append(data['ingredients'][0])
+        response, _ = self.send('post', '/api/recipes/', data)
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertFalse(Recipes.objects.exists())
+
+
+class RecipeImportTestCase(TestCase):
+    """Импорт NDJSON: пачки, ошибки по строкам, команда."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@ya.ru', username='user')
+        cls.token = Token.objects.create(user=cls.user).key
+        cls.tag = Tag.objects.create(name='Тег', slug='tag')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Продукт {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def line(self, name, ingredient_ids=None):
+        return json.dumps({
+            'name': name, 'text': 'Текст', 'cooking_time': 5,
+            'image': IMAGE, 'tags': [self.tag.id],
+            'ingredients': [
+                {'id': ingredient_id, 'amount': 10}
+                for ingredient_id in (
+                    ingredient_ids
+                    or [ingredient.id for ingredient in self.ingredients]
+                )
+            ],
+        }, ensure_ascii=False)
+
+    def test_endpoint_reports_line_errors(self):
+        body = '\n'.join([
+            self.line('Первый'),
+            '{не json',
+            self.line('Второй', [10 ** 6]),
+            self.line('Первый'),
+            '',
+            self.line('Третий'),
+        ])
+        response = Client().post(
+            '/api/recipes/import/', body,
+            content_type='application/x-ndjson',
+            HTTP_AUTHORIZATION=f'Token {self.token}'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        report = response.json()
+        self.assertEqual(report['created'], 2)
+        self.assertEqual(
+            [error['line'] for error in report['errors']], [2, 3, 4]
+        )
+        recipe = Recipes.objects.get(name='Третий')
+        self.assertEqual(recipe.author, self.user)
+        self.assertEqual(recipe.ingredients.count(), 3)
+        self.assertEqual(list(recipe.tags.all()), [self.tag])
+
+    def test_unknown_tag_is_line_error(self):
+        line = json.loads(self.line('С тегами'))
+        line['tags'] = [self.tag.id, 10 ** 6]
+        report = RecipeImporter(self.user).run(
+            [json.dumps(line), self.line('Без ошибок')]
+        )
+        self.assertEqual(report['created'], 1)
+        self.assertEqual(report['errors'], [
+            {'line': 1, 'errors': {'tags': [f'Тег не найден: {10 ** 6}.']}}
+        ])
+        self.assertFalse(Recipes.objects.filter(name='С тегами').exists())
+
+    def test_failed_batch_reports_only_failing_rows(self):
+        importer = RecipeImporter(self.user, batch_size=3)
+        # Рецепт с тем же названием создан после загрузки справочников.
+        Recipes.objects.create(
+            author=self.user, name='Второй', text='Текст',
+            cooking_time=5, image='media/recipe.png'
+        )
+        report = importer.run(
+            [self.line(name) for name in ('Первый', 'Второй', 'Третий')]
+        )
+        self.assertEqual(report['created'], 2)
+        self.assertEqual([error['line'] for error in report['errors']], [2])
+        self.assertEqual(
+            set(Recipes.objects.values_list('name', flat=True)),
+            {'Первый', 'Второй', 'Третий'}
+        )
+
+    def test_each_batch_charges_throttle(self):
+        caches['throttle'].clear()
+        self.addCleanup(caches['throttle'].clear)
+        body = '\n'.join(self.line(f'Рецепт {number}') for number in range(5))
+        importer = functools.partial(RecipeImporter, batch_size=2)
+        throttling = override_settings(THROTTLING={
+            'ENABLED': True, 'CACHE': 'throttle',
+            'RATES': {'recipes.import_recipes': '2/min'},
+        })
+        with mock.patch('api.views.RecipeImporter', importer), throttling:
+            response = Client().post(
+                '/api/recipes/import/', body,
+                content_type='application/x-ndjson',
+                HTTP_AUTHORIZATION=f'Token {self.token}'
+            )
+        self.assertEqual(response.status_code, HTTPStatus.TOO_MANY_REQUESTS)
+        self.assertEqual(
+            response.json(), {'created': 4, 'errors': [], 'stopped_at': 5}
+        )
+        self.assertIn(int(response['Retry-After']), (29, 30))
+
+    def test_query_count_does_not_grow_with_lines(self):
+        path = os.path.join(self.directory, 'recipes.ndjson')
+        self.assertEqual(
+            *(self.measure(path, names) for names in (
+                ['Один'], [f'Рецепт {number}' for number in range(20)]
+            ))
+        )
+        self.assertEqual(Recipes.objects.count(), 21)
+
+    def measure(self, path, names):
+        with open(path, 'w', encoding='utf-8') as target:
+            target.write('\n'.join(map(self.line, names)))
+        counter = RequestTiming('import')
+        with connection.execute_wrapper(counter):
+            call_command(
+                'import_recipes', path, author=self.user.email,
+                batch_size=50, stdout=io.StringIO()
+            )
+        return counter.queries
+
+    def test_anonymous_forbidden(self):
+        response = Client().post(
+            '/api/recipes/import/', self.line('Рецепт'),
+            content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+
+class RecipeExportTestCase(TestCase):
+    """Потоковая выгрузка каталога."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create(
+            email='staff@ya.ru', username='staff', is_staff=True
+        )
+        user = User.objects.create(email='user@ya.ru', username='user')
+        cls.staff_token = Token.objects.create(user=cls.staff).key
+        cls.user_token = Token.objects.create(user=user).key
+        tag = Tag.objects.create(name='Тег', slug='tag')
+        ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+        for number in range(7):
+            recipe = Recipes.objects.create(
+                author=user, name=f'Рецепт {number}', text='Текст',
+                cooking_time=5, image='media/recipe.png'
+            )
+            recipe.tags.add(tag)
+            IngredientAmount.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=number + 1
+            )
+
+    def export(self, token, query=''):
+        return Client().get(
+            f'/api/recipes/export/{query}',
+            HTTP_AUTHORIZATION=f'Token {token}'
+        )
+
+    def test_ndjson(self):
+        response = self.export(self.staff_token)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(response.streaming)
+        records = [
+            json.loads(line) for line in
+            b''.join(response.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual(len(records), 7)
+        self.assertEqual(records[0]['tags'], ['tag'])
+        self.assertEqual(records[6]['ingredients'][0]['amount'], 7)
+
+    async def test_asgi_streams_async_iterator(self):
+        response = await self.async_client.get(
+            '/api/recipes/export/',
+            headers={'Authorization': f'Token {self.staff_token}'}
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(response.is_async)
+        content = b''.join([
+            chunk async for chunk in response.streaming_content
+        ])
+        self.assertEqual(len(content.decode().splitlines()), 7)
+
+    def test_csv(self):
+        response = self.export(self.staff_token, '?file_format=csv')
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(rows[0].split(',')[:2], ['id', 'name'])
+        self.assertEqual(len(rows), 8)
+        self.assertIn('Соль:1 г', rows[1])
+
+    def test_queries_per_chunk(self):
+        # Один курсор по рецептам с авторами и по запросу за составом
+        # и тегами на каждую из трех пачек.
+        output = io.StringIO()
+        with self.assertNumQueries(7):
+            call_command('export_recipes', chunk_size=3, stdout=output)
+        self.assertEqual(len(output.getvalue().splitlines()), 7)
+
+    def test_staff_only(self):
+        self.assertEqual(
+            self.export(self.user_token).status_code, HTTPStatus.FORBIDDEN
+        )
+
+
+class FeedTestCase(TestCase):
+    """Лента подписок: раскладка при записи и курсорная пагинация."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@ya.ru', username='user')
+        cls.author = User.objects.create(
+            email='author@ya.ru', username='author'
+        )
+        cls.other = User.objects.create(email='other@ya.ru', username='other')
+        cls.token = Token.objects.create(user=cls.user).key
+        cls.author_token = Token.objects.create(user=cls.author).key
+
+    def create_recipes(self, author, count):
+        offset = Recipes.objects.count()
+        # Задача раскладки ставится после фиксации транзакции.
+        with self.captureOnCommitCallbacks(execute=True):
+            recipes = [
+                Recipes.objects.create(
+                    author=author, name=f'Рецепт {offset + number}',
+                    text='Текст', cooking_time=5, image='media/recipe.png'
+                )
+                for number in range(count)
+            ]
+        self.run_jobs()
+        return recipes
+
+    def run_jobs(self):
+        with override_settings(JOBS={}):
+            call_command('run_workers', processes=1, threads=1, burst=True)
+
+    def feed(self, url='/api/recipes/feed/?limit=3'):
+        response = Client().get(url, HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response.json()
+
+    def test_subscribe_fan_out_and_unsubscribe(self):
+        old = self.create_recipes(self.author, 2)
+        self.create_recipes(self.other, 2)
+        Follower.objects.create(user=self.user, author=self.author)
+        new = self.create_recipes(self.author, 3)
+        ids = [recipe.id for recipe in reversed(old + new)]
+        page = self.feed()
+        self.assertEqual([item['id'] for item in page['results']], ids[:3])
+        self.assertIsNone(page['previous'])
+        page = self.feed(page['next'])
+        self.assertEqual([item['id'] for item in page['results']], ids[3:])
+        self.assertIsNone(page['next'])
+        Follower.objects.get(user=self.user, author=self.author).delete()
+        self.assertFalse(FeedEntry.objects.filter(user=self.user).exists())
+
+    def test_new_recipe_reaches_followers_through_queue(self):
+        Follower.objects.create(user=self.user, author=self.author)
+        Follower.objects.create(user=self.other, author=self.author)
+        ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            MEDIA_ROOT=directory
+        ), self.captureOnCommitCallbacks(execute=True):
+            response = Client().post(
+                '/api/recipes/', {
+                    'name': 'Новый', 'text': 'Текст', 'cooking_time': 5,
+                    'image': IMAGE, 'tags': [],
+                    'ingredients': [{'id': ingredient.id, 'amount': 1}],
+                }, content_type='application/json',
+                HTTP_AUTHORIZATION=f'Token {self.author_token}'
+            )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        recipe_id = response.json()['id']
+        # Запрос только поставил задачу, ленты заполнит воркер.
+        self.assertFalse(
+            FeedEntry.objects.filter(recipe_id=recipe_id).exists()
+        )
+        self.assertEqual(
+            list(Job.objects.values_list('name', 'args')),
+            [(fan_out_recipes.task_name, [[recipe_id]])]
+        )
+        self.run_jobs()
+        self.assertEqual(
+            set(FeedEntry.objects.filter(recipe_id=recipe_id).values_list(
+                'user_id', flat=True
+            )),
+            {self.user.id, self.other.id}
+        )
+        self.assertEqual(Job.objects.get().status, JobStatus.DONE)
+
+    def test_import_fans_out(self):
+        Follower.objects.create(user=self.user, author=self.author)
+        ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            MEDIA_ROOT=directory
+        ), self.captureOnCommitCallbacks(execute=True):
+            report = RecipeImporter(self.author).run([json.dumps({
+                'name': 'Импорт', 'text': 'Текст', 'cooking_time': 5,
+                'image': IMAGE, 'tags': [],
+                'ingredients': [{'id': ingredient.id, 'amount': 1}],
+            })])
+        self.assertEqual(report['created'], 1)
+        self.run_jobs()
+        self.assertEqual(self.feed()['results'][0]['name'], 'Импорт')
+
+    def test_feed_query_count_does_not_grow_with_page(self):
+        Follower.objects.create(user=self.user, author=self.author)
+        tag = Tag.objects.create(name='Тег', slug='tag')
+        ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+        for recipe in self.create_recipes(self.author, 6):
+            recipe.tags.add(tag)
+            IngredientAmount.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=1
+            )
+        caches['interactions'].clear()
+        self.feed()
+        counts = []
+        for limit in (2, 6):
+            with CaptureQueriesContext(connection) as queries:
+                page = self.feed(f'/api/recipes/feed/?limit={limit}')
+            self.assertEqual(len(page['results']), limit)
+            self.assertEqual(page['results'][0]['ingredients'][0]['name'],
+                             'Соль')
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    @skipUnless(connection.vendor == 'sqlite', 'План запроса в SQLite')
+    def test_feed_is_index_range(self):
+        sql, params = FeedEntry.objects.filter(user=self.user).order_by(
+            '-recipe_id'
+        )[:4].query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        self.assertTrue(
+            any(detail.startswith('SEARCH recipes_feedentry USING')
+                for detail in plan),
+            plan
+        )
+        self.assertFalse(any('TEMP B-TREE' in detail for detail in plan))
+
+
+class ThrottlingTestCase(TestCase):
+    """Token bucket на дорогих действиях, общий кэш воркеров."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@ya.ru', username='user')
+        cls.token = Token.objects.create(user=cls.user).key
+        cls.recipe = Recipes.objects.create(
+            author=cls.user, name='Рецепт', text='Текст',
+            cooking_time=5, image='media/recipe.png'
+        )
+
+    def setUp(self):
+        caches['throttle'].clear()
+        self.addCleanup(caches['throttle'].clear)
+
+    def config(self, **rates):
+        return override_settings(THROTTLING={
+            'ENABLED': True, 'CACHE': 'throttle', 'RATES': rates,
+        })
+
+    def test_bucket_per_user_with_retry_after(self):
+        url = f'/api/recipes/{self.recipe.id}/get-link/'
+        client = Client(HTTP_AUTHORIZATION=f'Token {self.token}')
+        with self.config(**{'recipes.short_link': '2/min'}):
+            statuses = [client.get(url).status_code for _ in range(3)]
+            response = client.get(url)
+            other = Client().get(url)
+        self.assertEqual(statuses, [HTTPStatus.OK] * 2 + [
+            HTTPStatus.TOO_MANY_REQUESTS
+        ])
+        self.assertEqual(response.status_code, HTTPStatus.TOO_MANY_REQUESTS)
+        # Жетон пополняется за 30 секунд.
+        self.assertIn(int(response['Retry-After']), (29, 30))
+        # Аноним считается по IP в своем ведре.
+        self.assertEqual(other.status_code, HTTPStatus.OK)
+
+    def test_registration_by_ip(self):
+        with self.config(**{'users.create': '1/hour'}):
+            statuses = [
+                Client().post('/api/users/', {
+                    'email': f'new{number}@ya.ru',
+                    'username': f'new{number}',
+                    'first_name': 'Имя', 'last_name': 'Фамилия',
+                    'password': 'password-123',
+                }).status_code
+                for number in range(2)
+            ]
+        self.assertEqual(
+            statuses, [HTTPStatus.CREATED, HTTPStatus.TOO_MANY_REQUESTS]
+        )
+
+    def test_concurrent_burst_stays_within_limit(self):
+        request = Request(APIRequestFactory().get('/'))
+        request.user = self.user
+        view = RecipesViewSet(action='download_shopping_cart')
+        # Файловый кэш (flock) и кэш с атомарным add (locmem).
+        for cache in ('throttle', 'default'):
+            caches[cache].clear()
+            barrier = threading.Barrier(20)
+            results = []
+
+            def check():
+                barrier.wait()
+                results.append(
+                    TokenBucketThrottle().allow_request(request, view)
+                )
+
+            with override_settings(THROTTLING={
+                'ENABLED': True, 'CACHE': cache,
+                'RATES': {'recipes.download_shopping_cart': '5/h'},
+            }):
+                threads = [threading.Thread(target=check) for _ in range(20)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            with self.subTest(cache=cache):
+                self.assertEqual(results.count(True), 5)
+
+    def test_lock_timeout_keeps_other_owner(self):
+        for cache in ('throttle', 'default'):
+            with self.subTest(cache=cache):
+                cache = caches[cache]
+                held = threading.Event()
+                release = threading.Event()
+
+                def owner():
+                    with cache_lock(cache, 'key', 5):
+                        held.set()
+                        release.wait(5)
+
+                thread = threading.Thread(target=owner)
+                thread.start()
+                held.wait(5)
+                start = time.monotonic()
+                with self.assertRaises(LockTimeoutError):
+                    with cache_lock(cache, 'key', 0.1):
+                        self.fail('Секция выполнена без блокировки.')
+                self.assertLess(time.monotonic() - start, 1)
+                # Блокировка владельца не снята чужим таймаутом.
+                with self.assertRaises(LockTimeoutError):
+                    with cache_lock(cache, 'key', 0.05):
+                        pass
+                release.set()
+                thread.join()
+                with cache_lock(cache, 'key', 0.1):
+                    pass
+
+    def test_lock_timeout_rejects_request(self):
+        request = Request(APIRequestFactory().get('/'))
+        request.user = self.user
+        view = RecipesViewSet(action='download_shopping_cart')
+        throttle = TokenBucketThrottle()
+        with self.config(**{'recipes.download_shopping_cart': '5/min'}), \
+                mock.patch('api.throttling.cache_lock',
+                           side_effect=LockTimeoutError):
+            self.assertFalse(throttle.allow_request(request, view))
+        self.assertEqual(throttle.wait(), 1)
+
+    def test_check_is_fast(self):
+        request = Request(APIRequestFactory().get('/'))
+        request.user = self.user
+        view = RecipesViewSet(action='download_shopping_cart')
+        throttle = TokenBucketThrottle()
+        with self.config(**{'recipes.download_shopping_cart': '1000000/s'}):
+            start = time.perf_counter()
+            for _ in range(200):
+                self.assertTrue(throttle.allow_request(request, view))
+            elapsed = (time.perf_counter() - start) / 200
+        self.assertLess(elapsed, 0.001)
+
+
+calls = []
+
+
+@task
+def record_call(value):
+    """Тестовая задача: запоминает аргумент."""
+    calls.append(value)
+
+
+@task
+def always_fails():
+    """Тестовая задача, которая всегда падает."""
+    raise ValueError('сбой')
+
+
+class JobQueueTestCase(TestCase):
+    """Очередь задач: выполнение, повторы, расписание, скорость."""
+
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_and_run(self):
+        job = record_call.enqueue(5)
+        self.assertTrue(Worker('w1').run_once())
+        self.assertFalse(Worker('w1').run_once())
+        self.assertEqual(calls, [5])
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.DONE)
+        self.assertEqual(job.attempts, 1)
+
+    def test_retry_with_backoff_then_fail(self):
+        job = enqueue(always_fails, max_attempts=2)
+        before = timezone.now()
+        Worker('w1').run_once()
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.QUEUED)
+        self.assertIn('сбой', job.last_error)
+        self.assertGreaterEqual(
+            job.run_at, before + timedelta(seconds=backoff(1))
+        )
+        # Повтор еще не наступил.
+        self.assertFalse(Worker('w1').run_once())
+        Job.objects.filter(id=job.id).update(run_at=timezone.now())
+        Worker('w1').run_once()
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_claim_is_exclusive_and_reclaims_stale(self):
+        job = record_call.enqueue(1)
+        self.assertEqual(claim('w1').id, job.id)
+        self.assertIsNone(claim('w2'))
+        Job.objects.filter(id=job.id).update(
+            locked_at=timezone.now() - timedelta(hours=1)
+        )
+        reclaimed = claim('w2')
+        self.assertEqual(reclaimed.id, job.id)
+        self.assertEqual(reclaimed.attempts, 2)
+
+    def test_periodic_once_per_interval(self):
+        schedule = {'SCHEDULE': {
+            'calls': {'TASK': record_call.task_name, 'INTERVAL': 60,
+                      'ARGS': [1]},
+        }}
+        now = timezone.now()
+        with override_settings(JOBS=schedule):
+            enqueue_periodic(now)
+            enqueue_periodic(now)
+            enqueue_periodic(now + timedelta(seconds=60))
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_one_scheduler_job_per_tick(self):
+        schedule = {'SCHEDULE': {
+            'calls': {'TASK': record_call.task_name, 'INTERVAL': 60,
+                      'ARGS': [1]},
+        }}
+        workers = [
+            Worker(f'w{number}', scheduler=True) for number in range(3)
+        ]
+        with override_settings(JOBS=schedule), mock.patch(
+            'api.jobs.time.time', return_value=6000.0
+        ):
+            for worker in workers:
+                worker.schedule()
+                # До следующего шага планировщик базу не трогает.
+                with self.assertNumQueries(0):
+                    worker.schedule()
+            Worker('w4').schedule()
+            self.assertEqual(
+                list(Job.objects.values_list('name', 'key')),
+                [(schedule_periodic.task_name, 'schedule:100')]
+            )
+            while Worker('w1').run_once():
+                pass
+        self.assertEqual(calls, [1])
+
+    def test_command_burst(self):
+        for number in range(3):
+            record_call.enqueue(number)
+        with override_settings(JOBS={}):
+            call_command('run_workers', processes=1, threads=1, burst=True)
+        self.assertEqual(sorted(calls), [0, 1, 2])
+
+    def test_throughput_and_claim_latency(self):
+        count = 300
+        Job.objects.bulk_create(
+            Job(name=record_call.task_name, args=[number])
+            for number in range(count)
+        )
+        worker = Worker('w1')
+        latencies = []
+        start = time.perf_counter()
+        while True:
+            claimed = time.perf_counter()
+            job = claim(worker.name)
+            latencies.append(time.perf_counter() - claimed)
+            if job is None:
+                break
+            worker.execute(job)
+        elapsed = time.perf_counter() - start
+        self.assertEqual(len(calls), count)
+        self.assertGreater(count / elapsed, 100)
+        self.assertLess(percentile(latencies, 95), 0.02)
+
+
+class ShoppingListDocumentTestCase(TestCase):
+    """Документы списка покупок кэшируются по хешу корзины."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@ya.ru', username='user')
+        cls.token = Token.objects.create(user=cls.user).key
+        cls.salt = Ingredient.objects.create(name='Соль', measurement_unit='г')
+        cls.recipes = []
+        for number in range(2):
+            recipe = Recipes.objects.create(
+                author=cls.user, name=f'Рецепт {number}', text='Текст',
+                cooking_time=5, image='media/recipe.png'
+            )
+            IngredientAmount.objects.create(
+                recipe=recipe, ingredient=cls.salt, amount=number + 1
+            )
+            cls.recipes.append(recipe)
+        ShoppingList.objects.create(author=cls.user, recipe=cls.recipes[0])
+        # В TestCase on_commit не выполняется: номера раздаются явно.
+        sync.number_pending()
+
+    def setUp(self):
+        caches['documents'].clear()
+        caches['throttle'].clear()
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def download(self, query='', **headers):
+        return self.client.get(
+            f'/api/recipes/download_shopping_cart/{query}', **headers
+        )
+
+    def test_etag_and_not_modified(self):
+        response = self.download()
+        self.assertEqual(
+            response.content.decode(), 'Список покупок:\n\n1) Соль - 1 г\n'
+        )
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        response = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_cached_until_cart_or_ingredient_changes(self):
+        first = self.download()
+        counter = RequestTiming('download')
+        with connection.execute_wrapper(counter):
+            second = self.download()
+        self.assertEqual(first['ETag'], second['ETag'])
+        # Без агрегации: только хеш корзины.
+        self.assertEqual(counter.queries, 1)
+        ShoppingList.objects.create(author=self.user, recipe=self.recipes[1])
+        third = self.download()
+        self.assertNotEqual(third['ETag'], first['ETag'])
+        self.assertIn('Соль - 3 г', third.content.decode())
+        self.salt.name = 'Морская соль'
+        self.salt.save()
+        fourth = self.download()
+        self.assertNotEqual(fourth['ETag'], third['ETag'])
+        self.assertIn('Морская соль', fourth.content.decode())
+
+    def test_document_cached_under_its_own_contents(self):
+        # Количество меняется между проверкой хеша и построением.
+        stale = cart_digest(cart_versions(self.user), get_version())
+        amount = IngredientAmount.objects.get(recipe=self.recipes[0])
+        amount.amount = 7
+        amount.save()
+        # Строка меняется отдельно от рецепта, как в IngredientAmountAdmin.
+        sync.mark_pending([amount.recipe_id])
+        sync.number_pending()
+        digest, content = get_document(self.user, stale, 'txt')
+        self.assertNotEqual(digest, stale)
+        self.assertIn('Соль - 7 г', content.decode())
+        self.assertIsNone(
+            caches['documents'].get(f'shopping-list:txt:{stale}')
+        )
+        self.assertEqual(self.download()['ETag'], f'"{digest[:32]}-txt"')
+
+    def test_pending_change_is_not_cached(self):
+        amount = IngredientAmount.objects.get(recipe=self.recipes[0])
+        amount.amount = 5
+        amount.save()
+        # Строка меняется отдельно от рецепта, как в IngredientAmountAdmin.
+        sync.mark_pending([amount.recipe_id])
+        response = self.download()
+        self.assertIn('Соль - 5 г', response.content.decode())
+        self.assertNotIn('ETag', response)
+
+    def test_csv_and_pdf(self):
+        csv_response = self.download('?file_format=csv')
+        self.assertEqual(
+            csv_response.content.decode().splitlines()[1], '1,Соль,1,г'
+        )
+        pdf_response = self.download('?file_format=pdf')
+        self.assertEqual(pdf_response['Content-Type'], 'application/pdf')
+        self.assertTrue(pdf_response.content.startswith(b'%PDF'))
+        self.assertNotEqual(csv_response['ETag'], pdf_response['ETag'])
+        self.assertEqual(
+            self.download('?file_format=doc').status_code,
+            HTTPStatus.BAD_REQUEST
+        )
+
+
+class SubscribedAnnotationTestCase(TestCase):
+    """is_subscribed без запроса на каждого пользователя."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@ya.ru', username='user')
+        cls.token = Token.objects.create(user=cls.user).key
+        cls.authors = [
+            User.objects.create(
+                email=f'author{number}@ya.ru', username=f'author{number}'
+            )
+            for number in range(5)
+        ]
+        for author in cls.authors[:3]:
+            Follower.objects.create(user=cls.user, author=author)
+        for number, author in enumerate(cls.authors):
+            Recipes.objects.create(
+                author=author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=5, image='media/recipe.png'
+            )
+
+    def setUp(self):
+        caches['interactions'].clear()
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.client.get('/api/tags/')
+
+    def test_list_query_count_does_not_grow(self):
+        # Токен в кэше: количество и страница пользователей.
+        with self.assertNumQueries(2):
+            small = self.client.get('/api/users/?limit=2').json()
+        with self.assertNumQueries(2):
+            large = self.client.get('/api/users/?limit=6').json()
+        self.assertEqual(len(small['results']), 2)
+        subscribed = {
+            item['id']: item['is_subscribed'] for item in large['results']
+        }
+        for number, author in enumerate(self.authors):
+            if author.id in subscribed:
+                self.assertEqual(subscribed[author.id], number < 3)
+
+    def test_retrieve_and_me(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/users/{self.authors[0].id}/')
+        self.assertTrue(response.json()['is_subscribed'])
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/users/me/')
+        self.assertFalse(response.json()['is_subscribed'])
+
+    def test_recipe_authors_share_one_query(self):
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, self.user)
+        request = Request(request)
+        recipes = list(Recipes.objects.select_related('author'))
+        # Одно множество подписок на весь запрос.
+        with self.assertNumQueries(1):
+            data = [
+                UserSerializer(
+                    recipe.author, context={'request': request}
+                ).data['is_subscribed']
+                for recipe in recipes
+            ]
+        self.assertEqual(data.count(True), 3)
+
+
+# Манифест статики появляется только после collectstatic.
+@override_settings(STORAGES={**settings.STORAGES, 'staticfiles': {
+    'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+}})
+class AdminQueryBudgetTestCase(TestCase):
+    """Страницы админки не делают запросов на каждую строку."""
+
+    CHANGELISTS = (
+        'recipes', 'ingredientamount', 'shoppinglist', 'favorite',
+        'follower', 'ingredient', 'user',
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(
+            email='admin@ya.ru', username='admin', is_staff=True,
+            is_superuser=True
+        )
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch')
+        cls.ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.admin)
+
+    def add_rows(self, count):
+        start = User.objects.count()
+        for number in range(start, start + count):
+            user = User.objects.create(
+                email=f'user{number}@ya.ru', username=f'user{number}'
+            )
+            recipe = Recipes.objects.create(
+                author=user, name=f'Рецепт {number}', text='Текст',
+                cooking_time=5, image='media/recipe.png'
+            )
+            recipe.tags.add(self.tag)
+            IngredientAmount.objects.create(
+                recipe=recipe, ingredient=self.ingredient, amount=1
+            )
+            ShoppingList.objects.create(author=user, recipe=recipe)
+            Favorite.objects.create(author=user, recipe=recipe)
+            Favorite.objects.create(author=self.admin, recipe=recipe)
+            Follower.objects.create(user=user, author=self.admin)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def test_changelists_query_budget(self):
+        self.add_rows(2)
+        small = {
+            name: self.count_queries(f'/admin/recipes/{name}/')
+            for name in self.CHANGELISTS
+        }
+        self.add_rows(20)
+        for name in self.CHANGELISTS:
+            with self.subTest(name=name):
+                self.assertEqual(
+                    self.count_queries(f'/admin/recipes/{name}/'),
+                    small[name]
+                )
+
+    def test_favorite_count_annotation(self):
+        self.add_rows(3)
+        response = self.client.get('/admin/recipes/recipes/?o=4')
+        self.assertEqual(
+            [obj.favorite_total for obj in response.context['cl'].result_list],
+            [2, 2, 2]
+        )
+
+    def test_recipe_change_form_uses_autocomplete(self):
+        self.add_rows(1)
+        recipe = Recipes.objects.get()
+        for number in range(50):
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+        response = self.client.get(
+            f'/admin/recipes/recipes/{recipe.id}/change/'
+        )
+        self.assertEqual(response.status_code, 200)
+        # В выпадающих списках только выбранные значения.
+        self.assertNotContains(response, 'Ингредиент 49')
+        response = self.client.get(
+            '/admin/autocomplete/', {
+                'app_label': 'recipes', 'model_name': 'ingredientamount',
+                'field_name': 'ingredient', 'term': '49',
+            }
+        )
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_ingredient_amount_admin_marks_recipe_pending(self):
+        self.add_rows(1)
+        amount = IngredientAmount.objects.get()
+        sync.number_pending()
+        self.client.post(
+            f'/admin/recipes/ingredientamount/{amount.id}/change/', {
+                'ingredient': self.ingredient.id,
+                'recipe': amount.recipe_id, 'amount': 5,
+            }
+        )
+        self.assertIsNone(Recipes.objects.get().sync_seq)
+
+    def test_ingredient_inline_rows_without_queries(self):
+        self.add_rows(1)
+        recipe = Recipes.objects.get()
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(
+                recipe=recipe, amount=1, ingredient=Ingredient.objects.create(
+                    name=f'Ингредиент {number}', measurement_unit='г'
+                )
+            )
+            for number in range(10)
+        )
+        request = RequestFactory().get('/')
+        request.user = self.admin
+        rows = list(
+            IngredientAmountInline(Recipes, django_admin.site).get_queryset(
+                request
+            ).filter(recipe=recipe)
+        )
+        # Подписи строк состава (IngredientAmount.__str__) без запросов.
+        with self.assertNumQueries(0):
+            labels = [str(row) for row in rows]
+        self.assertEqual(len(labels), 11)
+
+
+class InteractionsTestCase(TestCase):
+    """Флаги пользователя из кэшируемых множеств id."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@ya.ru', username='user')
+        cls.author = User.objects.create(
+            email='author@ya.ru', username='author'
+        )
+        cls.token = Token.objects.create(user=cls.user).key
+        cls.recipes = [
+            Recipes.objects.create(
+                author=cls.author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=5, image='media/recipe.png'
+            )
+            for number in range(4)
+        ]
+        Favorite.objects.create(author=cls.user, recipe=cls.recipes[0])
+        ShoppingList.objects.create(author=cls.user, recipe=cls.recipes[1])
+
+    def setUp(self):
+        caches['interactions'].clear()
+        caches['throttle'].clear()
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def flags(self, recipe):
+        data = self.client.get(f'/api/recipes/{recipe.id}/').json()
+        return (
+            data['is_favorited'], data['is_in_shopping_cart'],
+            data['author']['is_subscribed']
+        )
+
+    def test_id_set(self):
+        ids = IdSet(array('q', [2, 5, 9]))
+        self.assertIn(5, ids)
+        self.assertNotIn(4, ids)
+        self.assertNotIn(10, ids)
+        self.assertEqual(len(IdSet()), 0)
+
+    def test_sets_are_cached_across_requests(self):
+        self.assertEqual(
+            [self.flags(recipe) for recipe in self.recipes[:3]],
+            [(True, False, False), (False, True, False),
+             (False, False, False)]
+        )
+        state = Interactions(self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(list(state.favorites), [self.recipes[0].id])
+            self.assertEqual(list(state.cart), [self.recipes[1].id])
+            self.assertEqual(list(state.followed), [])
+
+    def test_actions_invalidate(self):
+        recipe = self.recipes[2]
+        self.assertEqual(self.flags(recipe), (False, False, False))
+        self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(self.flags(recipe), (True, True, True))
+        self.client.delete(f'/api/recipes/{recipe.id}/favorite/')
+        self.client.delete(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(self.flags(recipe), (False, True, False))
+
+    def test_anonymous(self):
+        with self.assertNumQueries(0):
+            self.assertNotIn(self.recipes[0].id, Interactions(
+                AnonymousUser()
+            ).favorites)
+
+
+class RecipeFilterTestCase(TestCase):
+    """Фильтры рецептов одинаковы в синхронном и асинхронном списке."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@ya.ru', username='user')
+        cls.author = User.objects.create(
+            email='author@ya.ru', username='author'
+        )
+        cls.token = Token.objects.create(user=cls.user).key
+        lunch = Tag.objects.create(name='Обед', slug='lunch')
+        dinner = Tag.objects.create(name='Ужин', slug='dinner')
+        cls.recipes = []
+        for number in range(6):
+            recipe = Recipes.objects.create(
+                author=cls.author if number % 2 else cls.user,
+                name=f'Рецепт {number}', text='Текст',
+                cooking_time=5, image='media/recipe.png'
+            )
+            recipe.tags.set([lunch, dinner][:number % 3])
+            cls.recipes.append(recipe)
+        for recipe in cls.recipes[:4]:
+            Favorite.objects.create(author=cls.user, recipe=recipe)
+            # Чужое избранное не должно размножать строки.
+            Favorite.objects.create(author=cls.author, recipe=recipe)
+        for recipe in cls.recipes[2:5]:
+            ShoppingList.objects.create(author=cls.user, recipe=recipe)
+
+    def setUp(self):
+        caches['interactions'].clear()
+        caches['throttle'].clear()
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def ids(self, query, view=None):
+        request = APIRequestFactory().get(f'/api/recipes/?{query}')
+        force_authenticate(request, self.user)
+        data = (view or RecipesViewSet.as_view({'get': 'list'}))(
+            request
+        ).data
+        return sorted(item['id'] for item in data['results'])
+
+    def expected(self, numbers):
+        return sorted(self.recipes[number].id for number in numbers)
+
+    def test_filters(self):
+        cases = {
+            '': range(6),
+            f'author={self.author.id}': (1, 3, 5),
+            'is_favorited=1': (0, 1, 2, 3),
+            'is_favorited=0': range(6),
+            'is_in_shopping_cart=true': (2, 3, 4),
+            'is_favorited=1&is_in_shopping_cart=1': (2, 3),
+            'tags=lunch': (1, 2, 4, 5),
+            'tags=lunch&tags=dinner': (2, 5),
+            'tags=lunch&tags=lunch': (1, 2, 4, 5),
+            'tags=unknown': (),
+            f'tags=lunch&is_favorited=1&author={self.author.id}': (1,),
+            'author=abc': (),
+        }
+        for query, numbers in cases.items():
+            with self.subTest(query=query):
+                self.assertEqual(self.ids(query), self.expected(numbers))
+                response = self.client.get(f'/api/recipes/?{query}')
+                self.assertEqual(
+                    sorted(item['id'] for item in response.json()['results']),
+                    self.expected(numbers)
+                )
+
+    def test_anonymous_ignores_user_filters(self):
+        response = Client().get(
+            '/api/recipes/?is_favorited=1&is_in_shopping_cart=1'
+        )
+        self.assertEqual(response.json()['count'], 6)
+
+
+class ContentAddressedStorageTestCase(TestCase):
+    """Медиафайлы по хешу содержимого: без дублей и без сирот."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@ya.ru', username='user')
+        cls.token = Token.objects.create(user=cls.user).key
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch')
+        cls.ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.media_root = directory.name
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        caches['throttle'].clear()
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def color_image(self, color):
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (1, 1), color).save(buffer, 'PNG')
+        return 'data:image/png;base64,' + base64.b64encode(
+            buffer.getvalue()
+        ).decode()
+
+    def files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media_root)
+            for root, _, names in os.walk(self.media_root)
+            for name in names
+        )
+
+    def send(self, method, url, name, image=IMAGE):
+        with self.captureOnCommitCallbacks(execute=True):
+            return getattr(self.client, method)(url, {
+                'name': name, 'text': 'Текст', 'cooking_time': 5,
+                'image': image, 'tags': [self.tag.id],
+                'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+            }, content_type='application/json')
+
+    def test_same_image_is_stored_once(self):
+        first = self.send('post', '/api/recipes/', 'Первый').json()
+        second = self.send('post', '/api/recipes/', 'Второй').json()
+        self.assertEqual(first['image'], second['image'])
+        self.assertRegex(
+            first['image'], r'/media/media/[0-9a-f]{2}/[0-9a-f]{64}\.png$'
+        )
+        self.assertEqual(len(self.files()), 1)
+        self.send('patch', f'/api/recipes/{first["id"]}/', 'Первый')
+        self.assertEqual(len(self.files()), 1)
+        # Файл удаляется вместе с последней ссылкой на него.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/recipes/{first["id"]}/')
+        self.assertEqual(len(self.files()), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/recipes/{second["id"]}/')
+        self.assertEqual(self.files(), [])
+
+    def test_replaced_image_is_removed(self):
+        recipe = self.send('post', '/api/recipes/', 'Рецепт').json()
+        old_files = self.files()
+        self.send(
+            'patch', f'/api/recipes/{recipe["id"]}/', 'Рецепт',
+            image=self.color_image('red')
+        )
+        new_files = self.files()
+        self.assertEqual(len(new_files), 1)
+        self.assertNotEqual(new_files, old_files)
+
+    def test_file_deleted_before_commit_is_restored(self):
+        first = self.send('post', '/api/recipes/', 'Первый').json()
+        with self.captureOnCommitCallbacks(execute=True):
+            second = self.client.post('/api/recipes/', {
+                'name': 'Второй', 'text': 'Текст', 'cooking_time': 5,
+                'image': IMAGE, 'tags': [self.tag.id],
+                'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+            }, content_type='application/json').json()
+            # Проверка ссылок другого запроса не видела строку второго
+            # рецепта и удалила файл, который тот переиспользовал.
+            name, = self.files()
+            default_storage.delete(name)
+        self.assertEqual(first['image'], second['image'])
+        self.assertEqual(self.files(), [name])
+
+    def test_avatar_shares_and_releases_files(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(
+                '/api/users/me/avatar/', {'avatar': IMAGE},
+                content_type='application/json'
+            )
+        self.user.refresh_from_db()
+        self.assertRegex(
+            self.user.avatar.name, r'^avatars/[0-9a-f]{2}/[0-9a-f]{64}\.png$'
+        )
+        self.assertEqual(self.files(), [self.user.avatar.name])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/api/users/me/avatar/')
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertEqual(self.files(), [])
+
+
+class StaticFilesTestCase(TestCase):
+    """collectstatic: хеши в именах, сжатые копии, immutable."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        cls.static_root = directory.name
+        static = override_settings(STATIC_ROOT=cls.static_root)
+        static.enable()
+        cls.addClassCleanup(static.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def test_hashed_and_compressed(self):
+        url = staticfiles_storage.url('admin/css/base.css')
+        self.assertRegex(url, r'^/static/admin/css/base\.[0-9a-f]{12}\.css$')
+        path = os.path.join(self.static_root, url[len('/static/'):])
+        for suffix in ('', '.gz', '.br'):
+            self.assertTrue(os.path.exists(path + suffix), path + suffix)
+        self.assertIn(
+            'foodgram_static_manifest_load_seconds', render_metrics()
+        )
+
+    def test_hashed_names_require_debug_off(self):
+        with override_settings(DEBUG=True):
+            self.assertEqual(
+                staticfiles_storage.url('admin/css/base.css'),
+                '/static/admin/css/base.css'
+            )
+
+    def test_served_immutable(self):
+        url = staticfiles_storage.url('admin/css/base.css')
+        response = Client().get(url, HTTP_ACCEPT_ENCODING='br, gzip')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn('immutable', response['Cache-Control'])
+        # Без хеша в имени файл может измениться.
+        response = Client().get('/static/admin/css/base.css')
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+
+class BatchRelationsTestCase(TestCase):
+    """Избранное, корзина и подписки пачкой одной вставкой."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@ya.ru', username='user')
+        cls.token = Token.objects.create(user=cls.user).key
+        cls.authors = [
+            User.objects.create(
+                email=f'author{number}@ya.ru', username=f'author{number}'
+            )
+            for number in range(3)
+        ]
+        cls.recipes = [
+            Recipes.objects.create(
+                author=cls.authors[number % 3], name=f'Рецепт {number}',
+                text='Текст', cooking_time=5, image='media/recipe.png'
+            )
+            for number in range(12)
+        ]
+
+    def setUp(self):
+        caches['interactions'].clear()
+        caches['throttle'].clear()
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.client.get('/api/tags/')
+
+    def send(self, method, url, ids):
+        return getattr(self.client, method)(
+            url, {'ids': ids}, content_type='application/json'
+        )
+
+    def statuses(self, response):
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return {
+            item['id']: item['status'] for item in response.json()['results']
+        }
+
+    def test_favorite_batch(self):
+        first, second, third = (recipe.id for recipe in self.recipes[:3])
+        response = self.send(
+            'post', '/api/recipes/favorite/', [first, second, first, 99999]
+        )
+        self.assertEqual(self.statuses(response), {
+            first: 'added', second: 'added', 99999: 'not_found'
+        })
+        response = self.send('post', '/api/recipes/favorite/', [first, third])
+        self.assertEqual(
+            self.statuses(response), {first: 'exists', third: 'added'}
+        )
+        response = self.send(
+            'delete', '/api/recipes/favorite/', [first, 99999]
+        )
+        self.assertEqual(
+            self.statuses(response), {first: 'removed', 99999: 'missing'}
+        )
+        self.assertEqual(
+            sorted(self.user.favorites.values_list('recipe_id', flat=True)),
+            [second, third]
+        )
+        data = self.client.get(f'/api/recipes/{second}/').json()
+        self.assertTrue(data['is_favorited'])
+
+    def test_batch_query_count_does_not_grow(self):
+        counts = []
+        for recipes in (self.recipes[:2], self.recipes[2:12]):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.send(
+                    'post', '/api/recipes/shopping_cart/',
+                    [recipe.id for recipe in recipes]
+                )
+            self.assertEqual(
+                set(self.statuses(response).values()), {'added'}
+            )
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(self.user.shopping_cart.count(), 12)
+
+    def test_single_subscribe_needs_no_author_lookup(self):
+        url = f'/api/users/{self.authors[0].id}/subscribe/'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        # Только DELETE ... RETURNING, без чтения автора.
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(
+            self.client.post(url).status_code, HTTPStatus.NO_CONTENT
+        )
+        self.assertEqual(
+            self.client.post(url).status_code, HTTPStatus.BAD_REQUEST
+        )
+        self.assertEqual(
+            self.client.post('/api/users/99999/subscribe/').status_code,
+            HTTPStatus.NOT_FOUND
+        )
+        self.assertEqual(
+            self.client.post(
+                f'/api/users/{self.user.id}/subscribe/'
+            ).status_code,
+            HTTPStatus.BAD_REQUEST
+        )
+
+    def test_returning_check(self):
+        self.assertEqual(relations.check_returning(), [])
+        with mock.patch.object(
+            type(connection.features), 'can_return_rows_from_bulk_insert',
+            False
+        ):
+            self.assertEqual(
+                [error.id for error in relations.check_returning()],
+                ['api.E001']
+            )
+
+    def test_subscribe_batch(self):
+        ids = [author.id for author in self.authors] + [self.user.id]
+        response = self.send('post', '/api/users/subscribe/', ids)
+        self.assertEqual(self.statuses(response), {
+            **{author.id: 'added' for author in self.authors},
+            self.user.id: 'self',
+        })
+        # Лента заполняется и без post_save от bulk_create.
+        self.assertEqual(FeedEntry.objects.filter(user=self.user).count(), 12)
+        response = self.send(
+            'delete', '/api/users/subscribe/', [self.authors[0].id]
+        )
+        self.assertEqual(self.statuses(response), {
+            self.authors[0].id: 'removed'
+        })
+        self.assertEqual(FeedEntry.objects.filter(user=self.user).count(), 8)
+
+    def test_validation(self):
+        for ids in ([], ['abc'], [0], list(range(1, 102))):
+            with self.subTest(ids=len(ids)):
+                response = self.send('post', '/api/recipes/favorite/', ids)
+                self.assertEqual(
+                    response.status_code, HTTPStatus.BAD_REQUEST
+                )
+
+    def test_single_item_survives_race(self):
+        recipe = self.recipes[0]
+        response = self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        response = self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        # Параллельный запрос вставил строку, пока состояние было старым.
+        recipe = self.recipes[1]
+        self.client.get(f'/api/recipes/{recipe.id}/')
+        Favorite.objects.bulk_create([
+            Favorite(author=self.user, recipe=recipe)
+        ])
+        # Результат берется из вставки, а не из устаревшего состояния.
+        response = self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(
+            Favorite.objects.filter(author=self.user, recipe=recipe).count(),
+            1
+        )
+        response = self.client.post('/api/recipes/99999/shopping_cart/')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        # Ответ собирается без повторного чтения строки корзины.
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                f'/api/recipes/{recipe.id}/shopping_cart/'
+            )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        item = ShoppingList.objects.get(author=self.user, recipe=recipe)
+        self.assertEqual(
+            response.json(), {'id': item.id, 'recipe': recipe.id}
+        )
+        self.assertFalse([
+            query for query in queries
+            if query['sql'].startswith('SELECT')
+            and 'recipes_shoppinglist' in query['sql']
+        ])
+
+    def test_double_click_adds_once(self):
+        recipe = self.recipes[0]
+        # Оба запроса видят одно и то же состояние без рецепта.
+        self.client.get(f'/api/recipes/{recipe.id}/')
+        first = relations.add('favorite', self.user, [recipe.id])
+        second = relations.add('favorite', self.user, [recipe.id])
+        self.assertEqual(first, {recipe.id: 'added'})
+        self.assertEqual(second, {recipe.id: 'exists'})
+        # Удаляет строку только один из двух запросов.
+        first = relations.remove('favorite', self.user, [recipe.id])
+        second = relations.remove('favorite', self.user, [recipe.id])
+        self.assertEqual(first, {recipe.id: 'removed'})
+        self.assertEqual(second, {recipe.id: 'missing'})
+
+
+class SyncChangesTestCase(TestCase):
+    """Инкрементальная синхронизация каталога по токену."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='user@ya.ru', username='user')
+        cls.tag = Tag.objects.create(name='Тег', slug='tag')
+        cls.recipes = [
+            cls.create_recipe(f'Рецепт {number}') for number in range(3)
+        ]
+        # Обработчики фиксации в setUpTestData не выполняются.
+        sync.number_pending()
+
+    @classmethod
+    def create_recipe(cls, name):
+        return Recipes.objects.create(
+            author=cls.user, name=name, text='Текст', cooking_time=5,
+            image='media/recipe.png'
+        )
+
+    def setUp(self):
+        caches['throttle'].clear()
+
+    def changes(self, since=None, **params):
+        if since is not None:
+            params['since'] = since
+        response = Client().get('/api/recipes/changes/', params)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response.json()
+
+    def test_full_then_incremental_sync(self):
+        first = self.changes()
+        self.assertEqual(
+            [record['id'] for record in first['recipes']],
+            [recipe.id for recipe in self.recipes]
+        )
+        self.assertEqual(first['deleted'], [])
+        self.assertFalse(first['has_more'])
+        self.assertEqual(self.changes(first['next'])['recipes'], [])
+
+        updated, deleted, _ = self.recipes
+        updated.name = 'Новое название'
+        deleted_id = deleted.id
+        with self.captureOnCommitCallbacks(execute=True):
+            updated.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            deleted.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            created = self.create_recipe('Новый рецепт')
+        delta = self.changes(first['next'])
+        self.assertEqual(
+            [record['id'] for record in delta['recipes']],
+            [updated.id, created.id]
+        )
+        self.assertEqual(delta['recipes'][0]['name'], 'Новое название')
+        self.assertEqual(delta['deleted'], [deleted_id])
+        self.assertEqual(
+            self.changes(delta['next']),
+            {'recipes': [], 'deleted': [], 'next': delta['next'],
+             'has_more': False}
+        )
+
+    def test_chunks_follow_change_order(self):
+        token = self.changes()['next']
+        deleted_id = self.recipes[1].id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipes[0].save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipes[1].delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipes[2].save()
+        changes = []
+        while True:
+            page = self.changes(token, limit=1)
+            changes += [record['id'] for record in page['recipes']]
+            changes += [('deleted', item) for item in page['deleted']]
+            token = page['next']
+            if not page['has_more']:
+                break
+        self.assertEqual(
+            changes,
+            [self.recipes[0].id, ('deleted', deleted_id), self.recipes[2].id]
+        )
+
+    def test_up_to_date_client_costs_one_query(self):
+        token = self.changes()['next']
+        with self.assertNumQueries(1):
+            self.changes(token)
+
+    def test_invalid_token_and_limit(self):
+        for params in ({'since': 'мусор'}, {'since': 'djI6MQ'},
+                       {'limit': 'много'}):
+            response = Client().get('/api/recipes/changes/', params)
+            self.assertEqual(
+                response.status_code, HTTPStatus.BAD_REQUEST, params
+            )
+
+    def test_expired_token_requires_full_sync(self):
+        token = self.changes()['next']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipes[0].delete()
+        models.DeletedRecipe.objects.update(
+            deleted_at=timezone.now() - timedelta(days=31)
+        )
+        purge_deleted_recipes(days=30)
+        self.assertFalse(models.DeletedRecipe.objects.exists())
+        response = Client().get('/api/recipes/changes/', {'since': token})
+        self.assertEqual(response.status_code, HTTPStatus.GONE)
+        fresh = self.changes()
+        self.assertEqual(len(fresh['recipes']), 2)
+        self.assertEqual(self.changes(fresh['next'])['recipes'], [])
+
+    def test_imported_recipes_get_sequence_numbers(self):
+        token = self.changes()['next']
+        ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with override_settings(MEDIA_ROOT=directory.name), \
+                self.captureOnCommitCallbacks(execute=True):
+            report = RecipeImporter(self.user).run([
+                json.dumps({
+                    'name': name, 'text': 'Текст', 'cooking_time': 5,
+                    'image': IMAGE, 'tags': [self.tag.id],
+                    'ingredients': [{'id': ingredient.id, 'amount': 10}],
+                })
+                for name in ('Импорт 1', 'Импорт 2')
+            ])
+        self.assertEqual(report['created'], 2)
+        delta = self.changes(token)
+        self.assertEqual(
+            [record['name'] for record in delta['recipes']],
+            ['Импорт 1', 'Импорт 2']
+        )
+        self.assertEqual(delta['recipes'][0]['tags'], ['tag'])
+
+    def test_write_does_not_lock_counter(self):
+        recipe = self.recipes[0]
+        with CaptureQueriesContext(connection) as queries, \
+                self.captureOnCommitCallbacks() as callbacks:
+            recipe.save()
+            self.recipes[1].delete()
+            self.create_recipe('Новый рецепт')
+        # Транзакция изменения не обращается к строке счетчика.
+        self.assertFalse([
+            query for query in queries
+            if models.SyncCounter._meta.db_table in query['sql']
+        ])
+        self.assertIn(sync.number_pending, callbacks)
+        sync.number_pending()
+        self.assertEqual(
+            Recipes.objects.filter(sync_seq__isnull=True).count(), 0
+        )
+
+    def test_change_committed_after_sync_is_not_skipped(self):
+        token = self.changes()['next']
+        recipe = self.recipes[0]
+        with self.captureOnCommitCallbacks() as callbacks:
+            recipe.save()
+            # До фиксации изменение не видно, токен не сдвигается за него.
+            delta = self.changes(token)
+        self.assertEqual(delta['recipes'], [])
+        for callback in callbacks:
+            callback()
+        delta = self.changes(delta['next'])
+        self.assertEqual(
+            [record['id'] for record in delta['recipes']], [recipe.id]
+        )
+
+    def test_lost_numbering_is_picked_up_by_task(self):
+        token = self.changes()['next']
+        # Процесс упал между фиксацией и раздачей номеров.
+        with self.captureOnCommitCallbacks():
+            self.recipes[0].save()
+        number_pending_changes()
+        self.assertEqual(
+            [record['id'] for record in self.changes(token)['recipes']],
+            [self.recipes[0].id]
+        )
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Блокировки строк Postgres')
+class SyncConcurrencyTestCase(TransactionTestCase):
+    """Параллельные сохранения рецептов не ждут друг друга."""
+
+    def setUp(self):
+        self.user = User.objects.create(email='user@ya.ru', username='user')
+        self.recipes = [
+            Recipes.objects.create(
+                author=self.user, name=f'Рецепт {number}', text='Текст',
+                cooking_time=5, image='media/recipe.png'
+            )
+            for number in range(2)
+        ]
+
+    def test_open_transaction_does_not_block_other_writers(self):
+        saved = threading.Event()
+        release = threading.Event()
+
+        def slow_writer():
+            try:
+                with transaction.atomic():
+                    self.recipes[0].save()
+                    saved.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=slow_writer)
+        thread.start()
+        try:
+            self.assertTrue(saved.wait(10))
+            started = time.monotonic()
+            with transaction.atomic():
+                self.recipes[1].save()
+            self.assertLess(time.monotonic() - started, 5)
+            # Зафиксированное изменение уже пронумеровано, незавершенное
+            # ждет своей фиксации.
+            self.recipes[1].refresh_from_db()
+            self.assertIsNotNone(self.recipes[1].sync_seq)
+        finally:
+            release.set()
+            thread.join()
+        self.recipes[0].refresh_from_db()
+        # Номер идет в порядке фиксаций, а не начала транзакций.
+        self.assertGreater(
+            self.recipes[0].sync_seq, self.recipes[1].sync_seq
+        )
@@ -0,0 +1,86 @@
+"""
+Ограничение частоты дорогих запросов по алгоритму token bucket.
+
+Ведро на пару (действие, пользователь или IP) хранится в кэше
+THROTTLING['CACHE'], общем для всех воркеров gunicorn. Ведро
+вмещает N запросов и пополняется со скоростью N за период, так что
+короткий всплеск проходит, а длительная нагрузка режется до лимита.
+Проверка — одно чтение и одна запись в кэш под блокировкой ведра
+(api.locks.cache_lock): одновременные запросы разных воркеров не
+прочитают одно и то же ведро и не пройдут сверх лимита.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+from api.locks import LockTimeoutError, cache_lock
+from api.metrics import registry
+
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Ожидание блокировки ведра; запрос, не дождавшийся ее, отклоняется.
+LOCK_TIMEOUT = 1
+
+
+def parse_rate(rate):
+    """'10/min' -> (10, 60): емкость ведра и период в секундах."""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Лимит для действия view.action вьюсета с throttle_scope:
+    ключ настроек RATES — '<throttle_scope>.<action>'.
+    Авторизованных считает по пользователю, анонимов по IP.
+    """
+
+    def __init__(self):
+        """Ожидание до следующего жетона, если запрос отклонен."""
+        self.wait_seconds = None
+
+    def get_scope(self, view):
+        return '{}.{}'.format(
+            getattr(view, 'throttle_scope', ''), getattr(view, 'action', '')
+        )
+
+    def get_cache_key(self, request, scope):
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+        return f'throttle:{scope}:{ident}'
+
+    def allow_request(self, request, view):
+        config = getattr(settings, 'THROTTLING', {})
+        scope = self.get_scope(view)
+        rate = config.get('RATES', {}).get(scope)
+        if not config.get('ENABLED', False) or rate is None:
+            return True
+        capacity, period = parse_rate(rate)
+        refill = capacity / period
+        cache = caches[config.get('CACHE', 'default')]
+        key = self.get_cache_key(request, scope)
+        try:
+            with cache_lock(cache, key, LOCK_TIMEOUT):
+                now = time.time()
+                tokens, updated = cache.get(key, (capacity, now))
+                tokens = min(capacity, tokens + (now - updated) * refill)
+                if tokens >= 1:
+                    # Полное ведро восстанавливается за period, дольше
+                    # хранить незачем.
+                    cache.set(key, (tokens - 1, now), math.ceil(period))
+                    return True
+            self.wait_seconds = (1 - tokens) / refill
+        except LockTimeoutError:
+            # Без блокировки ведро не проверить: запрос отклоняется.
+            self.wait_seconds = LOCK_TIMEOUT
+        registry.inc('foodgram_throttled_total', (('scope', scope),))
+        return False
+
+    def wait(self):
+        return self.wait_seconds
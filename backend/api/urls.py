@@ -1,10 +1,14 @@
 from rest_framework.routers import DefaultRouter
-from django.urls import include, path
+from django.urls import include, path, re_path
+from . import async_views
+from .async_views import method_dispatch
 from .views import (
     CustomUserViewSet,
     RecipesViewSet,
     TagViewSet,
     IngredientViewSet,
+    MetricsView,
+    RecipeExportView,
 )
 
 router = DefaultRouter()
@@ -13,7 +17,80 @@ router.register(r'recipes', RecipesViewSet)
 router.register(r'tags', TagViewSet)
 router.register(r'ingredients', IngredientViewSet)
 
+# GET горячих эндпоинтов обслуживают асинхронные представления,
+# остальные методы тех же адресов — вьюсеты из router.
+async_urlpatterns = [
+    path(
+        'recipes/',
+        method_dispatch(
+            async_views.recipe_list,
+            RecipesViewSet.as_view({'post': 'create'})
+        ),
+        name='recipes-list'
+    ),
+    path(
+        'recipes/<int:pk>/',
+        method_dispatch(
+            async_views.recipe_detail,
+            RecipesViewSet.as_view({
+                'put': 'update',
+                'patch': 'partial_update',
+                'delete': 'destroy',
+            })
+        ),
+        name='recipes-detail'
+    ),
+    re_path(
+        r'^recipes/redirect/(?P<short_link>[a-zA-Z0-9_-]+)/$',
+        async_views.redirect_short_link,
+        name='recipes-redirect-short-link'
+    ),
+    path(
+        'tags/',
+        method_dispatch(
+            async_views.tag_list, TagViewSet.as_view({'post': 'create'})
+        ),
+        name='tag-list'
+    ),
+    path(
+        'tags/<int:pk>/',
+        method_dispatch(
+            async_views.tag_detail,
+            TagViewSet.as_view({
+                'put': 'update',
+                'patch': 'partial_update',
+                'delete': 'destroy',
+            })
+        ),
+        name='tag-detail'
+    ),
+    path(
+        'ingredients/',
+        method_dispatch(
+            async_views.ingredient_list,
+            IngredientViewSet.as_view({'post': 'create'})
+        ),
+        name='ingredient-list'
+    ),
+    path(
+        'ingredients/<int:pk>/',
+        method_dispatch(
+            async_views.ingredient_detail,
+            IngredientViewSet.as_view({
+                'put': 'update',
+                'patch': 'partial_update',
+                'delete': 'destroy',
+            })
+        ),
+        name='ingredient-detail'
+    ),
+]
+
 urlpatterns = [
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('recipes/export/', RecipeExportView.as_view(),
+         name='recipes-export'),
+    *async_urlpatterns,
     path('', include(router.urls)),
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
@@ -1,29 +1,46 @@
 import base64
 import hashlib
-from collections import defaultdict
-from django.db.models import Count, Sum
-from django_filters.rest_framework import DjangoFilterBackend
-from django.http import HttpResponseRedirect, HttpResponse
-from django.shortcuts import get_object_or_404, redirect
+import math
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError
+from django.db.models import Exists, OuterRef
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags
 from rest_framework import viewsets, status, permissions
-from rest_framework.decorators import action, api_view
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.permissions import SAFE_METHODS
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from recipes.models import (User, Ingredient, Tag,
-                            Recipes, IngredientAmount, ShoppingList,
-                            Follower, Favorite)
+                            Recipes, ShoppingList,
+                            Follower, FeedEntry)
 from api.serializers import (UserSerializer, RecipesInfoSerializer,
                              ShoppingListSerializer, FollowerSerializer,
                              PasswordSerializer, AvatarSerializer,
                              TagSerializer, IngredientSerializer,
-                             RecipesAddSerializer, IngredientRecipeSerializer,
-                             FavoriteSerializer, RecipesFoFollowerSerializer)
-from api.permissions import AuthorOrReadOnly, IsAdminOrReadOnly
-from .filters import RecipesFilter
-from .pagination import CustomPagination
+                             RecipesAddSerializer, RecipeDetailSerializer,
+                             FavoriteSerializer,
+                             BatchSerializer, recipe_info_related,
+                             with_recipe_info)
+from api.exporter import FORMATS as EXPORT_FORMATS
+from api.exporter import alines
+from api.importer import RecipeImporter
+from api import relations, sync
+from api.metrics import render_metrics
+from api.middleware import timed_serializer
+from api.shopping_list import FORMATS as SHOPPING_LIST_FORMATS
+from api.shopping_list import (cart_digest, cart_versions, get_document,
+                               get_version)
+from api.permissions import (AuthorOrReadOnly, IsAdminOrReadOnly,
+                             IsStaff, IsStaffOrLocalhost)
+from .filters import filter_ingredients, filter_recipes
+from .pagination import CustomPagination, FeedPagination
+from .parsers import NDJSONParser
+from .throttling import TokenBucketThrottle
 import logging
 
 
@@ -32,12 +49,62 @@ logger = logging.getLogger('recipes')
 short_links_storage = {}
 
 
-class CustomUserViewSet(viewsets.ModelViewSet):
+def batch_response(request, kind):
+    """
+    POST добавляет, DELETE убирает пачку {"ids": [...]} в связи kind
+    (api.relations); ответ — результат для каждого id.
+    """
+    serializer = BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    apply = relations.add if request.method == 'POST' else relations.remove
+    results = apply(kind, request.user, serializer.validated_data['ids'])
+    return Response(
+        {'results': [
+            {'id': target_id, 'status': result}
+            for target_id, result in results.items()
+        ]},
+        status=status.HTTP_200_OK
+    )
+
+
+class TimedSerializerMixin:
+    """
+    Сериализаторы get_serializer замеряются в сегменте serialize
+    заголовка Server-Timing (api.middleware.ServerTimingMiddleware).
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        return timed_serializer(
+            self.request, super().get_serializer(*args, **kwargs)
+        )
+
+
+def item_result(request, kind, pk):
+    """Результат api.relations для одного id из адреса."""
+    if not str(pk).isdigit():
+        raise NotFound()
+    apply = relations.add if request.method == 'POST' else relations.remove
+    return apply(kind, request.user, [int(pk)])[int(pk)]
+
+
+class CustomUserViewSet(TimedSerializerMixin, viewsets.ModelViewSet):
     """Вьюсет для модели User."""
 
     queryset = User.objects.all()
     serializer_class = UserSerializer
     pagination_class = CustomPagination
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'users'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset
+        # is_subscribed для каждой строки без отдельного запроса.
+        return queryset.annotate(subscribed=Exists(
+            Follower.objects.filter(user=user, author=OuterRef('pk'))
+        ))
 
     def get_permissions(self):
         if self.action in ['create', 'retrieve']:
@@ -50,13 +117,15 @@ class CustomUserViewSet(viewsets.ModelViewSet):
         try:
             serializer.save()
         except IntegrityError as e:
-            logger.error(f"Ошибка при создании пользователя: {e}")
+            logger.error('Ошибка при создании пользователя: %s', e)
             return Response(
                 {'ERROR': 'Ошибка целостности данных. Проверьте уникальность.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         except Exception as e:
-            logger.error(f"Непредвиденная ошибка при создании пользователя: {e}")
+            logger.error(
+                'Непредвиденная ошибка при создании пользователя: %s', e
+            )
             return Response(
                 {'ERROR': 'Произошла ошибка. Попробуйте еще раз.'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -76,22 +145,23 @@ class CustomUserViewSet(viewsets.ModelViewSet):
             .select_related('author')
             .order_by('id')
         )
-        print(f"Общее количество подписок: {subscribed_users.count()}")
         page = self.paginate_queryset(subscribed_users)
         if page is not None:
-            print(f"Количество подписок на текущей странице: {len(page)}")
-            serializer = FollowerSerializer(
+            logger.debug(
+                'Количество подписок на текущей странице: %s', len(page)
+            )
+            serializer = timed_serializer(request, FollowerSerializer(
                 page,
                 many=True,
                 context={'request': request}
-            )
+            ))
             return self.get_paginated_response(serializer.data)
 
-        serializer = FollowerSerializer(
+        serializer = timed_serializer(request, FollowerSerializer(
             subscribed_users,
             many=True,
             context={'request': request}
-        )
+        ))
         return Response({"results": serializer.data})
 
     @action(
@@ -101,43 +171,43 @@ class CustomUserViewSet(viewsets.ModelViewSet):
         url_path='subscribe'
     )
     def subscribe(self, request, pk=None):
-        author = get_object_or_404(User, pk=pk)
-        user = request.user
-        if user == author:
+        if str(pk) == str(request.user.pk):
             return Response(
                 {'status': 'Нельзя подписаться на самого себя!'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-
-        if request.method == 'POST':
-            follower, created = Follower.objects.get_or_create(
-                user=user,
-                author=author
+        # Существование автора проверяет сама вставка или удаление.
+        result = item_result(request, 'subscribe', pk)
+        if result == relations.NOT_FOUND:
+            raise NotFound()
+        if result == relations.ADDED:
+            return Response(
+                UserSerializer(
+                    User.objects.get(pk=pk), context={'request': request}
+                ).data,
+                status=status.HTTP_204_NO_CONTENT
             )
-            if created:
-                return Response(
-                    UserSerializer(author).data,
-                    status=status.HTTP_204_NO_CONTENT
-                )
+        if result == relations.EXISTS:
             return Response(
                 {'status': 'Уже подписан!'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        if result == relations.REMOVED:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(
+            {'status': 'не подписан'},
+            status=status.HTTP_404_NOT_FOUND
+        )
 
-        elif request.method == 'DELETE':
-            # Обработка отписки
-            subscription = Follower.objects.filter(
-                user=user,
-                author=author
-            ).first()
-            if subscription:
-                subscription.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            return Response(
-                {'status': 'не подписан'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-        return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        permission_classes=[IsAuthenticated],
+        url_path='subscribe'
+    )
+    def subscribe_batch(self, request):
+        """Подписка на авторов или отписка пачкой {"ids": [...]}."""
+        return batch_response(request, 'subscribe')
 
     @action(
         methods=['GET', 'PATCH'],
@@ -182,7 +252,7 @@ class CustomUserViewSet(viewsets.ModelViewSet):
             )
         elif request.method == 'DELETE':
             if user.avatar:
-                user.avatar.delete(save=False)
+                # Файл удалится, если на него больше никто не ссылается.
                 user.avatar = None
                 user.save()
                 return Response(
@@ -215,7 +285,7 @@ class CustomUserViewSet(viewsets.ModelViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(TimedSerializerMixin, viewsets.ModelViewSet):
     """Вьюсет для модели тегов."""
 
     queryset = Tag.objects.all()
@@ -223,13 +293,18 @@ class TagViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAdminOrReadOnly]
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(TimedSerializerMixin, viewsets.ModelViewSet):
     """Вьюсет для модели ингредиентов."""
 
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [IsAdminOrReadOnly]
 
+    def get_queryset(self):
+        return filter_ingredients(
+            super().get_queryset(), self.request.query_params
+        )
+
 
 class FavoritesView(APIView):
     def get(self, request):
@@ -238,31 +313,38 @@ class FavoritesView(APIView):
             return Response({"detail": "Unauthorized"}, status=401)
 
         favorites = user.favorites.all()
-        serializer = FavoriteSerializer(favorites, many=True)
+        serializer = timed_serializer(
+            request, FavoriteSerializer(favorites, many=True)
+        )
         return Response(serializer.data)
 
 
-class RecipesViewSet(viewsets.ModelViewSet):
+class MetricsView(APIView):
+    """Метрики всех воркеров в формате Prometheus."""
+
+    permission_classes = [IsStaffOrLocalhost]
+
+    def get(self, request):
+        return HttpResponse(
+            render_metrics(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
+
+
+class RecipesViewSet(TimedSerializerMixin, viewsets.ModelViewSet):
     """Вьюсет для модели рецептов."""
 
     queryset = Recipes.objects.all()
     permission_classes = [AuthorOrReadOnly]
     pagination_class = CustomPagination
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = RecipesFilter
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'recipes'
 
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipesInfoSerializer
         return RecipesAddSerializer
 
-    def get_ingredients(self, recipe_instance):
-        ingredient_amounts = IngredientAmount.objects.filter(
-            recipe=recipe_instance
-        ).select_related('ingredient')
-        print(ingredient_amounts)
-        return IngredientRecipeSerializer(ingredient_amounts, many=True).data
-
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
         page = self.paginate_queryset(queryset)
@@ -274,38 +356,23 @@ class RecipesViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
     def get_queryset(self):
-        print(f"Request GET parameters: {self.request.GET}")
+        logger.debug('Параметры запроса рецептов: %s', self.request.GET)
         queryset = super().get_queryset()
-        request = self.request
-        author_id = request.query_params.get('author')
-        if author_id:
-            queryset = queryset.filter(author_id=author_id)
-        if request.user.is_authenticated:
-            if request.query_params.get('is_favorited'):
-                # Фильтрация по избранным рецептам
-                queryset = queryset.filter(
-                    favorites__author=request.user
-                ).distinct()
-        tag_slugs = request.query_params.getlist('tags')
-        if tag_slugs:
-            queryset = (
-                queryset
-                .filter(tags__slug__in=tag_slugs)
-                .annotate(num_tags=Count('tags'))
-                .filter(num_tags=len(tag_slugs))
-                .distinct()
-            )
-        return queryset
+        if self.request.method in SAFE_METHODS:
+            queryset = with_recipe_info(queryset)
+        return filter_recipes(
+            queryset,
+            self.request.query_params,
+            self.request.user
+        )
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        serializer = self.get_serializer(
+        serializer = timed_serializer(request, RecipeDetailSerializer(
             instance,
             context={'request': request}
-        )
-        data = serializer.data
-        data['ingredients'] = self.get_ingredients(instance)
-        return Response(data)
+        ))
+        return Response(serializer.data)
 
     @action(
         detail=True,
@@ -314,44 +381,38 @@ class RecipesViewSet(viewsets.ModelViewSet):
     )
     def favorite(self, request, pk):
         """Добавить или удалить рецепт из избранного."""
-        recipe = get_object_or_404(Recipes, pk=pk)
-        if request.method == 'POST':
-            favorite, created = Favorite.objects.get_or_create(
-                author=request.user,
-                recipe=recipe
+        result = item_result(request, 'favorite', pk)
+        if result == relations.NOT_FOUND:
+            raise NotFound()
+        if result == relations.ADDED:
+            return Response(
+                {'message': 'Рецепт добавлен в избранное.'},
+                status=status.HTTP_201_CREATED
             )
-            if created:
-                return Response(
-                    {'message': 'Рецепт добавлен в избранное.'},
-                    status=status.HTTP_201_CREATED
-                )
-            else:
-                return Response(
-                    {'message': 'Рецепт уже в избранном.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        elif request.method == 'DELETE':
-            try:
-                favorite = Favorite.objects.get(
-                    author=request.user,
-                    recipe=recipe
-                )
-                favorite.delete()
-                return Response(
-                    {'message': 'Рецепт удален из избранного.'},
-                    status=status.HTTP_204_NO_CONTENT
-                )
-            except Favorite.DoesNotExist:
-                return Response(
-                    {'message': 'Рецепт не найден в избранном.'},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-            except Exception as e:
-                logger.error(f"Ошибка при обработке избранного: {e}")
-                return Response(
-                    {'ERROR': 'Произошла ошибка. Попробуйте еще раз.'},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
+        if result == relations.EXISTS:
+            return Response(
+                {'message': 'Рецепт уже в избранном.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if result == relations.REMOVED:
+            return Response(
+                {'message': 'Рецепт удален из избранного.'},
+                status=status.HTTP_204_NO_CONTENT
+            )
+        return Response(
+            {'message': 'Рецепт не найден в избранном.'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        permission_classes=[IsAuthenticated],
+        url_path='favorite'
+    )
+    def favorite_batch(self, request):
+        """Избранное пачкой {"ids": [...]}: POST добавляет, DELETE убирает."""
+        return batch_response(request, 'favorite')
 
     def create(self, request, *args, **kwargs):
         serializer = RecipesAddSerializer(
@@ -359,7 +420,7 @@ class RecipesViewSet(viewsets.ModelViewSet):
             context={'request': request}
         )
         if not serializer.is_valid():
-            print("Ошибки валидации:", serializer.errors)
+            logger.info('Ошибки валидации рецепта: %s', serializer.errors)
             return Response(
                 serializer.errors,
                 status=status.HTTP_400_BAD_REQUEST
@@ -376,7 +437,9 @@ class RecipesViewSet(viewsets.ModelViewSet):
     def update(self, request, pk=None, partial=False):
         """Редактирование рецепта."""
 
-        recipe = get_object_or_404(Recipes, pk=pk)
+        recipe = get_object_or_404(
+            Recipes.objects.select_related('author'), pk=pk
+        )
         if recipe.author != request.user:
             return Response(
                 {'detail': 'У вас нет прав для редактирования этого рецепта.'},
@@ -394,6 +457,88 @@ class RecipesViewSet(viewsets.ModelViewSet):
             status=status.HTTP_200_OK
         )
 
+    @action(
+        detail=False,
+        methods=['GET'],
+        permission_classes=[IsAuthenticated]
+    )
+    def feed(self, request):
+        """Рецепты авторов из подписок, новые первыми."""
+        paginator = FeedPagination()
+        entries = paginator.paginate_queryset(
+            FeedEntry.objects.filter(user=request.user).select_related(
+                'recipe__author'
+            ).prefetch_related(*recipe_info_related('recipe__')),
+            request, view=self
+        )
+        serializer = timed_serializer(request, RecipesInfoSerializer(
+            [entry.recipe for entry in entries], many=True,
+            context={'request': request}
+        ))
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['GET'],
+        permission_classes=[AllowAny]
+    )
+    def changes(self, request):
+        """
+        Изменения каталога после токена ?since= (без токена — с начала):
+        новые и измененные рецепты, id удаленных и токен next для
+        следующего запроса. ?limit= — размер пачки.
+        """
+        config = sync.get_config()
+        try:
+            since = sync.decode_token(request.query_params.get('since'))
+            limit = int(request.query_params.get(
+                'limit', config.get('PAGE_SIZE', 100)
+            ))
+        except ValueError:
+            return Response(
+                {'since': 'Неверный токен или размер пачки.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = min(max(limit, 1), config.get('MAX_PAGE_SIZE', 500))
+        try:
+            data = sync.changes_response(since, limit, request)
+        except sync.TokenExpiredError:
+            return Response(
+                {'since': 'Токен устарел, нужна полная синхронизация.'},
+                status=status.HTTP_410_GONE
+            )
+        return Response(data, status=status.HTTP_200_OK)
+
+    @action(
+        detail=False,
+        methods=['POST'],
+        url_path='import',
+        permission_classes=[IsAuthenticated],
+        parser_classes=[NDJSONParser]
+    )
+    def import_recipes(self, request):
+        """
+        Пакетный импорт рецептов текущего пользователя из NDJSON:
+        по рецепту в строке, тело читается потоком. Каждая пачка
+        списывает жетон 'recipes.import_recipes'; без жетона импорт
+        останавливается с 429, в отчете stopped_at — строка, с которой
+        продолжить.
+        """
+        throttle = TokenBucketThrottle()
+        report = RecipeImporter(
+            request.user, charge=lambda: throttle.allow_request(request, self)
+        ).run(request.data)
+        logger.info(
+            'Импорт рецептов: создано %s, ошибок %s',
+            report['created'], len(report['errors'])
+        )
+        if 'stopped_at' in report:
+            return Response(
+                report, status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(math.ceil(throttle.wait()))}
+            )
+        return Response(report, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['GET'], url_path='get-link')
     def short_link(self, request, pk=None):
         recipes = get_object_or_404(Recipes, pk=pk)
@@ -412,30 +557,6 @@ class RecipesViewSet(viewsets.ModelViewSet):
         short_link = short_link.rstrip('=')[:4]
         return short_link
 
-    @action(
-        detail=False,
-        methods=['GET'],
-        url_path='redirect/(?P<short_link>[a-zA-Z0-9_-]+)'
-    )
-    def redirect_short_link(self, request, short_link):
-        try:
-            original_id = self.decode_short_link(short_link)
-            # Построение полного URL на основе текущего запроса
-            return HttpResponseRedirect(
-                request.build_absolute_uri(f'/recipes/{original_id}/')
-            )
-        except Exception:
-            return Response(
-                {"ERROR": "Неверный формат короткой ссылки."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-    def decode_short_link(self, short_link):
-        if short_link in short_links_storage:
-            return short_links_storage[short_link]
-        else:
-            raise ValueError("Короткая ссылка не найдена")
-
     @action(
         detail=True,
         methods=['POST', 'DELETE'],
@@ -445,41 +566,50 @@ class RecipesViewSet(viewsets.ModelViewSet):
         if request.method == 'POST':
             return self.add_to_shopping_cart(request.user, pk)
         else:
-            return self.delete_shopping_cart(request.user, pk)
+            return self.delete_shopping_cart(
+                item_result(request, 'shopping_cart', pk)
+            )
 
-    def add_to_shopping_cart(self, user, id):
-        # Проверка, существует ли рецепт
-        try:
-            recipe = Recipes.objects.get(id=id)
-        except Recipes.DoesNotExist:
+    def add_to_shopping_cart(self, user, pk):
+        if not str(pk).isdigit():
+            raise NotFound()
+        results, rows = relations.add_rows('shopping_cart', user, [int(pk)])
+        result = results[int(pk)]
+        if result == relations.NOT_FOUND:
             return Response(
                 {'detail': 'Рецепт не найден.'},
                 status=status.HTTP_404_NOT_FOUND
             )
-        # Проверка, существует ли уже запись в списке покупок
-        if ShoppingList.objects.filter(author=user, recipe=recipe).exists():
+        if result == relations.EXISTS:
             return Response(
                 {'detail': 'Рецепт уже добавлен в список покупок.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        # Создание нового объекта ShoppingList
-        shopping_list_item = ShoppingList(author=user, recipe=recipe)
-        shopping_list_item.save()
-        # Сериализация созданного объекта для ответа
-        serializer = ShoppingListSerializer(shopping_list_item)
-        # recipe_serializer = RecipesFoFollowerSerializer(recipe)
+        # Ответ собирается из RETURNING вставки: строку, которую уже
+        # мог удалить параллельный DELETE, перечитывать не нужно.
+        serializer = ShoppingListSerializer(
+            ShoppingList(id=rows[int(pk)], author=user, recipe_id=int(pk))
+        )
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    def delete_shopping_cart(self, user, id):
-        delete_cart = ShoppingList.objects.filter(author=user, recipe__id=id)
-        if delete_cart.exists():
-            delete_cart.delete()
+    def delete_shopping_cart(self, result):
+        if result == relations.REMOVED:
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
             {'ERROR': 'Рецепт уже удален или не найден!'},
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        permission_classes=[IsAuthenticated],
+        url_path='shopping_cart'
+    )
+    def shopping_cart_batch(self, request):
+        """Корзина пачкой {"ids": [...]}: POST добавляет, DELETE убирает."""
+        return batch_response(request, 'shopping_cart')
+
     @action(
         detail=True,
         permission_classes=[IsAuthenticated]
@@ -490,40 +620,74 @@ class RecipesViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, permission_classes=[IsAuthenticated])
     def download_shopping_cart(self, request):
-        shopping_cart_recipes = request.user.shopping_cart.values_list(
-            'recipe_id',
-            flat=True
-        )
-        print('shopping_cart:', shopping_cart_recipes)
-        ingredients = (
-            IngredientAmount.objects
-            .filter(recipe_id__in=shopping_cart_recipes)
-            .select_related('ingredient')
-            .values('ingredient__name', 'ingredient__measurement_unit')
-            .annotate(total_amount=Sum('amount'))
-        )
-        print('ingredients:', ingredients)
-
-        if not ingredients.exists():
+        """
+        Список покупок: ?file_format=txt (по умолчанию), csv или pdf.
+        Документ кэшируется по хешу корзины, хеш отдается как ETag.
+        """
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            return Response(
+                {'file_format': 'Доступны: {}.'.format(
+                    ', '.join(SHOPPING_LIST_FORMATS)
+                )},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        versions = cart_versions(request.user)
+        digest = cart_digest(versions, get_version()) if versions else None
+        headers = {'Cache-Control': 'private, no-cache'}
+        if digest is not None:
+            headers['ETag'] = f'"{digest[:32]}-{file_format}"'
+            if headers['ETag'] in parse_etags(
+                request.headers.get('If-None-Match', '')
+            ):
+                return HttpResponse(status=status.HTTP_304_NOT_MODIFIED,
+                                    headers=headers)
+        content = None
+        if versions:
+            digest, content = get_document(
+                request.user, digest, file_format
+            )
+        if content is None:
             return Response(
                 {'MESSAGE': 'Ингредиенты не найдены, но запрос выполнен успешно.'},
                 status=status.HTTP_200_OK
             )
-        ingredient_summary = defaultdict(int)
-
-        for ingredient in ingredients:
-            name = ingredient['ingredient__name']
-            total_amount = ingredient['total_amount']
-            unit = ingredient['ingredient__measurement_unit']
-            ingredient_summary[(name, unit)] += total_amount
-        text = 'Список покупок:\n\n'
-
-        for number, ((name, unit), total_amount) in enumerate(
-            ingredient_summary.items(), start=1
-        ):
-            text += f"{number}) {name} - {total_amount} {unit}\n"
-
-        response = HttpResponse(text, content_type='text/plain')
-        filename = 'shopping_list.txt'
+        # ETag — хеш состава, из которого документ построен: корзина
+        # могла измениться после проверки.
+        headers.pop('ETag', None)
+        if digest is not None:
+            headers['ETag'] = f'"{digest[:32]}-{file_format}"'
+        response = HttpResponse(
+            content,
+            content_type=SHOPPING_LIST_FORMATS[file_format][0],
+            headers=headers
+        )
+        filename = f'shopping_list.{file_format}'
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
+
+
+class RecipeExportView(APIView):
+    """
+    Потоковая выгрузка всех рецептов для персонала:
+    ?file_format=ndjson (по умолчанию) или csv.
+    """
+
+    permission_classes = [IsStaff]
+
+    def get(self, request):
+        file_format = request.query_params.get('file_format', 'ndjson')
+        if file_format not in EXPORT_FORMATS:
+            return Response(
+                {'file_format': f'Доступны: {", ".join(EXPORT_FORMATS)}.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        content_type, lines = EXPORT_FORMATS[file_format]
+        content = lines()
+        if isinstance(request._request, ASGIRequest):
+            content = alines(content)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename=recipes.{file_format}'
+        )
+        return response
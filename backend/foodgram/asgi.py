@@ -0,0 +1,19 @@
+"""
+ASGI config for foodgram project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+# Статику отдает nginx; синхронный WhiteNoiseMiddleware в цепочке
+# ASGI переводил бы каждый запрос в поток.
+os.environ.setdefault('SERVE_STATIC', 'False')
+
+application = get_asgi_application()
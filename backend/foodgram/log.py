@@ -0,0 +1,81 @@
+"""
+Неблокирующее логирование.
+
+После обычной настройки через dictConfig обработчики логгеров из
+LOGGING_QUEUED_LOGGERS заменяются одним QueueHandler, а исходные
+обработчики (консоль, ротация файлов) работают в фоновом потоке
+QueueListener. Поток запроса только кладет запись в очередь.
+"""
+import atexit
+import json
+import logging
+import logging.config
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+
+
+STANDARD_ATTRS = frozenset(vars(logging.LogRecord(
+    '', logging.INFO, '', 0, '', (), None
+))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON, включая поля из extra."""
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler для очереди внутри процесса.
+    В отличие от стандартного не форматирует сообщение в потоке
+    запроса: запись уходит в очередь как есть, а строка собирается
+    уже в потоке слушателя.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+listeners = []
+
+
+def stop_listeners():
+    """Дописывает оставшиеся в очередях записи и гасит потоки."""
+    while listeners:
+        listeners.pop().stop()
+
+
+atexit.register(stop_listeners)
+
+
+def configure_logging(config):
+    """Настраивает логирование и переводит логгеры на очередь."""
+    stop_listeners()
+    logging.config.dictConfig(config)
+    for name in getattr(settings, 'LOGGING_QUEUED_LOGGERS', ()):
+        logger = logging.getLogger(name)
+        if not logger.handlers:
+            continue
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(
+            log_queue, *logger.handlers, respect_handler_level=True
+        )
+        logger.handlers = [LazyQueueHandler(log_queue)]
+        listener.start()
+        listeners.append(listener)
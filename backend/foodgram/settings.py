@@ -1,5 +1,6 @@
 from pathlib import Path
 import os
+import tempfile
 import logging
 from logging.handlers import RotatingFileHandler
 
@@ -11,6 +12,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = ''
 
 # SECURITY WARNING: don't run with debug turned on in production!
+# С DEBUG статика отдается без хешей в именах (api.staticfiles).
 DEBUG = True
 
 ALLOWED_HOSTS = [host.strip() for host in os.getenv('ALLOWED_HOSTS', '127.0.0.1,localhost').split(',')]
@@ -33,8 +35,16 @@ INSTALLED_APPS = [
     'api',
 ]
 
+# WhiteNoise синхронный: под ASGI (foodgram.asgi задает SERVE_STATIC=False)
+# он занимал бы поток на каждый запрос, а /static/ там отдает nginx.
+SERVE_STATIC = os.getenv('SERVE_STATIC', 'True') == 'True'
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    *(['whitenoise.middleware.WhiteNoiseMiddleware'] if SERVE_STATIC else []),
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.SlowQueryMiddleware',
+    'api.middleware.ServerTimingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -42,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -63,6 +74,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
+ASGI_APPLICATION = 'foodgram.asgi.application'
 
 CORS_URLS_REGEX = r'^/api/.*$'
 CORS_ALLOWED_ORIGINS = [
@@ -117,19 +129,210 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Медиафайлы называются хешем содержимого и не дублируются (api.storage),
+# статика — с хешами в именах и сжатыми копиями (api.staticfiles).
+STORAGES = {
+    'default': {
+        'BACKEND': 'api.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'api.staticfiles.StaticFilesStorage',
+    },
+}
+
+# Качество Brotli для сжатых копий статики при collectstatic.
+STATIC_COMPRESSION = {
+    'BROTLI_QUALITY': int(os.getenv('STATIC_BROTLI_QUALITY', '9')),
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
 }
 
+# Замеры запросов: заголовок Server-Timing и строка в логгере 'recipes'.
+# Доля замеряемых запросов задается общая и по имени эндпоинта,
+# например {'recipes-list': 0.1}.
+REQUEST_TIMING = {
+    'ENABLED': os.getenv('REQUEST_TIMING_ENABLED', 'False') == 'True',
+    'SAMPLE_RATE': float(os.getenv('REQUEST_TIMING_SAMPLE_RATE', '1.0')),
+    'ENDPOINT_SAMPLE_RATES': {},
+}
+
+# Метрики Prometheus: каждый воркер сбрасывает свои значения в файл
+# в общем каталоге, эндпоинт /api/metrics/ складывает их.
+METRICS = {
+    'ENABLED': os.getenv('METRICS_ENABLED', 'True') == 'True',
+    'DIRECTORY': os.getenv(
+        'METRICS_DIR',
+        os.path.join(tempfile.gettempdir(), 'foodgram_metrics')
+    ),
+    'FLUSH_INTERVAL': float(os.getenv('METRICS_FLUSH_INTERVAL', '1.0')),
+}
+
+# Журнал медленных SQL-запросов с планом выполнения,
+# пишется в slow_queries.log рядом с django_error.log.
+SLOW_QUERY_LOG = {
+    'ENABLED': os.getenv('SLOW_QUERY_LOG_ENABLED', 'True') == 'True',
+    'THRESHOLD_MS': float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '200')),
+    'EXPLAIN': True,
+}
+
+# Профилирование запросов: ?_profile=1 для администраторов и
+# выборочное профилирование эндпоинтов, например {'recipes-list': 0.01}.
+PROFILING = {
+    'ENABLED': os.getenv('PROFILING_ENABLED', 'True') == 'True',
+    'DIRECTORY': os.getenv(
+        'PROFILING_DIR', os.path.join(BASE_DIR, 'profiles')
+    ),
+    'SAMPLE_RATES': {},
+    'LIMIT': 40,
+}
+
+# Кэш пользователя по токену для CachedTokenAuthentication:
+# TTL в общем для воркеров кэше CACHE и LOCAL_TTL в памяти процесса,
+# секунды.
+TOKEN_CACHE = {
+    'ENABLED': os.getenv('TOKEN_CACHE_ENABLED', 'True') == 'True',
+    'CACHE': 'tokens',
+    'TTL': int(os.getenv('TOKEN_CACHE_TTL', '300')),
+    'LOCAL_TTL': int(os.getenv('TOKEN_CACHE_LOCAL_TTL', '5')),
+    'LOCAL_MAX_SIZE': int(os.getenv('TOKEN_CACHE_LOCAL_MAX_SIZE', '1000')),
+}
+
+# Лента подписок: размер пачки при раскладке рецепта подписчикам
+# и сколько последних рецептов автора добавлять при подписке.
+FEED = {
+    'BATCH_SIZE': int(os.getenv('FEED_BATCH_SIZE', '1000')),
+    'BACKFILL': int(os.getenv('FEED_BACKFILL', '100')),
+}
+
+# Кэши 'throttle', 'documents', 'interactions' и 'tokens' общие для всех
+# воркеров: по умолчанию
+# файловые, в продакшене задается, например, Redis через переменные
+# окружения.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'throttle': {
+        'BACKEND': os.getenv(
+            'THROTTLE_CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'THROTTLE_CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'foodgram_throttle')
+        ),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    'documents': {
+        'BACKEND': os.getenv(
+            'DOCUMENTS_CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'DOCUMENTS_CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'foodgram_documents')
+        ),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'interactions': {
+        'BACKEND': os.getenv(
+            'INTERACTIONS_CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'INTERACTIONS_CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'foodgram_interactions')
+        ),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    'tokens': {
+        'BACKEND': os.getenv(
+            'TOKEN_CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'TOKEN_CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'foodgram_tokens')
+        ),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+# Документы списка покупок в кэше 'documents' по хешу корзины.
+# PDF_FONT — TrueType-шрифт с кириллицей для PDF.
+SHOPPING_LIST = {
+    'CACHE': 'documents',
+    'TIMEOUT': int(os.getenv('SHOPPING_LIST_CACHE_TIMEOUT', '86400')),
+    'LOCK_TIMEOUT': 10,
+    'PDF_FONT': os.getenv(
+        'SHOPPING_LIST_PDF_FONT',
+        '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+    ),
+}
+
+# Множества избранного, корзины и подписок пользователя (api.interactions)
+# в кэше 'interactions'; изменения сбрасывают их сразу.
+INTERACTIONS = {
+    'CACHE': 'interactions',
+    'TIMEOUT': int(os.getenv('INTERACTIONS_CACHE_TIMEOUT', '3600')),
+}
+
+# Token bucket для дорогих действий: '<throttle_scope>.<action>' ->
+# 'N/период' (s, min, hour, day). Ведро на пользователя или IP.
+THROTTLING = {
+    'ENABLED': os.getenv('THROTTLING_ENABLED', 'True') == 'True',
+    'CACHE': 'throttle',
+    'RATES': {
+        'recipes.download_shopping_cart': '10/min',
+        'recipes.short_link': '30/min',
+        'recipes.create': '20/min',
+        # Импорт: жетон на пачку из api.importer.BATCH_SIZE рецептов.
+        'recipes.import_recipes': '30/min',
+        'users.create': '5/hour',
+    },
+}
+
+# Очередь фоновых задач api.jobs: воркеры команды run_workers,
+# повторы с задержкой BACKOFF_BASE * 2^(попытка - 1) и расписание
+# {'имя': {'TASK': 'модуль.функция', 'INTERVAL': секунды}}.
+JOBS = {
+    'PROCESSES': int(os.getenv('JOBS_PROCESSES', '1')),
+    'THREADS': int(os.getenv('JOBS_THREADS', '4')),
+    'POLL_INTERVAL': float(os.getenv('JOBS_POLL_INTERVAL', '1.0')),
+    'MAX_ATTEMPTS': 3,
+    'BACKOFF_BASE': 5,
+    'BACKOFF_MAX': 3600,
+    'VISIBILITY_TIMEOUT': 300,
+    'SCHEDULE': {
+        'purge-jobs': {'TASK': 'api.tasks.purge_jobs', 'INTERVAL': 86400},
+        'purge-deleted-recipes': {
+            'TASK': 'api.tasks.purge_deleted_recipes', 'INTERVAL': 86400
+        },
+        'number-pending-changes': {
+            'TASK': 'api.tasks.number_pending_changes', 'INTERVAL': 60
+        },
+    },
+}
+
+# Синхронизация каталога GET /api/recipes/changes/ (api.sync): размер
+# пачки и срок хранения журнала удалений в днях.
+SYNC = {
+    'PAGE_SIZE': 100,
+    'MAX_PAGE_SIZE': 500,
+    'TOMBSTONE_DAYS': int(os.getenv('SYNC_TOMBSTONE_DAYS', '30')),
+}
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -138,6 +341,10 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'recipes.User'
 
 
+# Обработчики этих логгеров работают в фоновом потоке через очередь.
+LOGGING_CONFIG = 'foodgram.log.configure_logging'
+LOGGING_QUEUED_LOGGERS = ('recipes', 'recipes.sql')
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -148,11 +355,14 @@ LOGGING = {
         'verbose': {
             'format': '%(levelname)s %(asctime)s %(module)s %(message)s',
         },
+        'json': {
+            '()': 'foodgram.log.JsonFormatter',
+        },
     },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
-            'formatter': 'simple',
+            'formatter': 'json',
         },
         'file': {
             'level': 'ERROR',
@@ -160,7 +370,15 @@ LOGGING = {
             'filename': os.path.join(BASE_DIR, 'django_error.log'),
             'maxBytes': 1024 * 1024 * 5,
             'backupCount': 3,
-            'formatter': 'verbose',
+            'formatter': 'json',
+        },
+        'slow_queries_file': {
+            'level': 'WARNING',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': os.path.join(BASE_DIR, 'slow_queries.log'),
+            'maxBytes': 1024 * 1024 * 5,
+            'backupCount': 3,
+            'formatter': 'json',
         },
     },
     'loggers': {
@@ -169,5 +387,10 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': False,
         },
+        'recipes.sql': {
+            'handlers': ['slow_queries_file'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     },
 }
@@ -0,0 +1,27 @@
+"""
+Настройки gunicorn (файл читается из рабочего каталога сам).
+
+Хуки переносят метрики завершившихся воркеров в архив api.metrics,
+чтобы счетчики не убывали при перезапуске воркеров и повторе PID.
+"""
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+
+
+def on_starting(server):
+    """Метрики воркеров прошлого запуска — в архив."""
+    from api.metrics import archive
+    archive()
+
+
+def worker_exit(server, worker):
+    """Воркер сбрасывает последний интервал метрик."""
+    from api.metrics import registry
+    registry.flush()
+
+
+def child_exit(server, worker):
+    """Мастер переносит файл метрик завершившегося воркера в архив."""
+    from api.metrics import archive
+    archive(worker.pid)
@@ -1,4 +1,8 @@
 from django.contrib import admin
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from api.sync import mark_pending
 from recipes.models import (
     Ingredient,
     Tag,
@@ -15,7 +19,8 @@ class UserAdmin(admin.ModelAdmin):
     """Админка для пользователей"""
 
     list_display = ('first_name', 'last_name', 'email', 'username', 'role')
-    search_fields = ('first_name', 'email',)
+    search_fields = ('first_name', 'email', 'username',)
+    list_filter = ('role',)
     empty_value_display = '-пусто-'
 
 
@@ -24,7 +29,8 @@ class IngredientAdmin(admin.ModelAdmin):
 
     list_display = ('name', 'measurement_unit')
     search_fields = ('name',)
-    list_filter = ('name',)
+    # Единиц измерения немного, в отличие от названий.
+    list_filter = ('measurement_unit',)
     empty_value_display = '-пусто-'
 
 
@@ -41,31 +47,87 @@ class IngredientAmountAdmin(admin.ModelAdmin):
     """Админка для ингредиентов рецептов."""
 
     list_display = ('ingredient', 'recipe', 'amount',)
-    search_fields = ('name',)
-    list_filter = ('ingredient', 'recipe',)
+    list_select_related = ('ingredient', 'recipe',)
+    search_fields = ('ingredient__name', 'recipe__name',)
+    autocomplete_fields = ('ingredient', 'recipe',)
+    # Таблица большая: без COUNT(*) по всей таблице при поиске.
+    show_full_result_count = False
     empty_value_display = '-пусто-'
 
+    # Строки меняются без сохранения рецепта: рецепт ждет нового
+    # номера изменения (api.sync).
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Строка, перенесенная в другой рецепт, меняет оба.
+        mark_pending([obj.recipe_id, form.initial.get('recipe')])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        mark_pending([obj.recipe_id])
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = list(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        mark_pending(recipe_ids)
+
+
+class IngredientAmountInline(admin.TabularInline):
+    """Состав рецепта на странице рецепта."""
+
+    model = IngredientAmount
+    autocomplete_fields = ('ingredient',)
+    min_num = 1
+    extra = 0
+
+    def get_queryset(self, request):
+        # __str__ строки читает ингредиент и рецепт: без запросов
+        # на каждую строку состава.
+        return super().get_queryset(request).select_related(
+            'ingredient', 'recipe'
+        )
+
 
 class RecipesAdmin(admin.ModelAdmin):
     """Админка для рецептов."""
 
     list_display = ('id', 'name', 'author', 'favorite_count',)
-    search_fields = ('author', 'name',)
+    list_select_related = ('author',)
+    search_fields = ('name', 'author__email', 'author__username',)
     list_filter = ('tags',)
+    autocomplete_fields = ('author',)
+    filter_horizontal = ('tags',)
+    inlines = (IngredientAmountInline,)
+    show_full_result_count = False
     empty_value_display = '-пусто-'
 
+    def get_queryset(self, request):
+        # Подзапрос считается только для строк текущей страницы,
+        # а не группировкой всей таблицы рецептов.
+        favorites = Favorite.objects.filter(
+            recipe=OuterRef('pk')
+        ).values('recipe').annotate(count=Count('id')).values('count')
+        return super().get_queryset(request).annotate(
+            favorite_total=Coalesce(
+                Subquery(favorites, output_field=IntegerField()), 0
+            )
+        )
+
+    @admin.display(
+        description='Количество добавлений в избранное',
+        ordering='favorite_total'
+    )
     def favorite_count(self, obj):
-        return Favorite.objects.filter(recipe=obj).count()
-
-    favorite_count.short_description = 'Количество добавлений в избранное'
+        return obj.favorite_total
 
 
 class ShoppingListAdmin(admin.ModelAdmin):
     """Админка для покупок."""
 
     list_display = ('author', 'recipe',)
-    search_fields = ('author',)
-    list_filter = ('author',)
+    list_select_related = ('author', 'recipe',)
+    search_fields = ('author__email', 'author__username', 'recipe__name',)
+    autocomplete_fields = ('author', 'recipe',)
+    show_full_result_count = False
     empty_value_display = '-пусто-'
 
 
@@ -73,16 +135,20 @@ class FollowerAdmin(admin.ModelAdmin):
     """Админка для подписок."""
 
     list_display = ('user', 'author',)
-    search_fields = ('user',)
-    list_filter = ('author',)
+    list_select_related = ('user', 'author',)
+    search_fields = ('user__email', 'user__username', 'author__username',)
+    autocomplete_fields = ('user', 'author',)
+    show_full_result_count = False
 
 
 class FavoriteAdmin(admin.ModelAdmin):
     """Админка для избранного."""
 
     list_display = ('author', 'recipe',)
-    search_fields = ('author',)
-    list_filter = ('author',)
+    list_select_related = ('author', 'recipe',)
+    search_fields = ('author__email', 'author__username', 'recipe__name',)
+    autocomplete_fields = ('author', 'recipe',)
+    show_full_result_count = False
 
 
 admin.site.register(User, UserAdmin)
@@ -0,0 +1,182 @@
+import json
+import random
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from faker import Faker
+
+from api.feed import fan_out
+from api.sync import number_pending
+from recipes.models import (User, Ingredient, Tag, Recipes, IngredientAmount,
+                            ShoppingList, Follower, Favorite)
+
+
+BATCH_SIZE = 1000
+TAGS = (
+    ('Завтрак', 'breakfast'),
+    ('Обед', 'lunch'),
+    ('Ужин', 'dinner'),
+    ('Десерт', 'dessert'),
+    ('Выпечка', 'bakery'),
+    ('Вегетарианское', 'vegetarian'),
+)
+
+
+class Command(BaseCommand):
+    """
+    Генерирует тестовый набор данных заданного размера:
+    пользователи, подписки, рецепты с 5–20 ингредиентами из
+    data/ingredients.json, теги, избранное и списки покупок.
+    """
+
+    help = 'Генерирует синтетические данные для нагрузочных замеров.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--follows', type=int, default=10,
+                            help='Подписок на пользователя.')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Избранных рецептов на пользователя.')
+        parser.add_argument('--cart', type=int, default=5,
+                            help='Рецептов в списке покупок пользователя.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('--users должно быть не меньше 1.')
+        for name in ('recipes', 'follows', 'favorites', 'cart'):
+            if options[name] < 0:
+                raise CommandError(f'--{name} не может быть отрицательным.')
+        self.random = random.Random(options['seed'])
+        self.fake = Faker('ru_RU')
+        self.fake.seed_instance(options['seed'])
+        ingredient_ids = self.load_ingredients()
+        tag_ids = self.create_tags()
+        user_ids = self.create_users(options['users'])
+        recipe_ids = self.create_recipes(
+            options['recipes'], user_ids, ingredient_ids, tag_ids
+        )
+        self.create_relations(user_ids, recipe_ids, options)
+        # Подписки и рецепты созданы bulk_create, ленты раскладываем сами.
+        fan_out(Recipes.objects.filter(author_id__in=user_ids).only(
+            'id', 'author_id'
+        ).iterator())
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: пользователей {len(user_ids)}, '
+            f'рецептов {len(recipe_ids)}'
+        ))
+
+    def load_ingredients(self):
+        if not Ingredient.objects.exists():
+            path = Path(settings.BASE_DIR) / 'data' / 'ingredients.json'
+            with open(path, encoding='utf-8') as source:
+                Ingredient.objects.bulk_create(
+                    (Ingredient(**item) for item in json.load(source)),
+                    batch_size=BATCH_SIZE
+                )
+        return list(Ingredient.objects.values_list('id', flat=True))
+
+    def create_tags(self):
+        for name, slug in TAGS:
+            Tag.objects.get_or_create(name=name, slug=slug)
+        return list(Tag.objects.values_list('id', flat=True))
+
+    def create_users(self, count):
+        offset = User.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first() or 0
+        # Хеширование пароля дорогое, один хеш на всех.
+        password = make_password('benchmark-password')
+        users = [
+            User(
+                email=f'user{offset + number}@example.com',
+                username=f'user{offset + number}',
+                first_name=self.fake.first_name(),
+                last_name=self.fake.last_name(),
+                password=password,
+            )
+            for number in range(1, count + 1)
+        ]
+        User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+        return list(
+            User.objects.filter(id__gt=offset).values_list('id', flat=True)
+        )
+
+    def create_recipes(self, count, user_ids, ingredient_ids, tag_ids):
+        offset = Recipes.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first() or 0
+        recipes = [
+            Recipes(
+                author_id=self.random.choice(user_ids),
+                name='{} #{}'.format(
+                    self.fake.sentence(nb_words=3).rstrip('.'),
+                    offset + number
+                ),
+                text=self.fake.paragraph(nb_sentences=5),
+                cooking_time=self.random.randint(5, 180),
+                image='media/placeholder.png',
+            )
+            for number in range(1, count + 1)
+        ]
+        Recipes.objects.bulk_create(recipes, batch_size=BATCH_SIZE)
+        transaction.on_commit(number_pending)
+        recipe_ids = list(
+            Recipes.objects.filter(id__gt=offset).values_list('id', flat=True)
+        )
+        amounts = []
+        recipe_tags = []
+        for recipe_id in recipe_ids:
+            for ingredient_id in self.random.sample(
+                ingredient_ids, self.random.randint(5, 20)
+            ):
+                amounts.append(IngredientAmount(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=self.random.randint(1, 500),
+                ))
+            for tag_id in self.random.sample(
+                tag_ids, self.random.randint(1, 3)
+            ):
+                recipe_tags.append(Recipes.tags.through(
+                    recipes_id=recipe_id, tag_id=tag_id
+                ))
+        IngredientAmount.objects.bulk_create(amounts, batch_size=BATCH_SIZE)
+        Recipes.tags.through.objects.bulk_create(
+            recipe_tags, batch_size=BATCH_SIZE
+        )
+        return recipe_ids
+
+    def sample(self, population, count, exclude=None):
+        chosen = self.random.sample(
+            population, min(count + 1, len(population))
+        )
+        return [item for item in chosen if item != exclude][:count]
+
+    def create_relations(self, user_ids, recipe_ids, options):
+        followers, favorites, carts = [], [], []
+        for user_id in user_ids:
+            followers.extend(
+                Follower(user_id=user_id, author_id=author_id)
+                for author_id in self.sample(
+                    user_ids, options['follows'], exclude=user_id
+                )
+            )
+            favorites.extend(
+                Favorite(author_id=user_id, recipe_id=recipe_id)
+                for recipe_id in self.sample(recipe_ids, options['favorites'])
+            )
+            carts.extend(
+                ShoppingList(author_id=user_id, recipe_id=recipe_id)
+                for recipe_id in self.sample(recipe_ids, options['cart'])
+            )
+        for model, objects in (
+            (Follower, followers), (Favorite, favorites),
+            (ShoppingList, carts)
+        ):
+            model.objects.bulk_create(objects, batch_size=BATCH_SIZE)
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.17 on 2026-10-19 10:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_file_name_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='sync_seq',
+            field=models.BigIntegerField(db_index=True, default=None, editable=False, null=True, verbose_name='Номер изменения'),
+        ),
+    ]
@@ -47,10 +47,12 @@ class User(AbstractUser):
     password = models.CharField(
         max_length=MAX,
         verbose_name='Пароль')
+    # Индекс: по имени файла считаются ссылки на него (api.storage).
     avatar = models.ImageField(
         upload_to='avatars/',
         null=True,
-        blank=True)
+        blank=True,
+        db_index=True)
     is_subscribed = models.BooleanField(
         default=False,
         help_text='Подписан ли текущий пользователь на этого')
@@ -130,9 +132,11 @@ class Recipes(models.Model):
         Tag,
         related_name='recipes',
         help_text='Выберите тег')
+    # Индекс: по имени файла считаются ссылки на него (api.storage).
     image = models.ImageField(
         upload_to='media/',
-        help_text='Добавьте изображение')
+        help_text='Добавьте изображение',
+        db_index=True)
     name = models.CharField(
         verbose_name='Название рецепта',
         max_length=256,
@@ -150,6 +154,14 @@ class Recipes(models.Model):
         on_delete=models.CASCADE,
         related_name='recipes',
         help_text='Автор рецепта')
+    # Номер последнего изменения для синхронизации клиентов (api.sync);
+    # NULL — изменение ждет номера после фиксации.
+    sync_seq = models.BigIntegerField(
+        verbose_name='Номер изменения',
+        null=True,
+        default=None,
+        db_index=True,
+        editable=False)
 
     class Meta:
         ordering = ['-id']
@@ -159,6 +171,10 @@ class Recipes(models.Model):
             models.UniqueConstraint(
                 fields=['name', 'author'],
                 name='unique_name_author')]
+        indexes = [
+            models.Index(
+                fields=['author', '-id'],
+                name='recipes_author_id_idx')]
     
     def __str__(self):
         return self.name
@@ -194,6 +210,12 @@ class IngredientAmount(models.Model):
             models.UniqueConstraint(
                 fields=['ingredient', 'recipe'],
                 name='unique_ingredient_recipe')]
+        indexes = [
+            # Покрывающий индекс: состав рецепта и список покупок
+            # читаются по recipe без обращения к таблице.
+            models.Index(
+                fields=['recipe', 'ingredient', 'amount'],
+                name='ingredientamount_recipe_idx')]
 
     def __str__(self):
         return f'{self.ingredient} {self.amount} для {self.recipe.name}'
@@ -221,6 +243,10 @@ class ShoppingList(models.Model):
             models.UniqueConstraint(
                 fields=['author', 'recipe'],
                 name='unique_shoppinglist')]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'author'],
+                name='shoppinglist_recipe_idx')]
 
     def __str__(self):
         return f'{self.recipe}'
@@ -248,6 +274,13 @@ class Follower(models.Model):
             models.UniqueConstraint(
                 fields=['user', 'author'],
                 name='unique_following')]
+        indexes = [
+            models.Index(
+                fields=['user', 'id'],
+                name='follower_user_id_idx'),
+            models.Index(
+                fields=['author', 'user'],
+                name='follower_author_user_idx')]
 
     def __str__(self):
         return f'{self.user} подписан на {self.author}'
@@ -273,6 +306,50 @@ class Favorite(models.Model):
             models.UniqueConstraint(
                 fields=['author', 'recipe'],
                 name='unique_favorite')]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'author'],
+                name='favorite_recipe_idx')]
 
     def __str__(self):
         return f'{self.recipe}'
+
+
+class FeedEntry(models.Model):
+    """
+    Лента подписок: рецепт автора в ленте подписчика.
+    Заполняется при создании рецепта и при подписке.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Подписчик',
+        related_name='feed')
+    recipe = models.ForeignKey(
+        Recipes,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='feed_entries')
+    # Автор рецепта, чтобы чистить ленту при отписке без соединения.
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Автор рецепта',
+        related_name='+')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        constraints = [
+            # Ключ (user, recipe) отдает ленту одним диапазоном индекса.
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry')]
+        indexes = [
+            models.Index(
+                fields=['user', 'author'],
+                name='feedentry_user_author_idx')]
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'